@@ -243,6 +243,7 @@ import (
 	obot_memory_request?: string & !=""         // Memory request (default: 1Gi)
 	obot_memory_limit?: string & !=""           // Memory limit (default: 4Gi)
 	obot_encryption_provider?: *"custom" | "azure-keyvault" | "aws-kms" | "gcp-kms"  // Encryption provider
+	obot_use_ai_gateway?: *true | bool          // Route LLM requests through the AI gateway
 	obot_use_agentgateway?: *false | bool       // Use agentgateway for LLM requests with rate limiting, prompt guards, FinOps
 
 	// obot S3/MinIO Workspace Storage (enables multi-replica scaling)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# Encrypt the rendered `*.sops.*` files with SOPS. Files are encrypted by a bounded pool of sops
+# processes. When a file's plaintext is the same as the last time it was encrypted, the previous
+# ciphertext is restored instead, so unchanged secrets keep their ciphertext and do not show up
+# in git diffs or trigger Flux reconciliations.
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+STATE_VERSION = 1
+# Metadata sops adds to encrypted YAML, JSON and dotenv files
+ENCRYPTED = re.compile(rb'^sops:\s*$|"sops":\s*\{|^sops_mac=', re.MULTILINE)
+
+
+def log(message: str) -> None:
+    print(message, flush=True)
+
+
+def sha256(value: bytes) -> str:
+    return hashlib.sha256(value).hexdigest()
+
+
+# Return True if a file already carries sops metadata
+def is_encrypted(content: bytes) -> bool:
+    return ENCRYPTED.search(content) is not None
+
+
+# Return the `*.sops.*` files below the given directories
+def find_secrets(directories: list[Path]) -> list[str]:
+    return sorted(
+        os.path.relpath(path)
+        for directory in directories
+        if directory.is_dir()
+        for path in directory.rglob("*.sops.*")
+        if path.is_file()
+    )
+
+
+# Return the secret files written by the last render, if the render recorded them
+def rendered_secrets(rendered_file: Path) -> list[str] | None:
+    try:
+        return [os.path.relpath(path) for path in json.loads(rendered_file.read_text())]
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def load_state(state_file: Path) -> dict[str, dict[str, str]]:
+    try:
+        state = json.loads(state_file.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if state.get("version") != STATE_VERSION:
+        return {}
+    return state.get("files", {})
+
+
+def save_state(state_file: Path, files: dict[str, dict[str, str]]) -> None:
+    state_file.parent.mkdir(parents=True, exist_ok=True)
+    state = {"version": STATE_VERSION, "files": dict(sorted(files.items()))}
+    tmp_file = state_file.with_suffix(".tmp")
+    tmp_file.write_text(json.dumps(state, indent=2) + "\n")
+    tmp_file.replace(state_file)
+
+
+# Encrypt a file in place, returning an error message if sops failed
+def encrypt(path: str) -> str | None:
+    result = subprocess.run(
+        ["sops", "--encrypt", "--in-place", path], capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return result.stderr.strip() or f"sops exited with {result.returncode}"
+    return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Encrypt the rendered secrets with SOPS")
+    parser.add_argument(
+        "directories", type=Path, nargs="+", help="directories containing *.sops.* files"
+    )
+    parser.add_argument(
+        "--rendered",
+        type=Path,
+        default=Path(".cache/render/secrets.json"),
+        help="list of secret files written by the render (default: .cache/render/secrets.json)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=Path(".cache/sops"),
+        help="directory for the ciphertext cache and state (default: .cache/sops)",
+    )
+    parser.add_argument(
+        "--sops-config",
+        type=Path,
+        default=Path(".sops.yaml"),
+        help="sops configuration, a change re-encrypts every secret (default: .sops.yaml)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=min(8, os.cpu_count() or 1),
+        help="number of concurrent sops processes (default: number of CPUs, at most 8)",
+    )
+    args = parser.parse_args()
+
+    state_file = args.cache_dir / "state.json"
+    ciphertext_dir = args.cache_dir / "ciphertext"
+    state = load_state(state_file)
+    config_digest = sha256(args.sops_config.read_bytes()) if args.sops_config.is_file() else ""
+
+    # Only the secrets written by the render need work. Secrets the render did not touch were
+    # encrypted by an earlier run, unless they are unknown, e.g. left over from an interrupted
+    # run; those are checked for sops metadata without starting a sops process.
+    rendered = rendered_secrets(args.rendered)
+    secrets = find_secrets(args.directories)
+    candidates = [
+        path
+        for path in secrets
+        if rendered is None or path in rendered or path not in state
+    ]
+
+    pending: dict[str, dict[str, str]] = {}
+    restored = 0
+    for path in candidates:
+        content = Path(path).read_bytes()
+        if is_encrypted(content):
+            continue
+        plaintext = sha256(content)
+        key = sha256(f"{config_digest}\n{path}\n{plaintext}".encode("utf-8"))
+        cached = ciphertext_dir / key
+        if cached.is_file():
+            ciphertext = cached.read_bytes()
+            Path(path).write_bytes(ciphertext)
+            state[path] = {"plaintext": plaintext, "ciphertext": sha256(ciphertext), "key": key}
+            restored += 1
+        else:
+            pending[path] = {"plaintext": plaintext, "key": key}
+
+    log(
+        f"=== Encrypting {len(pending)} secrets, restored {restored} unchanged, "
+        f"{len(secrets) - len(pending) - restored} already encrypted ==="
+    )
+    errors: dict[str, str] = {}
+    ciphertext_dir.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max(1, args.workers)) as pool:
+        for path, error in zip(pending, pool.map(encrypt, pending)):
+            if error:
+                errors[path] = error
+                continue
+            ciphertext = Path(path).read_bytes()
+            (ciphertext_dir / pending[path]["key"]).write_bytes(ciphertext)
+            state[path] = {**pending[path], "ciphertext": sha256(ciphertext)}
+
+    # Forget secrets that are no longer rendered and their cached ciphertext
+    state = {path: entry for path, entry in state.items() if path in secrets}
+    keys = {entry["key"] for entry in state.values()}
+    for cached in ciphertext_dir.iterdir():
+        if cached.name not in keys:
+            cached.unlink()
+    save_state(state_file, state)
+
+    for path, error in sorted(errors.items()):
+        log(f"Failed to encrypt {path}: {error}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
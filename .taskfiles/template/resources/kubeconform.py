@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# Validate the rendered Kubernetes manifests with kubeconform. Kustomizations are built across a
+# pool of workers and every document goes through a single kubeconform run with a persistent
+# schema cache, so a warm cache also works offline. Kustomizations whose input files are
+# unchanged since the last successful run are skipped.
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+
+STATE_VERSION = 1
+KUSTOMIZE_ARGS = ["--load-restrictor=LoadRestrictionsNone"]
+KUBECONFORM_ARGS = [
+    "-strict",
+    "-ignore-missing-schemas",
+    "-skip",
+    "Gateway,HTTPRoute,Secret",
+    "-schema-location",
+    "default",
+    "-schema-location",
+    "https://kubernetes-schemas.pages.dev/{{.Group}}/{{.ResourceKind}}_{{.ResourceAPIVersion}}.json",
+]
+# Relative references leaving a kustomization directory, e.g. `- ../../components/sops`
+PARENT_REFERENCE = re.compile(r"""(?:^|[\s"'])(\.\./[^\s"'#,\]]+)""", re.MULTILINE)
+
+
+class Target(NamedTuple):
+    # Path of the standalone manifest or kustomization directory, relative to the kubernetes dir
+    name: str
+    path: Path
+    is_kustomization: bool
+
+
+def log(message: str) -> None:
+    print(message, flush=True)
+
+
+# Return the standalone manifests in flux/ and every kustomization in flux/ and apps/
+def find_targets(kubernetes_dir: Path) -> list[Target]:
+    targets = [
+        Target(str(path.relative_to(kubernetes_dir)), path, False)
+        for path in sorted((kubernetes_dir / "flux").glob("*.yaml"))
+        if path.is_file()
+    ]
+    for subdir in ("flux", "apps"):
+        for kustomization in sorted((kubernetes_dir / subdir).rglob("kustomization.yaml")):
+            path = kustomization.parent
+            targets.append(Target(str(path.relative_to(kubernetes_dir)), path, True))
+    return targets
+
+
+# Return the files under a path (or the path itself), sorted
+def tree_files(path: Path) -> list[Path]:
+    if path.is_file():
+        return [path]
+    return sorted(f for f in path.rglob("*") if f.is_file())
+
+
+# Return a digest of a target's inputs: its own files and anything its kustomizations reference
+# outside the directory, such as the shared components
+def input_digest(target: Target, tool_digest: str) -> str:
+    paths = set(tree_files(target.path))
+    if target.is_kustomization:
+        for kustomization in [f for f in paths if f.name == "kustomization.yaml"]:
+            for reference in PARENT_REFERENCE.findall(kustomization.read_text()):
+                referenced = (kustomization.parent / reference).resolve()
+                if referenced.exists() and not referenced.is_relative_to(target.path.resolve()):
+                    paths.update(tree_files(referenced))
+
+    digest = hashlib.sha256(tool_digest.encode("utf-8"))
+    for path in sorted(paths):
+        digest.update(f"\n{path}\n".encode("utf-8"))
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+# Return a digest of the tool versions and arguments, so upgrading them revalidates everything
+def tools_digest() -> str:
+    versions = [
+        subprocess.run(command, capture_output=True, text=True).stdout.strip()
+        for command in (["kustomize", "version"], ["kubeconform", "-v"])
+    ]
+    parts = [str(STATE_VERSION), *versions, *KUSTOMIZE_ARGS, *KUBECONFORM_ARGS]
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def load_state(state_file: Path, tool_digest: str) -> dict[str, str]:
+    try:
+        state = json.loads(state_file.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if state.get("version") != STATE_VERSION or state.get("tools") != tool_digest:
+        return {}
+    return state.get("targets", {})
+
+
+def save_state(state_file: Path, tool_digest: str, targets: dict[str, str]) -> None:
+    state_file.parent.mkdir(parents=True, exist_ok=True)
+    state = {"version": STATE_VERSION, "tools": tool_digest, "targets": dict(sorted(targets.items()))}
+    tmp_file = state_file.with_suffix(".tmp")
+    tmp_file.write_text(json.dumps(state, indent=2) + "\n")
+    tmp_file.replace(state_file)
+
+
+# Build a kustomization into a file, returning an error message if kustomize failed
+def build(target: Target, output: Path) -> str | None:
+    result = subprocess.run(
+        ["kustomize", "build", str(target.path), *KUSTOMIZE_ARGS],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return result.stderr.strip() or f"kustomize build exited with {result.returncode}"
+    output.write_text(result.stdout)
+    return None
+
+
+# Run kubeconform once over all files, returning the failure messages keyed by file
+def kubeconform(files: list[Path], cache_dir: Path, workers: int) -> dict[str, list[str]]:
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    result = subprocess.run(
+        [
+            "kubeconform",
+            *KUBECONFORM_ARGS,
+            "-cache",
+            str(cache_dir),
+            "-n",
+            str(workers),
+            "-output",
+            "json",
+            *map(str, files),
+        ],
+        capture_output=True,
+        text=True,
+    )
+    try:
+        resources = json.loads(result.stdout).get("resources") or []
+    except json.JSONDecodeError:
+        raise RuntimeError(result.stderr.strip() or result.stdout.strip() or "kubeconform failed")
+
+    failures: dict[str, list[str]] = {}
+    for resource in resources:
+        if resource.get("status") in ("statusInvalid", "statusError"):
+            kind, name = resource.get("kind", ""), resource.get("name", "")
+            message = f"{kind} {name}: {resource.get('msg', '')}".strip()
+            failures.setdefault(resource.get("filename", ""), []).append(message)
+    if result.returncode != 0 and not failures:
+        raise RuntimeError(result.stderr.strip() or "kubeconform failed")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Validate the rendered Kubernetes manifests with kubeconform"
+    )
+    parser.add_argument("kubernetes_dir", type=Path, help="rendered kubernetes directory")
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=Path(".cache/kubeconform"),
+        help="directory for the schema cache, builds and state (default: .cache/kubeconform)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of parallel kustomize builds and kubeconform workers (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="validate everything, ignoring the last run"
+    )
+    args = parser.parse_args()
+
+    kubernetes_dir: Path = args.kubernetes_dir
+    if not kubernetes_dir.is_dir():
+        log(f"Kubernetes location not found: {kubernetes_dir}")
+        return 1
+
+    state_file = args.cache_dir / "state.json"
+    builds_dir = args.cache_dir / "builds"
+    shutil.rmtree(builds_dir, ignore_errors=True)
+    builds_dir.mkdir(parents=True)
+
+    tool_digest = tools_digest()
+    previous = {} if args.force else load_state(state_file, tool_digest)
+    targets = find_targets(kubernetes_dir)
+    digests = {target.name: input_digest(target, tool_digest) for target in targets}
+    changed = [target for target in targets if previous.get(target.name) != digests[target.name]]
+    log(f"=== Validating {len(changed)} of {len(targets)} manifests and kustomizations ===")
+
+    # Build the changed kustomizations in parallel, standalone manifests are validated as they are
+    files: dict[str, Path] = {}
+    errors: dict[str, list[str]] = {}
+    kustomizations = [target for target in changed if target.is_kustomization]
+    outputs = [builds_dir / f"{index:04d}.yaml" for index in range(len(kustomizations))]
+    with ThreadPoolExecutor(max(1, args.workers)) as pool:
+        results = pool.map(build, kustomizations, outputs)
+        for target, output, error in zip(kustomizations, outputs, results):
+            if error:
+                errors[target.name] = [error]
+            else:
+                files[target.name] = output
+    for target in changed:
+        if not target.is_kustomization:
+            files[target.name] = target.path
+
+    if files:
+        by_file = {str(path): name for name, path in files.items()}
+        try:
+            failures = kubeconform(list(files.values()), args.cache_dir / "schemas", args.workers)
+        except RuntimeError as e:
+            log(f"kubeconform failed: {e}")
+            return 1
+        for filename, messages in failures.items():
+            errors.setdefault(by_file.get(filename, filename), []).extend(messages)
+
+    # Remember everything that passed, including targets that were unchanged and still exist
+    passed = {
+        target.name: digests[target.name]
+        for target in targets
+        if target.name not in errors
+    }
+    save_state(state_file, tool_digest, passed)
+    shutil.rmtree(builds_dir, ignore_errors=True)
+
+    for name, messages in sorted(errors.items()):
+        log(f"=== {name} is invalid ===")
+        for message in messages:
+            log(f"  {message}")
+    if errors:
+        log(f"=== {len(errors)} of {len(changed)} validated manifests and kustomizations failed ===")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
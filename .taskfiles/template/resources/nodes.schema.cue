@@ -27,6 +27,9 @@ import (
 	// Node labels for Kubernetes (used for CSI topology, etc.)
 	// Example: {"topology.kubernetes.io/region": "talos-k8s", "topology.kubernetes.io/zone": "pve-node-01"}
 	nodeLabels?: {[string]: string}
+	// Allocatable CPU cores and memory, only used by the capacity planner (task template:capacity)
+	cpu?:    number & >0
+	memory?: =~"^[0-9]+(\\.[0-9]+)?(Ki|Mi|Gi|Ti|k|M|G|T)?$"
 }
 
 #Config
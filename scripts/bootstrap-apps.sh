@@ -23,9 +23,9 @@ function wait_for_nodes() {
     done
 }
 
-# Namespaces to be applied before the SOPS secrets are installed
-function apply_namespaces() {
-    log debug "Applying namespaces"
+# Namespaces and SOPS secrets to be applied before the helmfile charts are installed
+function apply_namespaces_and_secrets() {
+    log debug "Applying namespaces and secrets"
 
     local -r apps_dir="${ROOT_DIR}/kubernetes/apps"
 
@@ -33,55 +33,18 @@ function apply_namespaces() {
         log error "Directory does not exist" "directory=${apps_dir}"
     fi
 
-    for app in "${apps_dir}"/*/; do
-        namespace=$(basename "${app}")
-
-        # Check if the namespace resources are up-to-date
-        if kubectl get namespace "${namespace}" &>/dev/null; then
-            log info "Namespace resource is up-to-date" "resource=${namespace}"
-            continue
-        fi
-
-        # Apply the namespace resources
-        if kubectl create namespace "${namespace}" --dry-run=client --output=yaml \
-            | kubectl apply --server-side --filename - &>/dev/null;
-        then
-            log info "Namespace resource applied" "resource=${namespace}"
-        else
-            log error "Failed to apply namespace resource" "resource=${namespace}"
-        fi
-    done
-}
-
-# SOPS secrets to be applied before the helmfile charts are installed
-function apply_sops_secrets() {
-    log debug "Applying secrets"
-
     local -r secrets=(
         "${ROOT_DIR}/bootstrap/github-deploy-key.sops.yaml"
         "${ROOT_DIR}/bootstrap/sops-age.sops.yaml"
         "${ROOT_DIR}/kubernetes/components/sops/cluster-secrets.sops.yaml"
     )
 
-    for secret in "${secrets[@]}"; do
-        if [ ! -f "${secret}" ]; then
-            log warn "File does not exist" "file=${secret}"
-            continue
-        fi
-
-        # Check if the secret resources are up-to-date
-        if sops exec-file "${secret}" "kubectl --namespace flux-system diff --filename {}" &>/dev/null; then
-            log info "Secret resource is up-to-date" "resource=$(basename "${secret}" ".sops.yaml")"
-            continue
-        fi
-
-        # Apply secret resources
-        if sops exec-file "${secret}" "kubectl --namespace flux-system apply --server-side --filename {}" &>/dev/null; then
-            log info "Secret resource applied successfully" "resource=$(basename "${secret}" ".sops.yaml")"
-        else
-            log error "Failed to apply secret resource" "resource=$(basename "${secret}" ".sops.yaml")"
-        fi
-    done
+    # Diffed against the live objects and applied in one batch, see bootstrap_apply.py
+    if ! python "${ROOT_DIR}/scripts/bootstrap_apply.py" --apps-dir "${apps_dir}" "${secrets[@]}"; then
+        log error "Failed to apply namespaces and secrets"
+    fi
+
+    log info "Namespaces and secrets are up-to-date"
 }
 
 # Gateway API CRDs from kubernetes-sigs (required for kgateway/agentgateway)
@@ -172,12 +135,11 @@ function sync_helm_releases() {
 
 function main() {
     check_env KUBECONFIG TALOSCONFIG
-    check_cli helmfile kubectl kustomize sops talhelper yq
+    check_cli helmfile kubectl kustomize python sops talhelper yq
 
     # Apply resources and Helm releases
     wait_for_nodes
-    apply_namespaces
-    apply_sops_secrets
+    apply_namespaces_and_secrets
     apply_gateway_api_crds  # kubernetes-sigs Gateway API CRDs (before helmfile CRDs)
     apply_crds              # Helm chart CRDs (kgateway-crds, etc.)
     sync_helm_releases
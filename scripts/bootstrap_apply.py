@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# Apply the namespaces and SOPS secrets needed before the helmfile charts are installed. Every
+# Namespace and decrypted Secret is built in memory, compared against the live objects fetched
+# with one list request per namespace, and only the missing or changed objects are submitted as
+# server-side applies over a small pool of keep-alive connections to the API server: first the
+# Namespaces, then the Secrets.
+
+import argparse
+import base64
+import http.client
+import json
+import queue
+import ssl
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+from urllib.parse import quote, urlencode, urlsplit
+
+# Same field manager as `kubectl apply --server-side`, so objects applied by the earlier shell
+# implementation keep a single owner
+FIELD_MANAGER = "kubectl"
+SECRETS_NAMESPACE = "flux-system"
+
+Object = dict[str, Any]
+
+
+class ApiError(Exception):
+    pass
+
+
+def log(message: str) -> None:
+    print(message, flush=True)
+
+
+# A client for the Kubernetes API that keeps up to `connections` HTTP connections open and
+# reuses them for every request
+class ApiClient:
+    def __init__(
+        self,
+        server: str,
+        headers: dict[str, str] | None = None,
+        context: ssl.SSLContext | None = None,
+        connections: int = 4,
+    ):
+        url = urlsplit(server)
+        if url.scheme not in ("http", "https") or not url.hostname:
+            raise ApiError(f"Unsupported API server URL: {server}")
+        self._url = url
+        self._headers = {"Accept": "application/json", **(headers or {})}
+        self._context = context
+        self._idle: queue.LifoQueue[http.client.HTTPConnection | None] = queue.LifoQueue()
+        for _ in range(connections):
+            self._idle.put(None)
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self._url.scheme == "https":
+            return http.client.HTTPSConnection(
+                self._url.hostname, self._url.port, timeout=30, context=self._context
+            )
+        return http.client.HTTPConnection(self._url.hostname, self._url.port, timeout=30)
+
+    # Send a request and return the decoded JSON response, retrying once on a connection
+    # the server closed while it was idle
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: Object | None = None,
+        content_type: str = "application/json",
+        params: dict[str, str] | None = None,
+    ) -> Object:
+        target = self._url.path.rstrip("/") + path + (f"?{urlencode(params)}" if params else "")
+        headers = dict(self._headers)
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = content_type
+
+        connection = self._idle.get()
+        try:
+            for attempt in range(2):
+                connection = connection or self._connect()
+                try:
+                    connection.request(method, target, payload, headers)
+                    response = connection.getresponse()
+                    data = response.read()
+                    break
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    connection.close()
+                    connection = None
+                    if attempt:
+                        raise
+        except (OSError, http.client.HTTPException) as e:
+            if connection is not None:
+                connection.close()
+                connection = None
+            raise ApiError(f"{method} {path}: {e}") from e
+        finally:
+            self._idle.put(connection)
+
+        try:
+            result = json.loads(data) if data else {}
+        except json.JSONDecodeError:
+            result = {}
+        if response.status >= 400:
+            message = result.get("message") or data.decode("utf-8", "replace").strip()
+            raise ApiError(f"{method} {path}: {response.status} {message}")
+        return result
+
+    def close(self) -> None:
+        while not self._idle.empty():
+            connection = self._idle.get_nowait()
+            if connection is not None:
+                connection.close()
+
+
+# Return a client for the current context of the kubeconfig, as resolved by kubectl. The
+# credentials are written to a temporary directory, which must outlive the client's connections.
+def client_from_kubeconfig(credentials_dir: Path, connections: int) -> ApiClient:
+    result = subprocess.run(
+        ["kubectl", "config", "view", "--minify", "--raw", "--output", "json"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise ApiError(f"Failed to read the kubeconfig: {result.stderr.strip()}")
+    kubeconfig = json.loads(result.stdout)
+    try:
+        cluster = kubeconfig["clusters"][0]["cluster"]
+        user = kubeconfig["users"][0]["user"]
+    except (KeyError, IndexError) as e:
+        raise ApiError("The kubeconfig has no current context") from e
+
+    def credential(name: str) -> str | None:
+        if data := cluster.get(f"{name}-data") or user.get(f"{name}-data"):
+            path = credentials_dir / name
+            path.write_bytes(base64.b64decode(data))
+            return str(path)
+        return cluster.get(name) or user.get(name)
+
+    context = ssl.create_default_context(cafile=credential("certificate-authority"))
+    if cluster.get("insecure-skip-tls-verify"):
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    if certificate := credential("client-certificate"):
+        context.load_cert_chain(certificate, credential("client-key"))
+
+    headers = {}
+    if token := user.get("token"):
+        headers["Authorization"] = f"Bearer {token}"
+    elif "exec" in user or "auth-provider" in user:
+        raise ApiError("Exec and auth-provider credentials are not supported, use kubectl proxy")
+    return ApiClient(cluster["server"], headers, context, connections)
+
+
+# Return a Namespace for every directory below the apps directory
+def desired_namespaces(apps_dir: Path) -> list[Object]:
+    return [
+        {"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": path.name}}
+        for path in sorted(apps_dir.iterdir())
+        if path.is_dir()
+    ]
+
+
+# Decrypt a SOPS file and return the documents it contains
+def decrypt(path: Path) -> list[Object]:
+    sops = subprocess.run(["sops", "--decrypt", str(path)], capture_output=True)
+    if sops.returncode != 0:
+        raise ApiError(f"Failed to decrypt {path}: {sops.stderr.decode().strip()}")
+    yq = subprocess.run(
+        ["yq", "eval-all", "--output-format", "json", "--indent", "0", "[.]", "-"],
+        input=sops.stdout,
+        capture_output=True,
+    )
+    if yq.returncode != 0:
+        raise ApiError(f"Failed to parse {path}: {yq.stderr.decode().strip()}")
+    return [document for document in json.loads(yq.stdout) if isinstance(document, dict)]
+
+
+# Return a Secret's data with its stringData merged in, as the API server stores it
+def secret_data(secret: Object) -> dict[str, str]:
+    data = dict(secret.get("data") or {})
+    for key, value in (secret.get("stringData") or {}).items():
+        data[key] = base64.b64encode(str(value).encode("utf-8")).decode("ascii")
+    return data
+
+
+# Return True if the live object already matches the desired one
+def is_up_to_date(desired: Object, live: Object | None) -> bool:
+    if live is None:
+        return False
+    if desired["kind"] != "Secret":
+        return True
+    for field in ("labels", "annotations"):
+        wanted = desired["metadata"].get(field) or {}
+        current = live["metadata"].get(field) or {}
+        if any(current.get(key) != value for key, value in wanted.items()):
+            return False
+    return (
+        live.get("type", "Opaque") == desired.get("type", "Opaque")
+        and (live.get("data") or {}) == secret_data(desired)
+    )
+
+
+def resource_path(obj: Object) -> str:
+    name = quote(obj["metadata"]["name"], safe="")
+    if obj["kind"] == "Namespace":
+        return f"/api/v1/namespaces/{name}"
+    namespace = quote(obj["metadata"]["namespace"], safe="")
+    return f"/api/v1/namespaces/{namespace}/secrets/{name}"
+
+
+def describe(obj: Object) -> str:
+    metadata = obj["metadata"]
+    if obj["kind"] == "Namespace":
+        return f"namespace/{metadata['name']}"
+    return f"secret/{metadata['namespace']}/{metadata['name']}"
+
+
+# Return the live namespaces and secrets that match the desired objects, with one list request
+# for the namespaces and one per namespace holding secrets
+def live_objects(
+    client: ApiClient, pool: ThreadPoolExecutor, desired: list[Object]
+) -> dict[str, Object]:
+    secret_namespaces = sorted(
+        {obj["metadata"]["namespace"] for obj in desired if obj["kind"] == "Secret"}
+    )
+    requests = ["/api/v1/namespaces"] + [
+        f"/api/v1/namespaces/{quote(namespace, safe='')}/secrets"
+        for namespace in secret_namespaces
+    ]
+    live: dict[str, Object] = {}
+    results = pool.map(lambda path: client.request("GET", path), requests)
+    for path, result in zip(requests, results):
+        kind = "Namespace" if path == "/api/v1/namespaces" else "Secret"
+        for item in result.get("items") or []:
+            live[describe({"kind": kind, **item})] = item
+    return live
+
+
+# Server-side apply an object, returning an error message if the API server rejected it
+def apply(client: ApiClient, obj: Object) -> str | None:
+    try:
+        client.request(
+            "PATCH",
+            resource_path(obj),
+            obj,
+            content_type="application/apply-patch+yaml",
+            params={"fieldManager": FIELD_MANAGER},
+        )
+    except ApiError as e:
+        return str(e)
+    return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Apply the app namespaces and the SOPS secrets with server-side apply"
+    )
+    parser.add_argument("secrets", type=Path, nargs="*", help="SOPS encrypted secret files")
+    parser.add_argument(
+        "--apps-dir",
+        type=Path,
+        default=Path("kubernetes/apps"),
+        help="directory with one directory per namespace (default: kubernetes/apps)",
+    )
+    parser.add_argument(
+        "--server",
+        help="API server URL to use without credentials, e.g. from kubectl proxy "
+        "(default: the current kubeconfig context)",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=4,
+        help="number of concurrent API server connections (default: 4)",
+    )
+    args = parser.parse_args()
+
+    if not args.apps_dir.is_dir():
+        log(f"Directory does not exist: {args.apps_dir}")
+        return 1
+    secret_files = []
+    for path in args.secrets:
+        if path.is_file():
+            secret_files.append(path)
+        else:
+            log(f"File does not exist, skipping: {path}")
+
+    connections = max(1, args.connections)
+    with (
+        tempfile.TemporaryDirectory(prefix="bootstrap-") as credentials_dir,
+        ThreadPoolExecutor(connections) as pool,
+    ):
+        try:
+            desired = desired_namespaces(args.apps_dir)
+            for documents in pool.map(decrypt, secret_files):
+                for document in documents:
+                    metadata = document.setdefault("metadata", {})
+                    metadata.setdefault("namespace", SECRETS_NAMESPACE)
+                    desired.append(document)
+
+            if args.server:
+                client = ApiClient(args.server, connections=connections)
+            else:
+                client = client_from_kubeconfig(Path(credentials_dir), connections)
+            try:
+                live = live_objects(client, pool, desired)
+                pending = [
+                    obj for obj in desired if not is_up_to_date(obj, live.get(describe(obj)))
+                ]
+                log(
+                    f"=== Applying {len(pending)} resources, "
+                    f"{len(desired) - len(pending)} up-to-date ==="
+                )
+                # Namespaces are applied, and waited for, before the Secrets that go into them
+                errors: dict[str, str] = {}
+                for phase in (
+                    [obj for obj in pending if obj["kind"] == "Namespace"],
+                    [obj for obj in pending if obj["kind"] != "Namespace"],
+                ):
+                    results = pool.map(lambda obj: apply(client, obj), phase)
+                    errors.update(
+                        (describe(obj), error) for obj, error in zip(phase, results) if error
+                    )
+            finally:
+                client.close()
+        except ApiError as e:
+            log(str(e))
+            return 1
+
+    for obj in pending:
+        if describe(obj) not in errors:
+            log(f"Applied {describe(obj)}")
+    for name, error in sorted(errors.items()):
+        log(f"Failed to apply {name}: {error}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
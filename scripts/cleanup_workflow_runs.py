@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# Delete GitHub Actions workflow runs in bulk. Runs are listed page by page from the workflow
+# runs API, filtered by status, workflow and age on the server where the API allows it, and
+# deleted by a bounded pool of workers sharing a few keep-alive connections. Every response
+# updates the rate limit budget; workers pause once it runs out, and retry after the delay
+# GitHub asks for on rate limit and server errors.
+
+import argparse
+import http.client
+import json
+import os
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any
+from urllib.parse import quote, urlencode, urlsplit
+
+API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+STATUSES = ("failure", "cancelled", "timed_out", "skipped", "stale")
+PER_PAGE = 100
+# The runs API returns at most this many runs per query, older runs need a narrower query
+QUERY_RESULT_LIMIT = 1000
+MAX_ATTEMPTS = 5
+# GitHub asks to wait at least a minute after a secondary rate limit without a retry-after
+SECONDARY_RATE_LIMIT_DELAY = 60.0
+DURATION = re.compile(r"^(\d+)([hdw])$")
+DURATION_UNITS = {"h": "hours", "d": "days", "w": "weeks"}
+NEXT_LINK = re.compile(r'<([^>]+)>;\s*rel="next"')
+
+Run = dict[str, Any]
+
+
+class ApiError(Exception):
+    pass
+
+
+def log(message: str) -> None:
+    print(message, flush=True)
+
+
+def parse_duration(value: str) -> timedelta:
+    match = DURATION.match(value)
+    if not match:
+        raise argparse.ArgumentTypeError(f"expected a duration like 12h, 30d or 4w, got {value!r}")
+    return timedelta(**{DURATION_UNITS[match.group(2)]: int(match.group(1))})
+
+
+# A client for the GitHub REST API that keeps up to `connections` HTTP connections open and
+# reuses them for every request. The rate limit budget is shared by every thread using it.
+class GitHubClient:
+    def __init__(self, api_url: str, token: str | None, connections: int = 8):
+        url = urlsplit(api_url)
+        if url.scheme not in ("http", "https") or not url.hostname:
+            raise ApiError(f"Unsupported API URL: {api_url}")
+        self._url = url
+        self._headers = {
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28",
+            "User-Agent": "cleanup-workflow-runs",
+        }
+        if token:
+            self._headers["Authorization"] = f"Bearer {token}"
+        self._reserve = connections
+        self._idle: queue.LifoQueue[http.client.HTTPConnection | None] = queue.LifoQueue()
+        for _ in range(connections):
+            self._idle.put(None)
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self._url.scheme == "https":
+            return http.client.HTTPSConnection(self._url.hostname, self._url.port, timeout=30)
+        return http.client.HTTPConnection(self._url.hostname, self._url.port, timeout=30)
+
+    def _pause(self, seconds: float, reason: str) -> None:
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self._paused_until:
+                self._paused_until = until
+                log(f"{reason}, pausing for {seconds:.0f}s")
+
+    def _wait(self) -> None:
+        with self._lock:
+            delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    # Record the budget left in this rate limit window, pausing every request until the window
+    # resets once only the in-flight requests are left
+    def _track_rate_limit(self, headers: http.client.HTTPMessage) -> None:
+        remaining, reset = headers.get("x-ratelimit-remaining"), headers.get("x-ratelimit-reset")
+        if remaining is None or reset is None or not remaining.isdigit():
+            return
+        if int(remaining) <= self._reserve:
+            self._pause(max(0.0, float(reset) - time.time()) + 1, "Rate limit budget used up")
+
+    # Return how long to wait before retrying a failed request, or None if it should not be
+    # retried
+    def _retry_delay(
+        self, status: int, headers: http.client.HTTPMessage, message: str, attempt: int
+    ) -> float | None:
+        if status in (403, 429):
+            if retry_after := headers.get("retry-after"):
+                return float(retry_after) if retry_after.isdigit() else SECONDARY_RATE_LIMIT_DELAY
+            if headers.get("x-ratelimit-remaining") == "0" and headers.get("x-ratelimit-reset"):
+                return max(0.0, float(headers["x-ratelimit-reset"]) - time.time()) + 1
+            if status == 429 or "rate limit" in message.lower():
+                return SECONDARY_RATE_LIMIT_DELAY * 2**attempt
+            return None
+        if status >= 500:
+            return 2.0**attempt
+        return None
+
+    def _send(self, method: str, target: str) -> tuple[int, http.client.HTTPMessage, bytes]:
+        connection = self._idle.get()
+        try:
+            for attempt in range(2):
+                connection = connection or self._connect()
+                try:
+                    connection.request(method, target, headers=self._headers)
+                    response = connection.getresponse()
+                    return response.status, response.headers, response.read()
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    # The server closed a connection that was idle, try once on a new one
+                    connection.close()
+                    connection = None
+                    if attempt:
+                        raise
+            raise ApiError(f"{method} {target}: no response")
+        except (OSError, http.client.HTTPException) as e:
+            if connection is not None:
+                connection.close()
+                connection = None
+            raise ApiError(f"{method} {target}: {e}") from e
+        finally:
+            self._idle.put(connection)
+
+    # Send a request and return the decoded JSON response and the URL of the next page.
+    # `path` may also be an absolute URL on the API host, like the page links.
+    def request(
+        self, method: str, path: str, params: dict[str, str] | None = None
+    ) -> tuple[Any, str | None]:
+        url = urlsplit(path)
+        target = url.path if url.scheme else self._url.path.rstrip("/") + url.path
+        query = "&".join(part for part in (url.query, urlencode(params or {})) if part)
+        target += f"?{query}" if query else ""
+        for attempt in range(MAX_ATTEMPTS):
+            self._wait()
+            status, headers, data = self._send(method, target)
+            self._track_rate_limit(headers)
+            try:
+                result = json.loads(data) if data else {}
+            except json.JSONDecodeError:
+                result = {}
+            if status < 400:
+                link = NEXT_LINK.search(headers.get("link") or "")
+                return result, link.group(1) if link else None
+            message = (result.get("message") if isinstance(result, dict) else None) or data.decode(
+                "utf-8", "replace"
+            ).strip()
+            delay = self._retry_delay(status, headers, message, attempt)
+            if delay is None or attempt == MAX_ATTEMPTS - 1:
+                raise ApiError(f"{method} {url.path}: {status} {message}")
+            self._pause(delay, f"{method} {url.path}: {status} {message}")
+        raise ApiError(f"{method} {url.path}: giving up after {MAX_ATTEMPTS} attempts")
+
+    def close(self) -> None:
+        while not self._idle.empty():
+            connection = self._idle.get_nowait()
+            if connection is not None:
+                connection.close()
+
+
+# Return the runs path of the repository, or of one workflow given as a file name or ID. Other
+# workflow names are matched against the runs after they are listed.
+def runs_path(repo: str, workflow: str | None) -> str:
+    if workflow and (workflow.isdigit() or workflow.endswith((".yaml", ".yml"))):
+        return f"/repos/{repo}/actions/workflows/{quote(workflow, safe='')}/runs"
+    return f"/repos/{repo}/actions/runs"
+
+
+# Return the runs with a status created before `created_before`, following the page links. The
+# API stops after QUERY_RESULT_LIMIT runs per query, so the query is repeated for the runs
+# older than the oldest one seen until no more runs come back.
+def list_runs(
+    client: GitHubClient,
+    path: str,
+    status: str,
+    created_before: datetime | None,
+    limit: int,
+) -> list[Run]:
+    runs: dict[int, Run] = {}
+    upper = created_before.strftime("%Y-%m-%dT%H:%M:%SZ") if created_before else None
+    while True:
+        params = {"status": status, "per_page": str(PER_PAGE)}
+        if upper:
+            params["created"] = f"<={upper}"
+        page: str | None = path
+        found = 0
+        oldest = None
+        while page and (not limit or len(runs) < limit):
+            result, page = client.request("GET", page, params if page == path else None)
+            for run in result.get("workflow_runs") or []:
+                found += 1
+                runs.setdefault(run["id"], run)
+                oldest = run.get("created_at") or oldest
+        if found < QUERY_RESULT_LIMIT or (limit and len(runs) >= limit) or oldest == upper:
+            break
+        upper = oldest
+    ordered = sorted(runs.values(), key=lambda run: run.get("created_at") or "", reverse=True)
+    return ordered[:limit] if limit else ordered
+
+
+def delete_run(client: GitHubClient, repo: str, run: Run) -> str | None:
+    try:
+        client.request("DELETE", f"/repos/{repo}/actions/runs/{run['id']}")
+    except ApiError as e:
+        return str(e)
+    return None
+
+
+def describe(run: Run) -> str:
+    return (
+        f"{run.get('name')} [{run.get('conclusion') or run.get('status')}] "
+        f"(ID: {run['id']}, Created: {run.get('created_at')})"
+    )
+
+
+# Return the token of the environment or of the gh CLI
+def github_token() -> str | None:
+    if token := os.environ.get("GITHUB_TOKEN") or os.environ.get("GH_TOKEN"):
+        return token
+    try:
+        result = subprocess.run(["gh", "auth", "token"], capture_output=True, text=True)
+    except FileNotFoundError:
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip() or None
+
+
+# Return owner/name of the origin remote
+def default_repo() -> str | None:
+    if repo := os.environ.get("GITHUB_REPOSITORY"):
+        return repo
+    result = subprocess.run(["git", "remote", "get-url", "origin"], capture_output=True, text=True)
+    match = re.search(r"github\.com[:/]([^/]+/[^/]+?)(?:\.git)?$", result.stdout.strip())
+    return match.group(1) if result.returncode == 0 and match else None
+
+
+def confirm(count: int) -> bool:
+    if not sys.stdin.isatty():
+        log("Not asking for confirmation without a terminal, pass --yes")
+        return False
+    reply = input(f"Delete these {count} workflow runs? [y/N]: ")
+    return reply.strip().lower() in ("y", "yes")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Bulk delete GitHub Actions workflow runs")
+    parser.add_argument(
+        "--status",
+        choices=(*STATUSES, "all"),
+        default="failure",
+        help="status of the runs to delete, `all` for every status above (default: failure)",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=200,
+        help="maximum number of runs to delete, 0 for no limit (default: 200)",
+    )
+    parser.add_argument(
+        "--older-than",
+        type=parse_duration,
+        help="only delete runs created longer ago than this, e.g. 30d",
+    )
+    parser.add_argument(
+        "--workflow",
+        help="only delete runs of a workflow, given as its file name, ID or name",
+    )
+    parser.add_argument("--repo", default=default_repo(), help="owner/name (default: origin)")
+    parser.add_argument(
+        "--api-url",
+        default=API_URL,
+        help=f"GitHub API URL, e.g. of a local mock (default: $GITHUB_API_URL or {API_URL})",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=8,
+        help="number of concurrent requests (default: 8)",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="list the runs without deleting them"
+    )
+    parser.add_argument("--yes", action="store_true", help="delete without asking")
+    args = parser.parse_args()
+
+    if not args.repo:
+        parser.error("cannot tell the repository from the origin remote, pass --repo")
+    token = github_token()
+    if not token and urlsplit(args.api_url).hostname == "api.github.com":
+        log("Not authenticated with GitHub, set GITHUB_TOKEN or run: gh auth login")
+        return 1
+    statuses = STATUSES if args.status == "all" else (args.status,)
+    created_before = datetime.now(timezone.utc) - args.older_than if args.older_than else None
+    by_file = runs_path(args.repo, args.workflow) != runs_path(args.repo, None)
+    by_name = bool(args.workflow) and not by_file
+    # Runs matched by name are filtered after listing, so the limit cannot cut the listing short
+    list_limit = 0 if by_name else args.limit
+    connections = max(1, args.connections)
+
+    log(f"=== Cleaning up workflow runs of {args.repo} ===")
+    client = GitHubClient(args.api_url, token, connections)
+    try:
+        with ThreadPoolExecutor(connections) as pool:
+            path = runs_path(args.repo, args.workflow)
+            runs: dict[int, Run] = {}
+            for found in pool.map(
+                lambda status: list_runs(client, path, status, created_before, list_limit),
+                statuses,
+            ):
+                for run in found:
+                    if not by_name or run.get("name") == args.workflow:
+                        runs.setdefault(run["id"], run)
+            selected = sorted(
+                runs.values(), key=lambda run: run.get("created_at") or "", reverse=True
+            )
+            if args.limit:
+                selected = selected[: args.limit]
+            if not selected:
+                log("No workflow runs found matching the criteria")
+                return 0
+
+            log(f"Workflow runs to delete ({len(selected)}):")
+            for run in selected:
+                log(f"  - {describe(run)}")
+            if args.dry_run:
+                log("Dry run: no workflow runs were deleted")
+                return 0
+            if not args.yes and not confirm(len(selected)):
+                log("Cancelled")
+                return 0
+
+            start = time.perf_counter()
+            results = pool.map(lambda run: delete_run(client, args.repo, run), selected)
+            errors = {run["id"]: error for run, error in zip(selected, results) if error}
+    except ApiError as e:
+        log(str(e))
+        return 1
+    finally:
+        client.close()
+
+    for run_id, error in sorted(errors.items()):
+        log(f"Failed to delete run {run_id}: {error}")
+    log(
+        f"=== Deleted {len(selected) - len(errors)} workflow runs in "
+        f"{time.perf_counter() - start:.1f}s, {len(errors)} failed ==="
+    )
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,50 +2,31 @@
 set -Eeuo pipefail
 
 # etcd Backup Script for Talos Kubernetes Cluster
-# Creates a snapshot of etcd and stores it locally
+# Snapshots etcd on every control plane node into a deduplicated snapshot store, see
+# etcd_backup.py. Pass node addresses to back up only those nodes.
 # REF: https://docs.siderolabs.com/talos/v1.11/build-and-extend-talos/cluster-operations-and-maintenance/etcd-maintenance
 
 # Source common utilities
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+ROOT_DIR="$(cd "${SCRIPT_DIR}/.." && pwd)"
 # shellcheck disable=SC1091
 source "${SCRIPT_DIR}/lib/common.sh"
 
 # Check required tools
-check_cli talosctl
+check_cli "${TALOSCTL:-talosctl}" python yq
 
 # Configuration
-CONTROL_PLANE_IP="${1:-192.168.22.101}"
-BACKUP_DIR="${BACKUP_DIR:-./backups/etcd}"
-BACKUP_NAME="etcd-$(date +%Y%m%d-%H%M%S).db"
-KEEP_BACKUPS="${KEEP_BACKUPS:-7}"
+export BACKUP_DIR="${BACKUP_DIR:-./backups/etcd}"
+KEEP_WITHIN="${KEEP_WITHIN:-7d}"
+KEEP_DAILY="${KEEP_DAILY:-30}"
 
-# Create backup directory
-mkdir -p "${BACKUP_DIR}"
+log info "Backing up etcd" "store=${BACKUP_DIR}" "keep_within=${KEEP_WITHIN}" "keep_daily=${KEEP_DAILY}"
 
-log info "Creating etcd snapshot from control plane node" "node=${CONTROL_PLANE_IP}"
+python "${SCRIPT_DIR}/etcd_backup.py" backup \
+    --nodes-file "${ROOT_DIR}/nodes.yaml" \
+    --talconfig "${ROOT_DIR}/talos/talconfig.yaml" \
+    --keep-within "${KEEP_WITHIN}" \
+    --keep-daily "${KEEP_DAILY}" \
+    "$@"
 
-# Create snapshot on the node
-talosctl -n "${CONTROL_PLANE_IP}" etcd snapshot "${BACKUP_NAME}"
-
-log info "Copying snapshot to local backup directory" "path=${BACKUP_DIR}/${BACKUP_NAME}"
-
-# Copy snapshot to local machine
-talosctl -n "${CONTROL_PLANE_IP}" copy "/var/${BACKUP_NAME}" "${BACKUP_DIR}/"
-
-# Verify the backup exists
-if [[ -f "${BACKUP_DIR}/${BACKUP_NAME}" ]]; then
-    BACKUP_SIZE=$(du -h "${BACKUP_DIR}/${BACKUP_NAME}" | cut -f1)
-    log info "Backup completed successfully" "file=${BACKUP_NAME}" "size=${BACKUP_SIZE}"
-else
-    log error "Backup file not found" "path=${BACKUP_DIR}/${BACKUP_NAME}"
-fi
-
-# Cleanup old backups (keep last N)
-log info "Cleaning up old backups" "keep=${KEEP_BACKUPS}"
-cd "${BACKUP_DIR}"
-# shellcheck disable=SC2012
-ls -t ./*.db 2>/dev/null | tail -n +$((KEEP_BACKUPS + 1)) | xargs -r rm -f
-
-# List remaining backups
-BACKUP_COUNT=$(find . -name "*.db" -type f 2>/dev/null | wc -l | tr -d ' ')
-log info "Backup rotation complete" "total_backups=${BACKUP_COUNT}"
\ No newline at end of file
+log info "Backup completed successfully" "store=${BACKUP_DIR}"
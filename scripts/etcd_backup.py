@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+# Back up etcd from every control plane node at once into a deduplicated snapshot store. Each
+# snapshot is split into fixed-size chunks, which line up with the pages of the etcd database, so
+# pages that did not change between snapshots are stored once. Chunks are compressed and named
+# by the SHA-256 of their content; a manifest per snapshot lists its chunks along with the
+# SHA-256 and the etcd revision of the whole snapshot.
+
+import argparse
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, NamedTuple
+
+MANIFEST_VERSION = 1
+# A multiple of every page size bbolt uses, so an unchanged page never straddles a changed one
+CHUNK_SIZE = 1024 * 1024
+BACKUP_DIR = Path(os.environ.get("BACKUP_DIR", "./backups/etcd"))
+TIMESTAMP_FORMAT = "%Y%m%dT%H%M%SZ"
+DURATION = re.compile(r"^(\d+)([hdw])$")
+DURATION_UNITS = {"h": "hours", "d": "days", "w": "weeks"}
+
+# bbolt, the database etcd keeps its keys in
+BOLT_MAGIC = 0xED0CDAED
+BOLT_BRANCH_PAGE = 0x01
+BOLT_LEAF_PAGE = 0x02
+BOLT_BUCKET_LEAF = 0x01
+BOLT_PAGE_HEADER = struct.Struct("<QHHI")
+BOLT_META = struct.Struct("<IIIIQQQQQQ")
+BOLT_BRANCH_ELEMENT = struct.Struct("<IIQ")
+BOLT_LEAF_ELEMENT = struct.Struct("<IIII")
+BOLT_BUCKET = struct.Struct("<QQ")
+# Snapshots streamed from etcd end with the SHA-256 of the database
+SNAPSHOT_HASH_SIZE = 32
+SNAPSHOT_HASH_ALIGNMENT = 512
+
+
+class BackupError(Exception):
+    pass
+
+
+class Controller(NamedTuple):
+    name: str
+    address: str
+
+
+def log(message: str) -> None:
+    print(message, flush=True)
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def parse_duration(value: str) -> timedelta:
+    match = DURATION.match(value)
+    if not match:
+        raise argparse.ArgumentTypeError(f"expected a duration like 12h, 7d or 4w, got {value!r}")
+    return timedelta(**{DURATION_UNITS[match.group(2)]: int(match.group(1))})
+
+
+# Return the control plane nodes of nodes.yaml, or of the rendered talconfig.yaml once the
+# template files are tidied away
+def load_controllers(nodes_file: Path, talconfig_file: Path) -> list[Controller]:
+    if nodes_file.is_file():
+        path, name, address, controller = nodes_file, "name", "address", "controller"
+    elif talconfig_file.is_file():
+        path, name, address, controller = talconfig_file, "hostname", "ipAddress", "controlPlane"
+    else:
+        raise BackupError(f"Neither {nodes_file} nor {talconfig_file} exists")
+    yq = subprocess.run(
+        ["yq", "--output-format", "json", "--indent", "0", ".nodes // []", str(path)],
+        capture_output=True,
+    )
+    if yq.returncode != 0:
+        raise BackupError(f"Failed to parse {path}: {yq.stderr.decode().strip()}")
+    return [
+        Controller(str(node.get(name) or node.get(address)), str(node[address]))
+        for node in json.loads(yq.stdout)
+        if isinstance(node, dict) and node.get(controller) and node.get(address)
+    ]
+
+
+# Return True if a snapshot ends with a SHA-256 of the database, like snapshots streamed from
+# etcd do, and raise if it does not match, like `etcdutl snapshot restore` checks it
+def verify_snapshot_hash(path: Path) -> bool:
+    size = path.stat().st_size
+    if size % SNAPSHOT_HASH_ALIGNMENT != SNAPSHOT_HASH_SIZE:
+        return False
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        remaining = size - SNAPSHOT_HASH_SIZE
+        while remaining:
+            block = f.read(min(CHUNK_SIZE, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+        expected = f.read(SNAPSHOT_HASH_SIZE)
+    if digest.digest() != expected:
+        raise BackupError(f"{path.name}: the snapshot does not match its embedded SHA-256")
+    return True
+
+
+# Return the revision of an etcd database: the main revision of the last key in the `key`
+# bucket, whose keys are an 8-byte big-endian main revision, `_` and an 8-byte sub revision
+def snapshot_revision(path: Path) -> int | None:
+    if path.stat().st_size == 0:
+        return None
+    with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return read_revision(data)
+
+
+def read_revision(data: mmap.mmap) -> int | None:
+    try:
+        page_size = BOLT_META.unpack_from(data, BOLT_PAGE_HEADER.size)[2]
+        # The two meta pages are written in turns, the one with the newest transaction wins
+        metas = [
+            meta
+            for offset in (0, page_size)
+            if (meta := BOLT_META.unpack_from(data, offset + BOLT_PAGE_HEADER.size))[0]
+            == BOLT_MAGIC
+        ]
+        if not metas:
+            return None
+        # magic, version, page size, flags, root, sequence, freelist, pgid, txid, checksum
+        meta = max(metas, key=lambda m: m[8])
+        page_size, root = meta[2], meta[4]
+        bucket = find_bucket(data, page_size, page_offset(root, page_size), b"key")
+        if bucket is None:
+            return None
+        key = last_key(data, page_size, bucket)
+    except (struct.error, IndexError):
+        return None
+    return struct.unpack(">Q", key[:8])[0] if key and len(key) >= 8 else None
+
+
+def page_offset(pgid: int, page_size: int) -> int:
+    return pgid * page_size
+
+
+# Return the elements of a leaf page as (flags, key, value), or of a branch page as
+# (pgid, key, None)
+def page_elements(data: mmap.mmap, offset: int) -> tuple[int, list[tuple[int, bytes, Any]]]:
+    _, flags, count, _ = BOLT_PAGE_HEADER.unpack_from(data, offset)
+    elements = []
+    start = offset + BOLT_PAGE_HEADER.size
+    for index in range(count):
+        element = start + index * BOLT_LEAF_ELEMENT.size
+        if flags & BOLT_BRANCH_PAGE:
+            pos, ksize, pgid = BOLT_BRANCH_ELEMENT.unpack_from(data, element)
+            elements.append((pgid, data[element + pos : element + pos + ksize], None))
+        else:
+            element_flags, pos, ksize, vsize = BOLT_LEAF_ELEMENT.unpack_from(data, element)
+            key_start = element + pos
+            value = data[key_start + ksize : key_start + ksize + vsize]
+            elements.append((element_flags, data[key_start : key_start + ksize], value))
+    return flags, elements
+
+
+# Return the offset of the root page of a bucket, None for inline buckets, which are too small
+# to matter
+def find_bucket(data: mmap.mmap, page_size: int, offset: int, name: bytes) -> int | None:
+    flags, elements = page_elements(data, offset)
+    if flags & BOLT_BRANCH_PAGE:
+        for pgid, _, _ in elements:
+            found = find_bucket(data, page_size, page_offset(pgid, page_size), name)
+            if found is not None:
+                return found
+        return None
+    for element_flags, key, value in elements:
+        if key == name and element_flags & BOLT_BUCKET_LEAF:
+            root = BOLT_BUCKET.unpack_from(value)[0]
+            if root == 0:
+                return None
+            return page_offset(root, page_size)
+    return None
+
+
+def last_key(data: mmap.mmap, page_size: int, offset: int) -> bytes | None:
+    flags, elements = page_elements(data, offset)
+    if not elements:
+        return None
+    if flags & BOLT_BRANCH_PAGE:
+        return last_key(data, page_size, page_offset(elements[-1][0], page_size))
+    return elements[-1][1] if flags & BOLT_LEAF_PAGE else None
+
+
+# The chunks and manifests of every snapshot
+class SnapshotStore:
+    def __init__(self, root: Path):
+        self.root = root
+        self.chunks = root / "chunks"
+        self.snapshots = root / "snapshots"
+
+    def chunk_path(self, digest: str) -> Path:
+        return self.chunks / digest[:2] / f"{digest}.gz"
+
+    # Store a chunk unless a chunk with the same content is stored already, returning the
+    # number of compressed bytes written
+    def put_chunk(self, data: bytes) -> tuple[str, int]:
+        digest = sha256(data)
+        path = self.chunk_path(digest)
+        if path.exists():
+            return digest, 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        compressed = gzip.compress(data, compresslevel=6, mtime=0)
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as f:
+            f.write(compressed)
+        Path(f.name).replace(path)
+        return digest, len(compressed)
+
+    def read_chunk(self, digest: str) -> bytes:
+        data = gzip.decompress(self.chunk_path(digest).read_bytes())
+        if sha256(data) != digest:
+            raise BackupError(f"Chunk {digest} is corrupt")
+        return data
+
+    # Split a snapshot into chunks while hashing it and write its manifest. The snapshot is
+    # stored as talosctl wrote it, so a restored snapshot passes the hash check of a recovery.
+    def add(self, snapshot: Path, controller: Controller, created: datetime) -> dict[str, Any]:
+        hash_verified = verify_snapshot_hash(snapshot)
+        digest = hashlib.sha256()
+        chunks = []
+        size = written = 0
+        with snapshot.open("rb") as f:
+            while data := f.read(CHUNK_SIZE):
+                size += len(data)
+                digest.update(data)
+                chunk, compressed = self.put_chunk(data)
+                chunks.append(chunk)
+                written += compressed
+        name = f"{created.strftime(TIMESTAMP_FORMAT)}-{controller.name}"
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "name": name,
+            "node": controller.name,
+            "address": controller.address,
+            "created": created.isoformat(),
+            "size": size,
+            "sha256": digest.hexdigest(),
+            "revision": snapshot_revision(snapshot),
+            "hash_verified": hash_verified,
+            "chunk_size": CHUNK_SIZE,
+            "chunks": chunks,
+            "stored": written,
+        }
+        self.snapshots.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.snapshots / f"{name}.tmp"
+        tmp_file.write_text(json.dumps(manifest, indent=2) + "\n")
+        tmp_file.replace(self.snapshots / f"{name}.json")
+        return manifest
+
+    def manifests(self) -> list[dict[str, Any]]:
+        manifests = []
+        for path in sorted(self.snapshots.glob("*.json")):
+            try:
+                manifest = json.loads(path.read_text())
+            except json.JSONDecodeError:
+                continue
+            if manifest.get("version") == MANIFEST_VERSION:
+                manifests.append(manifest)
+        return manifests
+
+    def get(self, name: str) -> dict[str, Any]:
+        for manifest in self.manifests():
+            if manifest["name"] == name:
+                return manifest
+        raise BackupError(f"No snapshot named {name}")
+
+    # Reassemble a snapshot, checking every chunk and the SHA-256 of the whole snapshot. Without
+    # an output file the snapshot is only checked.
+    def restore(self, manifest: dict[str, Any], output: Path | None) -> None:
+        digest = hashlib.sha256()
+        tmp_file = output.with_name(f".{output.name}.tmp") if output else None
+        with open(tmp_file or os.devnull, "wb") as f:
+            for chunk in manifest["chunks"]:
+                data = self.read_chunk(chunk)
+                digest.update(data)
+                f.write(data)
+        if digest.hexdigest() != manifest["sha256"]:
+            if tmp_file:
+                tmp_file.unlink()
+            raise BackupError(f"{manifest['name']}: the reassembled snapshot does not match")
+        if tmp_file and output:
+            tmp_file.replace(output)
+
+    # Delete the manifests of expired snapshots and the chunks no snapshot uses anymore,
+    # returning the deleted snapshot names and the number of deleted chunks
+    def prune(self, expired: list[dict[str, Any]]) -> tuple[list[str], int]:
+        for manifest in expired:
+            (self.snapshots / f"{manifest['name']}.json").unlink(missing_ok=True)
+        used = {chunk for manifest in self.manifests() for chunk in manifest["chunks"]}
+        deleted = 0
+        for path in self.chunks.glob("*/*.gz"):
+            if path.name.removesuffix(".gz") not in used:
+                path.unlink()
+                deleted += 1
+        return [manifest["name"] for manifest in expired], deleted
+
+
+# Return the snapshots retention drops. Every node keeps all its snapshots younger than
+# `keep_within`, the newest snapshot of each of the last `keep_daily` days, and always its
+# newest snapshot.
+def expired_snapshots(
+    manifests: list[dict[str, Any]], now: datetime, keep_within: timedelta, keep_daily: int
+) -> list[dict[str, Any]]:
+    expired = []
+    by_node: dict[str, list[dict[str, Any]]] = {}
+    for manifest in manifests:
+        by_node.setdefault(manifest["node"], []).append(manifest)
+    for snapshots in by_node.values():
+        snapshots.sort(key=lambda m: m["created"], reverse=True)
+        days: set[str] = set()
+        for index, manifest in enumerate(snapshots):
+            created = datetime.fromisoformat(manifest["created"])
+            day = created.date().isoformat()
+            keep = (
+                index == 0
+                or now - created <= keep_within
+                or (day not in days and (now.date() - created.date()).days < keep_daily)
+            )
+            days.add(day)
+            if not keep:
+                expired.append(manifest)
+    return expired
+
+
+# Take a snapshot of a node with talosctl into a temporary file next to the store
+def take_snapshot(talosctl: str, controller: Controller, directory: Path) -> Path:
+    path = directory / f"{controller.name}.db"
+    result = subprocess.run(
+        [talosctl, "--nodes", controller.address, "etcd", "snapshot", str(path)],
+        capture_output=True,
+    )
+    if result.returncode != 0 or not path.is_file():
+        raise BackupError(
+            f"{controller.name}: talosctl etcd snapshot failed: {result.stderr.decode().strip()}"
+        )
+    return path
+
+
+def backup_controller(
+    store: SnapshotStore, talosctl: str, controller: Controller, created: datetime
+) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory(dir=store.root, prefix=".snapshot-") as directory:
+        snapshot = take_snapshot(talosctl, controller, Path(directory))
+        return store.add(snapshot, controller, created)
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return str(size)
+
+
+def backup(args: argparse.Namespace, store: SnapshotStore) -> int:
+    controllers = (
+        [Controller(address, address) for address in args.nodes]
+        if args.nodes
+        else load_controllers(args.nodes_file, args.talconfig)
+    )
+    if not controllers:
+        raise BackupError("No control plane nodes to back up")
+    store.root.mkdir(parents=True, exist_ok=True)
+    created = datetime.now(timezone.utc).replace(microsecond=0)
+    log(f"Taking etcd snapshots of {', '.join(c.name for c in controllers)}")
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=len(controllers)) as pool:
+        futures = [
+            (controller, pool.submit(backup_controller, store, args.talosctl, controller, created))
+            for controller in controllers
+        ]
+        for controller, future in futures:
+            try:
+                manifest = future.result()
+            except (BackupError, OSError) as e:
+                log(f"Failed to back up {controller.name}: {e}")
+                failed += 1
+                continue
+            log(
+                f"Stored {manifest['name']}: {format_size(manifest['size'])}, revision "
+                f"{manifest['revision']}, {format_size(manifest['stored'])} of new chunks, "
+                f"sha256 {manifest['sha256']}"
+            )
+
+    expired = expired_snapshots(store.manifests(), created, args.keep_within, args.keep_daily)
+    pruned, chunks = store.prune(expired)
+    log(f"Pruned {len(pruned)} snapshots and {chunks} unused chunks")
+    return 1 if failed else 0
+
+
+def list_snapshots(store: SnapshotStore) -> int:
+    manifests = store.manifests()
+    stored = sum(path.stat().st_size for path in store.chunks.glob("*/*.gz"))
+    for manifest in manifests:
+        log(
+            f"{manifest['name']:<40} {manifest['address']:<16} revision "
+            f"{manifest['revision']!s:<10} {format_size(manifest['size'])}"
+        )
+    total = sum(manifest["size"] for manifest in manifests)
+    log(f"{len(manifests)} snapshots, {format_size(total)} of etcd data in {format_size(stored)}")
+    return 0
+
+
+def verify(store: SnapshotStore, names: list[str]) -> int:
+    manifests = [store.get(name) for name in names] if names else store.manifests()
+    failed = 0
+    for manifest in manifests:
+        try:
+            store.restore(manifest, None)
+        except (BackupError, OSError) as e:
+            log(f"{manifest['name']}: {e}")
+            failed += 1
+    log(f"Verified {len(manifests) - failed} of {len(manifests)} snapshots")
+    return 1 if failed else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Back up etcd from every control plane node into a deduplicated store"
+    )
+    parser.add_argument(
+        "--backup-dir",
+        type=Path,
+        default=BACKUP_DIR,
+        help=f"snapshot store (default: $BACKUP_DIR or {BACKUP_DIR})",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backup_parser = commands.add_parser("backup", help="snapshot every control plane node")
+    backup_parser.add_argument(
+        "nodes", nargs="*", help="node addresses (default: the controllers in nodes.yaml)"
+    )
+    backup_parser.add_argument("--nodes-file", type=Path, default=Path("nodes.yaml"))
+    backup_parser.add_argument(
+        "--talconfig",
+        type=Path,
+        default=Path("talos/talconfig.yaml"),
+        help="read the controllers from here when there is no nodes.yaml",
+    )
+    backup_parser.add_argument(
+        "--talosctl",
+        default=os.environ.get("TALOSCTL", "talosctl"),
+        help="talosctl binary, e.g. a fake one for testing (default: $TALOSCTL or talosctl)",
+    )
+    backup_parser.add_argument(
+        "--keep-within",
+        type=parse_duration,
+        default=parse_duration("7d"),
+        help="keep every snapshot younger than this (default: 7d)",
+    )
+    backup_parser.add_argument(
+        "--keep-daily",
+        type=int,
+        default=30,
+        help="keep the newest snapshot of each of the last N days (default: 30)",
+    )
+
+    commands.add_parser("list", help="list the stored snapshots")
+    verify_parser = commands.add_parser("verify", help="check the chunks and hashes of snapshots")
+    verify_parser.add_argument("names", nargs="*", help="snapshots to verify (default: all)")
+    restore_parser = commands.add_parser("restore", help="reassemble a snapshot into a file")
+    restore_parser.add_argument("name", help="snapshot name, see `list`")
+    restore_parser.add_argument("output", type=Path, help="database file to write")
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.backup_dir)
+    try:
+        if args.command == "backup":
+            return backup(args, store)
+        if args.command == "list":
+            return list_snapshots(store)
+        if args.command == "verify":
+            return verify(store, args.names)
+        store.restore(store.get(args.name), args.output)
+        log(f"Restored {args.name} to {args.output}")
+        return 0
+    except BackupError as e:
+        log(str(e))
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+import argparse
+import os
+import shutil
+import sys
+import time
+import traceback
+from pathlib import Path
+from typing import NamedTuple
+
+import attrs
+from jinja2 import Environment
+from makejinja import app
+from makejinja.config import Config
+from makejinja.plugin import Plugin
+
+from render import collect_jobs, init_environment, load_config, render_jobs, worker_count
+from schema import SchemaError
+
+BATCH_ROOT = Path(".cache/batch")
+
+
+# A cluster variant: its name, which is also its output directory, and its data files
+class Variant(NamedTuple):
+    name: str
+    data: list[Path]
+
+
+def log(message: str) -> None:
+    print(message, flush=True)
+
+
+# Parse `name=cluster.yaml,nodes.yaml` into a variant
+def parse_variant(value: str) -> Variant:
+    name, separator, files = value.partition("=")
+    if not separator or not name or "/" in name or not files:
+        raise argparse.ArgumentTypeError(
+            f"expected NAME=CLUSTER_YAML,NODES_YAML, got {value!r}"
+        )
+    return Variant(name, [Path(file) for file in files.split(",") if file])
+
+
+# Renders every variant with one Jinja environment: the templates are compiled once, the secret
+# files are read once, and each variant only swaps in its own context before rendering into
+# its own output directory
+class BatchRenderer:
+    def __init__(self, config: Config, root: Path, workers: int):
+        self._config = config
+        self._root = root
+        self._workers = worker_count(config, workers)
+        self._env: Environment | None = None
+        self._plugins: list[Plugin] = []
+
+    # Only failures are logged, not the data files and every rendered file of every variant
+    def variant_config(self, variant: Variant) -> Config:
+        return attrs.evolve(
+            self._config, data=variant.data, output=self._root / variant.name, quiet=True
+        )
+
+    # Render a variant, returning how many files were rendered
+    def render(self, variant: Variant) -> int:
+        config = self.variant_config(variant)
+        if self._env is None:
+            self._env, self._plugins = init_environment(config)
+        else:
+            data = app.load_data(config)
+            for plugin in self._plugins:
+                if hasattr(plugin, "reload"):
+                    # Every variant uses the same secret files, so they are not read again
+                    plugin.reload(data, clear_secrets=False)
+
+        if config.output.is_dir() and config.clean:
+            shutil.rmtree(config.output)
+        config.output.mkdir(parents=True, exist_ok=True)
+        jobs, rendered_dirs = collect_jobs(config, self._plugins)
+        render_jobs(config, self._env, jobs, self._workers)
+        app.postprocess_rendered_dirs(config, rendered_dirs)
+        return len(jobs)
+
+
+# Render every variant, continuing with the next one when a variant fails. The exec_pre and
+# exec_post commands, which work on the configured output directory, are not run.
+def render_variants(config: Config, variants: list[Variant], root: Path, workers: int) -> int:
+    renderer = BatchRenderer(config, root, workers)
+    failed = []
+    total = time.perf_counter()
+    for variant in variants:
+        start = time.perf_counter()
+        try:
+            rendered = renderer.render(variant)
+        except Exception as e:
+            if isinstance(e, SchemaError):
+                log(str(e))
+            else:
+                traceback.print_exc()
+            log(f"=== {variant.name}: render failed ===")
+            failed.append(variant.name)
+        else:
+            log(
+                f"=== {variant.name}: rendered {rendered} files into {root / variant.name} "
+                f"in {time.perf_counter() - start:.2f}s ==="
+            )
+    log(f"=== Rendered {len(variants)} variants in {time.perf_counter() - total:.2f}s ===")
+    if failed:
+        log(f"Failed variants: {', '.join(failed)}")
+    return 1 if failed else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Render several cluster variants in one process, each into its own directory"
+    )
+    parser.add_argument(
+        "variants",
+        type=parse_variant,
+        nargs="+",
+        metavar="NAME=CLUSTER_YAML,NODES_YAML",
+        help="a variant name and its data files, e.g. public=cluster.yaml,nodes.yaml",
+    )
+    parser.add_argument(
+        "--output-root",
+        type=Path,
+        default=BATCH_ROOT,
+        help=f"directory holding the output directory of every variant (default: {BATCH_ROOT})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--config", type=Path, default=Path("makejinja.toml"), help="makejinja config file"
+    )
+    args = parser.parse_args()
+
+    names = [variant.name for variant in args.variants]
+    if len(set(names)) != len(names):
+        parser.error("variant names must be unique")
+    for variant in args.variants:
+        for path in variant.data:
+            if not path.exists():
+                parser.error(f"{variant.name}: file does not exist: {path}")
+
+    config = load_config(args.config)
+    if app.single_input_output_file(config):
+        parser.error("rendering a single input file is not supported, use makejinja")
+    # Compiled templates stay in memory for every variant after the first
+    config = attrs.evolve(config, internal=attrs.evolve(config.internal, cache_size=-1))
+    # The variants are rendered outside the working tree, so they keep no render state
+    os.environ["TEMPLATE_DRY_RUN"] = "1"
+    return render_variants(config, args.variants, args.output_root, args.workers)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
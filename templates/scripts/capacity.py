@@ -0,0 +1,513 @@
+import argparse
+import json
+import re
+import sys
+from pathlib import Path
+from typing import Any, Iterator, NamedTuple
+
+import attrs
+from makejinja import app
+
+from flux_graph import load_kustomizations, load_resources
+from plugin import build_context
+from render import load_config
+
+REPORT_VERSION = 2
+REPORT_FILE = Path(".cache/capacity/report.json")
+QUANTITY = re.compile(r"^([0-9.]+(?:e[0-9]+)?)(m|k|Ki|M|Mi|G|Gi|T|Ti|P|Pi|E|Ei)?$")
+QUANTITY_SUFFIXES = {
+    "m": 1e-3,
+    "k": 1e3,
+    "M": 1e6,
+    "G": 1e9,
+    "T": 1e12,
+    "P": 1e15,
+    "E": 1e18,
+    "Ki": 2**10,
+    "Mi": 2**20,
+    "Gi": 2**30,
+    "Ti": 2**40,
+    "Pi": 2**50,
+    "Ei": 2**60,
+}
+POD_TEMPLATE_KINDS = {"Deployment", "StatefulSet", "ReplicaSet", "DaemonSet"}
+REPLICA_KEYS = ("replicas", "replicaCount", "instances")
+CNPG_API_GROUP = "postgresql.cnpg.io/"
+# Keys of HelmRelease values that hold the containers of one pod, e.g. in app-template
+# `controllers/<name>/containers/<name>`
+CONTAINER_KEYS = ("containers", "initContainers")
+GIB = 2**30
+
+
+# CPU cores and memory bytes
+class Resources(NamedTuple):
+    cpu: float = 0
+    memory: float = 0
+
+    def __add__(self, other: "Resources") -> "Resources":
+        return Resources(self.cpu + other.cpu, self.memory + other.memory)
+
+    def __sub__(self, other: "Resources") -> "Resources":
+        return Resources(self.cpu - other.cpu, self.memory - other.memory)
+
+    def fits(self, capacity: "Resources") -> bool:
+        return self.cpu <= capacity.cpu + 1e-9 and self.memory <= capacity.memory + 1e-9
+
+
+# A set of identical pods: a Deployment, a StatefulSet, a CNPG cluster or a HelmRelease value
+# with resources, and how many of them run (one per node for DaemonSets). Unattributed workloads
+# are resources in HelmRelease values that belong to no pod of the release, such as the defaults
+# of pods an operator creates later; they are reported but not scheduled.
+class Workload(NamedTuple):
+    name: str
+    replicas: int
+    requests: Resources
+    limits: Resources
+    daemon: bool = False
+    unattributed: bool = False
+
+
+class Volume(NamedTuple):
+    owner: str
+    storage_class: str
+    size: float
+
+
+class Node(NamedTuple):
+    name: str
+    controller: bool
+    capacity: Resources
+    # True if the capacity is not declared in nodes.yaml and the default was used
+    assumed: bool
+
+
+# Return a Kubernetes quantity as a number, e.g. 500m -> 0.5 and 1Gi -> 1073741824
+def parse_quantity(value: Any) -> float | None:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = QUANTITY.match(str(value).strip()) if isinstance(value, str) else None
+    if match is None:
+        return None
+    return float(match[1]) * QUANTITY_SUFFIXES.get(match[2] or "", 1)
+
+
+# Return the requests and limits of a `resources` block
+def parse_resources(resources: Any) -> tuple[Resources, Resources]:
+    resources = resources if isinstance(resources, dict) else {}
+
+    def read(field: str) -> Resources:
+        values = resources.get(field) if isinstance(resources.get(field), dict) else {}
+        return Resources(
+            parse_quantity(values.get("cpu")) or 0, parse_quantity(values.get("memory")) or 0
+        )
+
+    requests, limits = read("requests"), read("limits")
+    # Kubernetes sets the request to the limit when only the limit is given
+    requests = Resources(requests.cpu or limits.cpu, requests.memory or limits.memory)
+    return requests, limits
+
+
+# Return the requests and limits of a pod: its containers run together, its init containers
+# one after another before them
+def pod_resources(spec: dict[str, Any]) -> tuple[Resources, Resources]:
+    requests, limits = Resources(), Resources()
+    for container in spec.get("containers") or []:
+        container_requests, container_limits = parse_resources(container.get("resources"))
+        requests, limits = requests + container_requests, limits + container_limits
+    for container in spec.get("initContainers") or []:
+        init_requests, init_limits = parse_resources(container.get("resources"))
+        requests = Resources(
+            max(requests.cpu, init_requests.cpu), max(requests.memory, init_requests.memory)
+        )
+        limits = Resources(
+            max(limits.cpu, init_limits.cpu), max(limits.memory, init_limits.memory)
+        )
+    return requests, limits
+
+
+def replica_count(values: dict[str, Any], default: int = 1) -> int:
+    for key in REPLICA_KEYS:
+        if isinstance(values.get(key), int) and not isinstance(values.get(key), bool):
+            return values[key]
+    return default
+
+
+# Return the workloads and volumes of a manifest
+def parse_manifest(
+    document: dict[str, Any], namespace: str | None
+) -> tuple[list[Workload], list[Volume]]:
+    kind = document.get("kind")
+    metadata = document.get("metadata") or {}
+    spec = document.get("spec") or {}
+    name = f"{metadata.get('namespace') or namespace}/{kind}/{metadata.get('name')}"
+    workloads: list[Workload] = []
+    volumes: list[Volume] = []
+
+    if kind in POD_TEMPLATE_KINDS:
+        replicas = replica_count(spec)
+        requests, limits = pod_resources((spec.get("template") or {}).get("spec") or {})
+        workloads.append(Workload(name, replicas, requests, limits, kind == "DaemonSet"))
+        for claim in spec.get("volumeClaimTemplates") or []:
+            volumes += [claim_volume(name, claim.get("spec") or {})] * replicas
+    elif kind == "Pod":
+        workloads.append(Workload(name, 1, *pod_resources(spec)))
+    elif kind == "Cluster" and str(document.get("apiVersion", "")).startswith(CNPG_API_GROUP):
+        instances = replica_count(spec)
+        workloads.append(Workload(name, instances, *parse_resources(spec.get("resources"))))
+        for field in ("storage", "walStorage"):
+            storage = spec.get(field) or {}
+            if size := parse_quantity(storage.get("size")):
+                storage_class = storage.get("storageClass") or "default"
+                volumes += [Volume(name, storage_class, size)] * instances
+    elif kind == "PersistentVolumeClaim":
+        volumes.append(claim_volume(name, spec))
+    elif kind == "HelmRelease":
+        # Containers below the same controller are merged into one pod spec
+        pods: dict[str, dict[str, Any]] = {}
+        for path, replicas, daemon, values in walk_values(spec.get("values") or {}):
+            if isinstance(values.get("resources"), dict):
+                pod_path, field = container_pod(path)
+                pod = pods.setdefault(
+                    pod_path,
+                    {"replicas": replicas, "daemon": daemon, **{key: [] for key in CONTAINER_KEYS}},
+                )
+                pod[field].append({"resources": values["resources"]})
+            if is_persistence(path, values) and not is_unattributed(path):
+                storage_class = values.get("storageClass") or values.get("storageClassName")
+                size = parse_quantity(values["size"]) or 0
+                volumes += [Volume(f"{name}/{path}", storage_class or "default", size)] * replicas
+        for pod_path, pod in pods.items():
+            requests, limits = pod_resources(pod)
+            if requests != Resources() or limits != Resources():
+                workloads.append(
+                    Workload(
+                        f"{name}/{pod_path}".rstrip("/"),
+                        pod["replicas"],
+                        requests,
+                        limits,
+                        pod["daemon"],
+                        is_unattributed(pod_path),
+                    )
+                )
+    return workloads, volumes
+
+
+# Return the path of the pod a HelmRelease value with resources belongs to, and whether it is a
+# container or an init container of that pod
+def container_pod(path: str) -> tuple[str, str]:
+    parts = path.split("/")
+    if len(parts) >= 2 and parts[-2] in CONTAINER_KEYS:
+        return "/".join(parts[:-2]), parts[-2]
+    return path, "containers"
+
+
+# Return True if a HelmRelease value holds defaults, e.g. obot's `mcpServerDefaults` for the MCP
+# servers it starts later, rather than the values of a pod of the release
+def is_unattributed(path: str) -> bool:
+    return any(part.lower().endswith("defaults") for part in path.split("/"))
+
+
+def claim_volume(owner: str, spec: dict[str, Any]) -> Volume:
+    size = parse_quantity(((spec.get("resources") or {}).get("requests") or {}).get("storage"))
+    return Volume(owner, spec.get("storageClassName") or "default", size or 0)
+
+
+# Return True if a HelmRelease value looks like a persistent volume: a size below a key such as
+# `persistence` or `storage`
+def is_persistence(path: str, values: dict[str, Any]) -> bool:
+    return (
+        "size" in values
+        and isinstance(values["size"], str)
+        and values["size"].endswith(("i", "G", "T"))
+        and any(word in path.lower() for word in ("persistence", "storage", "volume", "pvc"))
+    )
+
+
+# Walk the values of a HelmRelease, yielding every mapping with its path, the replicas of the
+# nearest enclosing controller and whether that controller is a DaemonSet. Subtrees with
+# `enabled: false` are skipped.
+def walk_values(
+    values: dict[str, Any], path: str = "", replicas: int = 1, daemon: bool = False
+) -> Iterator[tuple[str, int, bool, dict[str, Any]]]:
+    if values.get("enabled") is False:
+        return
+    replicas = replica_count(values, replicas)
+    daemon = daemon or str(values.get("type", "")).lower() == "daemonset"
+    yield path, replicas, daemon, values
+    for key, value in values.items():
+        if isinstance(value, dict) and key != "resources":
+            yield from walk_values(value, f"{path}/{key}".lstrip("/"), replicas, daemon)
+
+
+# Return the workloads and volumes of every Kustomization applied from the apps directory
+def collect(
+    apps_dir: Path, root: Path, errors: list[str]
+) -> tuple[list[Workload], list[Volume]]:
+    workloads: list[Workload] = []
+    volumes: list[Volume] = []
+    for kustomization in load_kustomizations(apps_dir, errors):
+        if not kustomization.path:
+            continue
+        path = root / kustomization.path
+        if not path.is_dir():
+            errors.append(f"{kustomization.id}: path {kustomization.path} does not exist")
+            continue
+        namespace = kustomization.target_namespace
+        for resource in load_resources(path, namespace, errors):
+            found_workloads, found_volumes = parse_manifest(resource.document, resource.namespace)
+            workloads += found_workloads
+            volumes += found_volumes
+    return workloads, volumes
+
+
+# Return the nodes with their allocatable capacity, from nodes.yaml or the defaults
+def cluster_nodes(context: dict[str, Any], default: Resources) -> list[Node]:
+    nodes = []
+    for node in context.get("nodes") or []:
+        cpu, memory = parse_quantity(node.get("cpu")), parse_quantity(node.get("memory"))
+        nodes.append(
+            Node(
+                node["name"],
+                bool(node.get("controller")),
+                Resources(cpu or default.cpu, memory or default.memory),
+                cpu is None or memory is None,
+            )
+        )
+    return nodes
+
+
+# Simulate scheduling: DaemonSet pods first, one per node, then the other pods from largest to
+# smallest, each onto the node that is least allocated afterwards, like the default scheduler
+def schedule(
+    nodes: list[Node], workloads: list[Workload]
+) -> tuple[dict[str, list[str]], dict[str, Resources], list[str]]:
+    placed: dict[str, list[str]] = {node.name: [] for node in nodes}
+    requested = {node.name: Resources() for node in nodes}
+    capacity = {node.name: node.capacity for node in nodes}
+    pending: list[str] = []
+
+    def place(pod: str, requests: Resources, node: str) -> bool:
+        if not (requested[node] + requests).fits(capacity[node]):
+            return False
+        requested[node] += requests
+        placed[node].append(pod)
+        return True
+
+    for workload in workloads:
+        if workload.daemon:
+            for node in placed:
+                if not place(workload.name, workload.requests, node):
+                    pending.append(f"{workload.name} on {node}")
+
+    largest = Resources(
+        max((c.cpu for c in capacity.values()), default=1) or 1,
+        max((c.memory for c in capacity.values()), default=1) or 1,
+    )
+    pods = sorted(
+        (
+            (workload.requests.cpu / largest.cpu + workload.requests.memory / largest.memory),
+            f"{workload.name}[{replica}]" if workload.replicas > 1 else workload.name,
+            workload.requests,
+        )
+        for workload in workloads
+        if not workload.daemon
+        for replica in range(workload.replicas)
+    )
+    for _, pod, requests in reversed(pods):
+
+        def allocation(node: str) -> float:
+            after = requested[node] + requests
+            return max(after.cpu / capacity[node].cpu, after.memory / capacity[node].memory)
+
+        candidates = [
+            node for node in placed if (requested[node] + requests).fits(capacity[node])
+        ]
+        if candidates:
+            place(pod, requests, min(candidates, key=lambda node: (allocation(node), node)))
+        else:
+            pending.append(pod)
+    return placed, requested, pending
+
+
+def ratio(used: float, available: float) -> float | None:
+    return round(used / available, 3) if available else None
+
+
+def plan(
+    context: dict[str, Any],
+    workloads: list[Workload],
+    volumes: list[Volume],
+    default: Resources,
+) -> dict[str, Any]:
+    nodes = cluster_nodes(context, default)
+    # Without allow_scheduling_on_control_planes, control plane nodes keep their NoSchedule taint
+    schedulable = [
+        node
+        for node in nodes
+        if not node.controller or context.get("allow_scheduling_on_control_planes")
+    ]
+    unattributed = [workload for workload in workloads if workload.unattributed]
+    workloads = [workload for workload in workloads if not workload.unattributed]
+    placed, requested, pending = schedule(schedulable, workloads)
+
+    pods = {w.name: w.replicas * (len(schedulable) if w.daemon else 1) for w in workloads}
+    total_capacity = sum((node.capacity for node in schedulable), Resources())
+    # Requests and limits of every pod, including the pending ones
+    total_requests, total_limits = Resources(), Resources()
+    for workload in workloads:
+        count = pods[workload.name]
+        total_requests += Resources(workload.requests.cpu * count, workload.requests.memory * count)
+        total_limits += Resources(workload.limits.cpu * count, workload.limits.memory * count)
+    headroom = total_capacity - total_requests
+
+    storage: dict[str, float] = {}
+    for volume in volumes:
+        storage[volume.storage_class] = storage.get(volume.storage_class, 0) + volume.size
+
+    used = {node.name: requested.get(node.name, Resources()) for node in nodes}
+    return {
+        "version": REPORT_VERSION,
+        "allow_scheduling_on_control_planes": bool(
+            context.get("allow_scheduling_on_control_planes")
+        ),
+        "nodes": {
+            node.name: {
+                "controller": node.controller,
+                "schedulable": node.name in placed,
+                "capacity_assumed": node.assumed,
+                "cpu": node.capacity.cpu,
+                "memory_gib": round(node.capacity.memory / GIB, 2),
+                "cpu_requested": round(used[node.name].cpu, 3),
+                "memory_requested_gib": round(used[node.name].memory / GIB, 2),
+                "pods": sorted(placed.get(node.name, [])),
+            }
+            for node in nodes
+        },
+        "cluster": {
+            "cpu": total_capacity.cpu,
+            "memory_gib": round(total_capacity.memory / GIB, 2),
+            "cpu_requested": round(total_requests.cpu, 3),
+            "memory_requested_gib": round(total_requests.memory / GIB, 2),
+            # Negative when the pods request more than the nodes have
+            "cpu_headroom": round(headroom.cpu, 3) + 0.0,
+            "memory_headroom_gib": round(headroom.memory / GIB, 2) + 0.0,
+            # Limits over allocatable capacity: above 1 the pods can not all burst at once
+            "cpu_overcommit": ratio(total_limits.cpu, total_capacity.cpu),
+            "memory_overcommit": ratio(total_limits.memory, total_capacity.memory),
+        },
+        "workloads": {
+            workload.name: {
+                "replicas": workload.replicas,
+                "daemon": workload.daemon,
+                "cpu_request": round(workload.requests.cpu, 3),
+                "memory_request_mib": round(workload.requests.memory / 2**20, 1),
+                "cpu_limit": round(workload.limits.cpu, 3),
+                "memory_limit_mib": round(workload.limits.memory / 2**20, 1),
+            }
+            for workload in sorted(workloads)
+        },
+        "unattributed": {
+            workload.name: {
+                "cpu_request": round(workload.requests.cpu, 3),
+                "memory_request_mib": round(workload.requests.memory / 2**20, 1),
+            }
+            for workload in sorted(unattributed)
+        },
+        "storage_gib": {
+            storage_class: round(size / GIB, 2) for storage_class, size in sorted(storage.items())
+        },
+        "volumes": [
+            {"owner": v.owner, "storage_class": v.storage_class, "size_gib": round(v.size / GIB, 2)}
+            for v in sorted(volumes)
+        ],
+        "pending": pending,
+    }
+
+
+def write_report(report: dict[str, Any], report_file: Path) -> None:
+    report_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = report_file.with_suffix(".tmp")
+    tmp_file.write_text(json.dumps(report, indent=2) + "\n")
+    tmp_file.replace(report_file)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Check that the requests of the rendered workloads fit on the nodes"
+    )
+    parser.add_argument(
+        "path",
+        type=Path,
+        nargs="?",
+        default=Path("kubernetes/apps"),
+        help="directory applied by the cluster-apps Kustomization (default: kubernetes/apps)",
+    )
+    parser.add_argument(
+        "--cpu",
+        type=float,
+        default=4,
+        help="allocatable CPU cores of nodes without `cpu` in nodes.yaml (default: 4)",
+    )
+    parser.add_argument(
+        "--memory",
+        default="16Gi",
+        help="allocatable memory of nodes without `memory` in nodes.yaml (default: 16Gi)",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=REPORT_FILE,
+        help=f"JSON report file (default: {REPORT_FILE})",
+    )
+    parser.add_argument(
+        "--config", type=Path, default=Path("makejinja.toml"), help="makejinja config file"
+    )
+    args = parser.parse_args()
+
+    memory = parse_quantity(args.memory)
+    if memory is None:
+        parser.error(f"invalid memory quantity: {args.memory}")
+    if not args.path.is_dir():
+        print(f"Directory does not exist: {args.path}, run `task configure` first")
+        return 1
+
+    config = attrs.evolve(load_config(args.config), quiet=True)
+    context = build_context(app.load_data(config))
+    errors: list[str] = []
+    workloads, volumes = collect(args.path, Path(config.output), errors)
+    report = plan(context, workloads, volumes, Resources(args.cpu, memory))
+    report["errors"] = errors
+    write_report(report, args.output)
+
+    for error in errors:
+        print(f"Warning: {error}")
+    print(f"{'NODE':<24}{'CPU':>16}{'MEMORY (GiB)':>20}  PODS")
+    for name, node in report["nodes"].items():
+        if not node["schedulable"]:
+            print(f"{name:<24}{'control plane, not schedulable':>36}")
+            continue
+        assumed = " (assumed capacity)" if node["capacity_assumed"] else ""
+        cpu = f"{node['cpu_requested']:g}/{node['cpu']:g}"
+        memory_used = f"{node['memory_requested_gib']:g}/{node['memory_gib']:g}"
+        print(f"{name:<24}{cpu:>16}{memory_used:>20}  {len(node['pods'])}{assumed}")
+    cluster = report["cluster"]
+    print(
+        f"Headroom: {cluster['cpu_headroom']:g} CPU, {cluster['memory_headroom_gib']:g} GiB; "
+        f"overcommit (limits / capacity): {cluster['cpu_overcommit']} CPU, "
+        f"{cluster['memory_overcommit']} memory"
+    )
+    if report["storage_gib"]:
+        print(
+            "Storage: "
+            + ", ".join(f"{size:g} GiB {name}" for name, size in report["storage_gib"].items())
+        )
+    if report["unattributed"]:
+        print(f"Not scheduled, not a pod of its release: {', '.join(report['unattributed'])}")
+    for pod in report["pending"]:
+        print(f"Pending: {pod}")
+    print(f"Report written to {args.output}")
+    return 1 if report["pending"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
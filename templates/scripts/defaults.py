@@ -0,0 +1,143 @@
+import argparse
+import copy
+import hashlib
+import heapq
+import json
+import sys
+from pathlib import Path
+from typing import Any, Callable, NamedTuple
+
+import attrs
+import makejinja
+from makejinja import app
+
+CONTEXT_CACHE_DIR = Path(".cache/context")
+
+
+# A default for a template data key: either a static value or computed from the keys it depends on
+class Default(NamedTuple):
+    key: str
+    value: Any = None
+    compute: Callable[[dict[str, Any]], Any] | None = None
+    depends: tuple[str, ...] = ()
+
+
+# Return a default that falls back to the value of another key
+def fallback(key: str, source: str, value: Any = None) -> Default:
+    return Default(key, compute=lambda data: data.get(source, value), depends=(source,))
+
+
+# Registry of defaults, resolved in dependency order. The order is computed once when the table is
+# built: a key always comes after the keys it depends on and otherwise keeps its position in the
+# table. Dependencies that are not in the table are user inputs from cluster.yaml / nodes.yaml.
+class DefaultsTable:
+    def __init__(self, defaults: list[Default]):
+        self._defaults = {}
+        for default in defaults:
+            if default.key in self._defaults:
+                raise ValueError(f"Duplicate default: {default.key}")
+            self._defaults[default.key] = default
+        self._order = self._sort()
+
+    def _sort(self) -> list[Default]:
+        position = {key: index for index, key in enumerate(self._defaults)}
+        pending = {
+            key: {dep for dep in default.depends if dep in self._defaults}
+            for key, default in self._defaults.items()
+        }
+        dependents: dict[str, list[str]] = {key: [] for key in self._defaults}
+        for key, deps in pending.items():
+            for dep in deps:
+                dependents[dep].append(key)
+
+        ready = [position[key] for key, deps in pending.items() if not deps]
+        heapq.heapify(ready)
+        keys = list(self._defaults)
+        order = []
+        while ready:
+            key = keys[heapq.heappop(ready)]
+            order.append(self._defaults[key])
+            for dependent in dependents[key]:
+                pending[dependent].discard(key)
+                if not pending[dependent]:
+                    heapq.heappush(ready, position[dependent])
+
+        if len(order) != len(self._defaults):
+            cycle = sorted(key for key, deps in pending.items() if deps)
+            raise ValueError(f"Circular defaults: {', '.join(cycle)}")
+        return order
+
+    # Return the keys in resolution order
+    def keys(self) -> list[str]:
+        return [default.key for default in self._order]
+
+    # Fill in every key missing from data, in place, and return data
+    def resolve(self, data: dict[str, Any]) -> dict[str, Any]:
+        for default in self._order:
+            if default.key in data:
+                continue
+            if default.compute is not None:
+                data[default.key] = default.compute(data)
+            else:
+                data[default.key] = copy.deepcopy(default.value)
+        return data
+
+
+# Return a digest of everything the resolved context depends on: the data files and the plugin code
+def context_digest(config: makejinja.config.Config) -> str:
+    digest = hashlib.sha256()
+    for path in app.collect_files(config.data):
+        digest.update(f"{path}\n".encode("utf-8"))
+        digest.update(path.read_bytes())
+    digest.update(json.dumps(config.data_vars, sort_keys=True, default=repr).encode("utf-8"))
+    for import_path in config.import_paths:
+        for script in sorted(Path(import_path).glob("*.py")):
+            digest.update(script.read_bytes())
+    return digest.hexdigest()
+
+
+# Return the resolved template context, from the cache if the data files and plugin are unchanged
+def load_context(
+    config: makejinja.config.Config,
+    resolve: Callable[[dict[str, Any]], dict[str, Any]],
+    cache_dir: Path = CONTEXT_CACHE_DIR,
+) -> dict[str, Any]:
+    cache_file = cache_dir / f"{context_digest(config)}.json"
+    try:
+        return json.loads(cache_file.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+    context = resolve(app.load_data(config))
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for stale_file in cache_dir.glob("*.json"):
+        stale_file.unlink()
+    tmp_file = cache_file.with_suffix(".tmp")
+    tmp_file.write_text(json.dumps(context, indent=2, sort_keys=True, default=str) + "\n")
+    tmp_file.replace(cache_file)
+    return json.loads(cache_file.read_text())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Print the template context: cluster.yaml and nodes.yaml with all defaults resolved"
+    )
+    parser.add_argument(
+        "--config", type=Path, default=Path("makejinja.toml"), help="makejinja config file"
+    )
+    parser.add_argument("--key", action="append", default=[], help="only print these keys")
+    args = parser.parse_args()
+
+    from plugin import build_context
+    from render import load_config
+
+    config = attrs.evolve(load_config(args.config), quiet=True)
+    context = load_context(config, build_context)
+    if args.key:
+        context = {key: context.get(key) for key in args.key}
+    json.dump(context, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
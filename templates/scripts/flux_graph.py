@@ -0,0 +1,341 @@
+import argparse
+import json
+import re
+import sys
+from collections import Counter
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import attrs
+import yaml
+from makejinja import app
+
+from plugin import build_context
+from render import load_config
+
+REPORT_VERSION = 1
+REPORT_FILE = Path(".cache/flux/graph.json")
+FLUX_KUSTOMIZATION = "kustomize.toolkit.fluxcd.io/"
+KUSTOMIZATION_FILES = ("kustomization.yaml", "kustomization.yml", "Kustomization")
+# Go duration units as used by Flux, e.g. `1h`, `15m` or `1m30s`
+DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+
+
+# A Flux Kustomization and the Kustomizations it waits for, as `namespace/name`
+class Kustomization(NamedTuple):
+    id: str
+    file: str
+    depends_on: list[str]
+    # The longest the Kustomization may take before its dependents give up waiting on it
+    timeout: float
+    # The directory it applies, relative to the repository root, and the namespace it sets
+    path: str | None = None
+    target_namespace: str | None = None
+
+
+# Return a Go duration in seconds, or None if it is not a valid duration
+def parse_duration(value: Any) -> float | None:
+    if not isinstance(value, str) or not value or DURATION.sub("", value):
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in DURATION.findall(value))
+
+
+def find_kustomization_file(directory: Path) -> Path | None:
+    return next(
+        (directory / name for name in KUSTOMIZATION_FILES if (directory / name).is_file()), None
+    )
+
+
+# A manifest applied from a kustomization, with the namespace kustomize sets on it if any
+class Resource(NamedTuple):
+    file: str
+    namespace: str | None
+    document: dict[str, Any]
+
+
+# Return the manifests applied from a directory, following the kustomize resources like
+# kustomize-controller does. A directory without kustomization.yaml includes its manifests and
+# the subdirectories that have one, as the file kustomize-controller generates would.
+def load_resources(
+    directory: Path, namespace: str | None = None, errors: list[str] | None = None
+) -> list[Resource]:
+    errors = [] if errors is None else errors
+    kustomization_file = find_kustomization_file(directory)
+    if kustomization_file is None:
+        resources = sorted(
+            path
+            for path in directory.iterdir()
+            if (path.is_file() and path.suffix in (".yaml", ".yml"))
+            or (path.is_dir() and find_kustomization_file(path))
+        )
+    else:
+        kustomization = yaml.safe_load(kustomization_file.read_text()) or {}
+        # The namespace of an outer kustomization overrides the namespace of the inner ones
+        namespace = namespace or kustomization.get("namespace")
+        # Remote resources are fetched by kustomize-controller and not part of the rendered tree
+        resources = [
+            directory / resource
+            for resource in kustomization.get("resources") or []
+            if "://" not in resource
+        ]
+
+    loaded = []
+    for resource in resources:
+        if resource.is_dir():
+            loaded += load_resources(resource, namespace, errors)
+        elif not resource.is_file():
+            errors.append(f"{kustomization_file}: resource {resource} does not exist")
+        else:
+            try:
+                documents = list(yaml.safe_load_all(resource.read_text()))
+            except yaml.YAMLError as e:
+                errors.append(f"{resource}: {e}")
+                continue
+            loaded += [
+                Resource(str(resource), namespace, document)
+                for document in documents
+                if isinstance(document, dict)
+            ]
+    return loaded
+
+
+# Return the Flux Kustomizations applied from a directory
+def load_kustomizations(
+    directory: Path, errors: list[str] | None = None
+) -> list[Kustomization]:
+    return [
+        parse_kustomization(resource.document, Path(resource.file), resource.namespace)
+        for resource in load_resources(directory, errors=errors)
+        if is_flux_kustomization(resource.document)
+    ]
+
+
+def is_flux_kustomization(document: dict[str, Any]) -> bool:
+    return document.get("kind") == "Kustomization" and str(
+        document.get("apiVersion", "")
+    ).startswith(FLUX_KUSTOMIZATION)
+
+
+def parse_kustomization(
+    document: dict[str, Any], file: Path, namespace: str | None
+) -> Kustomization:
+    metadata = document.get("metadata") or {}
+    spec = document.get("spec") or {}
+    namespace = namespace or metadata.get("namespace") or "default"
+    # A dependency without a namespace is in the namespace of the Kustomization itself
+    depends_on = [
+        f"{dependency.get('namespace') or namespace}/{dependency.get('name')}"
+        for dependency in spec.get("dependsOn") or []
+    ]
+    # Flux waits up to the interval when no timeout is set
+    timeout = parse_duration(spec.get("timeout")) or parse_duration(spec.get("interval")) or 0
+    return Kustomization(
+        f"{namespace}/{metadata.get('name')}",
+        str(file),
+        depends_on,
+        timeout,
+        spec.get("path"),
+        spec.get("targetNamespace"),
+    )
+
+
+# Return the strongly connected components with more than one Kustomization, and Kustomizations
+# that depend on themselves: each is a dependency cycle Flux never resolves
+def find_cycles(graph: dict[str, list[str]]) -> list[list[str]]:
+    index: dict[str, int] = {}
+    low: dict[str, int] = {}
+    stack: list[str] = []
+    on_stack: set[str] = set()
+    cycles = []
+
+    def connect(node: str) -> None:
+        index[node] = low[node] = len(index)
+        stack.append(node)
+        on_stack.add(node)
+        for dependency in graph[node]:
+            if dependency not in index:
+                connect(dependency)
+                low[node] = min(low[node], low[dependency])
+            elif dependency in on_stack:
+                low[node] = min(low[node], index[dependency])
+        if low[node] == index[node]:
+            component = []
+            while True:
+                member = stack.pop()
+                on_stack.discard(member)
+                component.append(member)
+                if member == node:
+                    break
+            if len(component) > 1 or node in graph[node]:
+                cycles.append(sorted(component))
+
+    for node in graph:
+        if node not in index:
+            connect(node)
+    return sorted(cycles)
+
+
+# Return a dependency that is not rendered, with the `*_enabled` flag that turned it off if any
+def describe_dangling(dependency: str, context: dict[str, Any]) -> str:
+    flag = dependency.rpartition("/")[2].replace("-", "_") + "_enabled"
+    if context.get(flag) is False:
+        return f"{dependency} (disabled by {flag})"
+    return dependency
+
+
+# Analyze the dependency graph: cycles, dangling dependencies, the reconciliation levels (every
+# Kustomization of a level can reconcile in parallel once the levels before it are ready), the
+# critical path and the widest level
+def analyze(
+    kustomizations: list[Kustomization], context: dict[str, Any] | None = None
+) -> dict[str, Any]:
+    context = context or {}
+    nodes = {kustomization.id: kustomization for kustomization in kustomizations}
+    counts = Counter(kustomization.id for kustomization in kustomizations)
+    duplicates = sorted(id for id, count in counts.items() if count > 1)
+    graph = {
+        id: sorted({dependency for dependency in node.depends_on if dependency in nodes})
+        for id, node in nodes.items()
+    }
+    dangling = {
+        id: [describe_dangling(d, context) for d in node.depends_on if d not in nodes]
+        for id, node in nodes.items()
+        if any(d not in nodes for d in node.depends_on)
+    }
+    cycles = find_cycles(graph)
+    blocked = {id for cycle in cycles for id in cycle}
+
+    # Longest chain ending at each Kustomization, and the sum of the timeouts along it
+    depth: dict[str, int] = {}
+    cost: dict[str, float] = {}
+    previous: dict[str, str | None] = {}
+    pending = {id: set(dependencies) for id, dependencies in graph.items() if id not in blocked}
+    dependents: dict[str, list[str]] = {id: [] for id in graph}
+    for id, dependencies in graph.items():
+        for dependency in dependencies:
+            dependents[dependency].append(id)
+    ready = sorted(id for id, dependencies in pending.items() if not dependencies)
+    while ready:
+        id = ready.pop()
+        parents = graph[id]
+        parent = max(parents, key=lambda p: (depth[p], cost[p], p), default=None)
+        depth[id] = max((depth[p] for p in parents), default=-1) + 1
+        cost[id] = (cost[parent] if parent else 0) + nodes[id].timeout
+        previous[id] = parent
+        for dependent in dependents[id]:
+            if dependent in pending:
+                pending[dependent].discard(id)
+                if not pending[dependent]:
+                    ready.append(dependent)
+    # Kustomizations waiting on a cycle never reconcile either
+    blocked |= set(pending) - set(depth)
+
+    levels: list[list[str]] = []
+    for id, level in sorted(depth.items()):
+        while len(levels) <= level:
+            levels.append([])
+        levels[level].append(id)
+
+    critical_path: list[str] = []
+    if depth:
+        node: str | None = max(depth, key=lambda id: (depth[id], cost[id], id))
+        while node:
+            critical_path.append(node)
+            node = previous[node]
+        critical_path.reverse()
+
+    return {
+        "version": REPORT_VERSION,
+        "enabled_flags": sorted(
+            key for key, value in context.items() if key.endswith("_enabled") and value is True
+        ),
+        "kustomizations": {
+            id: {
+                "file": node.file,
+                "depends_on": node.depends_on,
+                "timeout": node.timeout,
+                "level": depth.get(id),
+            }
+            for id, node in sorted(nodes.items())
+        },
+        "duplicates": duplicates,
+        "dangling": dangling,
+        "cycles": cycles,
+        "blocked": sorted(blocked),
+        "levels": levels,
+        "max_parallel_width": max(map(len, levels), default=0),
+        "critical_path": critical_path,
+        "critical_path_timeout": cost[critical_path[-1]] if critical_path else 0,
+    }
+
+
+def write_report(report: dict[str, Any], report_file: Path) -> None:
+    report_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = report_file.with_suffix(".tmp")
+    tmp_file.write_text(json.dumps(report, indent=2) + "\n")
+    tmp_file.replace(report_file)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Analyze the dependsOn graph of the rendered Flux Kustomizations"
+    )
+    parser.add_argument(
+        "path",
+        type=Path,
+        nargs="?",
+        default=Path("kubernetes/apps"),
+        help="directory applied by the cluster-apps Kustomization (default: kubernetes/apps)",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=REPORT_FILE,
+        help=f"JSON report file (default: {REPORT_FILE})",
+    )
+    parser.add_argument(
+        "--config", type=Path, default=Path("makejinja.toml"), help="makejinja config file"
+    )
+    args = parser.parse_args()
+
+    if not args.path.is_dir():
+        print(f"Directory does not exist: {args.path}, run `task configure` first")
+        return 1
+    config = attrs.evolve(load_config(args.config), quiet=True)
+    context = build_context(app.load_data(config))
+    errors: list[str] = []
+    report = analyze(load_kustomizations(args.path, errors), context)
+    report["errors"] = errors
+    write_report(report, args.output)
+
+    levels = report["levels"]
+    print(
+        f"{len(report['kustomizations'])} Kustomizations in {len(levels)} levels, "
+        f"at most {report['max_parallel_width']} in parallel"
+    )
+    print(
+        f"Critical path ({len(report['critical_path'])} Kustomizations, up to "
+        f"{report['critical_path_timeout'] / 60:g}m): {' -> '.join(report['critical_path'])}"
+    )
+    # Missing resources fail the kustomize build of the validation step, here they only mean
+    # the graph may be incomplete
+    for error in errors:
+        print(f"Warning: {error}")
+    problems = [
+        *(f"Duplicate Kustomization: {id}" for id in report["duplicates"]),
+        *(f"Dependency cycle: {' -> '.join(cycle)}" for cycle in report["cycles"]),
+        *(
+            f"{id} depends on {dependency}, which is not rendered"
+            for id, dependencies in report["dangling"].items()
+            for dependency in dependencies
+        ),
+    ]
+    for problem in problems:
+        print(problem)
+    print(f"Report written to {args.output}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+from pathlib import Path
+
+import jinja2
+import makejinja
+
+GATE_FILE = ".gate"
+
+
+# Index of the `.gate` files in the template inputs. A gate file holds a Jinja expression (usually
+# a `*_enabled` flag) that controls its directory: when it evaluates to false the whole subtree is
+# pruned before any template in it is loaded, parsed or rendered.
+class GateIndex:
+    def __init__(self, env: jinja2.Environment, config: makejinja.config.Config):
+        self._env = env
+        self._gates: dict[Path, str] = {}
+        self._open: dict[Path, bool] = {}
+        for input_dir in config.inputs:
+            if input_dir.is_dir():
+                for gate_file in input_dir.rglob(GATE_FILE):
+                    self._gates[gate_file.parent] = read_gate(gate_file)
+
+    # Return the gate expressions keyed by directory
+    def gates(self) -> dict[Path, str]:
+        return dict(self._gates)
+
+    # Evaluate a directory's gate once against the plugin data
+    def is_open(self, directory: Path) -> bool:
+        if directory not in self._open:
+            expression = self._env.compile_expression(self._gates[directory])
+            self._open[directory] = bool(expression())
+        return self._open[directory]
+
+    # makejinja path filter: return False for gate files and anything below a closed gate
+    def path_filter(self, input_path: Path) -> bool:
+        if input_path.name == GATE_FILE:
+            return False
+        return all(
+            self.is_open(directory)
+            for directory in (input_path, *input_path.parents)
+            if directory in self._gates
+        )
+
+
+# Return the expression from a gate file, ignoring blank lines and comments
+def read_gate(gate_file: Path) -> str:
+    lines = [
+        line.strip()
+        for line in gate_file.read_text().splitlines()
+        if line.strip() and not line.strip().startswith("#")
+    ]
+    if len(lines) != 1:
+        raise ValueError(f"Gate file must contain exactly one expression: {gate_file}")
+    return lines[0]
@@ -0,0 +1,185 @@
+import hashlib
+import json
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Callable
+
+import jinja2
+import makejinja
+from jinja2 import nodes
+
+MANIFEST_VERSION = 1
+MANIFEST_FILE = Path(".cache/render/manifest.json")
+
+
+# Return the sha256 hex digest of some bytes
+def sha256(value: bytes) -> str:
+    return hashlib.sha256(value).hexdigest()
+
+
+# Return a digest for a file (by content) or a directory (by its recursive listing)
+def path_digest(path: Path) -> str:
+    if path.is_file():
+        return sha256(path.read_bytes())
+    if path.is_dir():
+        listing = sorted(str(f.relative_to(path)) for f in path.rglob("*"))
+        return sha256("\n".join(listing).encode("utf-8"))
+    return "missing"
+
+
+# Return a stable digest for a value from the template context
+def value_digest(value: Any) -> str:
+    return sha256(json.dumps(value, sort_keys=True, default=repr).encode("utf-8"))
+
+
+# Return the names a template reads (data keys and plugin functions), including local names,
+# since jinja2.meta.find_undeclared_variables ignores everything already in env.globals
+def template_names(env: jinja2.Environment, source: str) -> list[str]:
+    ast = env.parse(source)
+    return sorted({node.name for node in ast.find_all(nodes.Name) if node.ctx == "load"})
+
+
+# Return the output path makejinja writes for a template relative to its input directory
+def output_path(config: makejinja.config.Config, relative_path: Path) -> Path:
+    output = config.output / relative_path
+    if relative_path.suffix == config.jinja_suffix and not config.keep_jinja_suffix:
+        output = output.with_suffix("")
+    return output
+
+
+# Skip templates whose source and referenced data have not changed since the last render.
+# Each template is parsed once to find the data keys and plugin functions it references, the
+# manifest stores those names with a digest of the source, the referenced values and the inputs
+# read by the referenced functions, so unchanged outputs are never rewritten.
+class IncrementalRender:
+    def __init__(
+        self,
+        env: jinja2.Environment,
+        config: makejinja.config.Config,
+        function_digests: dict[str, Callable[[], str]],
+        manifest_file: Path = MANIFEST_FILE,
+    ):
+        self._env = env
+        self._config = config
+        self._function_digests = function_digests
+        self._manifest_file = manifest_file
+        self._entries = self._load()
+        self._seen: set[str] = set()
+        self._pending: dict[str, dict[str, Any]] = {}
+        self._completed: dict[str, dict[str, Any]] = {}
+        self._global_digest: str | None = None
+        self._input_digests: dict[str, str] = {}
+
+    def _load(self) -> dict[str, dict[str, Any]]:
+        try:
+            manifest = json.loads(self._manifest_file.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        if manifest.get("version") != MANIFEST_VERSION:
+            return {}
+        return manifest.get("templates", {})
+
+    # Digest of everything that affects every template: the plugin code, makejinja config and versions
+    def _global(self) -> str:
+        if self._global_digest is None:
+            parts = [
+                str(MANIFEST_VERSION),
+                metadata.version("makejinja"),
+                jinja2.__version__,
+                path_digest(Path("makejinja.toml")),
+            ]
+            for import_path in self._config.import_paths:
+                for script in sorted(Path(import_path).glob("*.py")):
+                    parts.append(f"{script.name}:{path_digest(script)}")
+            self._global_digest = sha256("\n".join(parts).encode("utf-8"))
+        return self._global_digest
+
+    def _function_digest(self, name: str) -> str:
+        if name not in self._input_digests:
+            self._input_digests[name] = self._function_digests[name]()
+        return self._input_digests[name]
+
+    def _relative_path(self, input_path: Path) -> Path | None:
+        for input_dir in self._config.inputs:
+            if input_dir.is_dir() and input_path.is_relative_to(input_dir):
+                return input_path.relative_to(input_dir)
+        return None
+
+    def _digest(self, source: bytes, names: list[str]) -> str:
+        parts = [self._global(), sha256(source)]
+        for name in names:
+            value = self._env.globals.get(name)
+            if name in self._function_digests:
+                parts.append(f"{name}():{self._function_digest(name)}")
+            elif callable(value):
+                # Jinja builtins and plugin functions without external inputs are covered by the global digest
+                parts.append(f"{name}()")
+            else:
+                parts.append(f"{name}={value_digest(value)}")
+        return sha256("\n".join(parts).encode("utf-8"))
+
+    # makejinja path filter: return False for templates that do not need to be rendered again
+    def path_filter(self, input_path: Path) -> bool:
+        if not input_path.is_file():
+            return True
+        if any(input_path.match(x) for x in self._config.exclude_patterns):
+            return True
+        relative_path = self._relative_path(input_path)
+        if relative_path is None:
+            return True
+        name = str(relative_path)
+        if name in self._seen:
+            return True
+        self._seen.add(name)
+
+        source = input_path.read_bytes()
+        source_digest = sha256(source)
+        entry = self._entries.get(name)
+        is_template = input_path.suffix == self._config.jinja_suffix
+        if entry and entry["source"] == source_digest:
+            names = entry["names"]
+        elif is_template:
+            names = template_names(self._env, source.decode("utf-8"))
+        else:
+            names = []
+
+        digest = self._digest(source, names)
+        output = output_path(self._config, relative_path)
+        if entry and entry["digest"] == digest and (entry["empty"] or output.exists()):
+            self._completed[name] = entry
+            return False
+
+        new_entry = {"source": source_digest, "names": names, "digest": digest, "empty": False}
+        if is_template:
+            self._pending[name] = new_entry
+        else:
+            self._completed[name] = new_entry
+        return True
+
+    # Render callback: record a template once makejinja has rendered it successfully
+    def rendered(self, name: str, rendered: str, elapsed: float) -> None:
+        entry = self._pending.pop(name, None)
+        if entry is None:
+            return
+        entry["empty"] = rendered.strip() == "" and not self._config.keep_empty
+        self._completed[name] = entry
+
+    # Start another pass over the templates, comparing against the results of the last one
+    def restart(self) -> None:
+        self._entries.update(self._completed)
+        self._seen.clear()
+        self._pending.clear()
+        self._completed = {}
+        self._global_digest = None
+        self._input_digests.clear()
+
+    # Write the manifest; templates that failed to render are left out so they render next time
+    def save(self) -> None:
+        self._manifest_file.parent.mkdir(parents=True, exist_ok=True)
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "templates": dict(sorted(self._completed.items())),
+        }
+        tmp_file = self._manifest_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(manifest, indent=2) + "\n")
+        tmp_file.replace(self._manifest_file)
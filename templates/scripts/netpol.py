@@ -0,0 +1,968 @@
+import argparse
+import ipaddress
+import json
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import attrs
+import yaml
+
+from flux_graph import Resource, is_flux_kustomization, load_resources, parse_kustomization
+from render import load_config
+
+REPORT_VERSION = 1
+REPORT_FILE = Path(".cache/netpol/report.json")
+POLICY_KINDS = {
+    "NetworkPolicy": "networking.k8s.io/",
+    "CiliumNetworkPolicy": "cilium.io/",
+    "CiliumClusterwideNetworkPolicy": "cilium.io/",
+}
+# Cilium gives every endpoint its namespace and the labels of its namespace as labels
+NAMESPACE_LABEL = "io.kubernetes.pod.namespace"
+NAMESPACE_LABELS_PREFIX = "io.cilium.k8s.namespace.labels."
+# The namespace of cluster-wide policies in the report
+CLUSTERWIDE = "*"
+DIRECTIONS = ("ingress", "egress")
+ENDPOINT_FIELDS = {"ingress": "fromEndpoints", "egress": "toEndpoints"}
+ENTITY_FIELDS = {"ingress": "fromEntities", "egress": "toEntities"}
+CIDR_FIELDS = {"ingress": ("fromCIDR", "fromCIDRSet"), "egress": ("toCIDR", "toCIDRSet")}
+# Peers that are kept as they are, without being compared to other peers
+OTHER_PEER_FIELDS = {
+    "ingress": ("fromRequires", "fromNodes", "fromGroups"),
+    "egress": ("toRequires", "toNodes", "toGroups", "toServices"),
+}
+# Entities that are part of the `cluster` entity
+CLUSTER_ENTITIES = {
+    "cluster",
+    "host",
+    "remote-node",
+    "kube-apiserver",
+    "health",
+    "init",
+    "ingress",
+    "unmanaged",
+}
+
+
+# A label selector over the labels Cilium gives an endpoint, where the namespace is the
+# `io.kubernetes.pod.namespace` label and namespace labels are prefixed, so pod and namespace
+# selectors of both policy kinds compare the same way
+class Selector(NamedTuple):
+    labels: tuple[tuple[str, str], ...] = ()
+    expressions: tuple[tuple[str, str, tuple[str, ...]], ...] = ()
+
+
+# What a rule allows traffic from or to: every peer (`all`), endpoints, an entity, a CIDR with
+# its exceptions, an FQDN matcher, or another kind of peer that is kept as it is
+class Peer(NamedTuple):
+    kind: str
+    selector: Selector | None = None
+    value: str = ""
+    excepts: tuple[str, ...] = ()
+
+
+# A port range of a protocol (ANY for every protocol), a named port, or an ICMP type. Without
+# a start it is every port of the protocol.
+class Port(NamedTuple):
+    protocol: str
+    start: int | None = None
+    end: int | None = None
+    name: str = ""
+
+
+# A single peer and port a policy allows or denies for the endpoints it selects. A rule with
+# several peers and ports is flattened into one entry per pair.
+class Entry(NamedTuple):
+    policy: str
+    namespace: str
+    subject: Selector
+    direction: str
+    deny: bool
+    peer: Peer
+    # None for every port and protocol
+    port: Port | None
+    # JSON of the L7 rules, empty without any
+    l7: str
+
+
+class Policy(NamedTuple):
+    id: str
+    kind: str
+    file: str
+    namespace: str
+    subject: Selector
+    # Directions in which the policy denies what no policy allows
+    enforced: tuple[str, ...]
+    entries: list[Entry]
+    # Parts of the policy that never apply, with the reason
+    unreachable: list[str]
+
+
+# Label keys may carry the `k8s:` or `any:` source prefix in Cilium policies
+def canonical_key(key: str) -> str:
+    for prefix in ("k8s:", "any:"):
+        if key.startswith(prefix):
+            return key[len(prefix) :]
+    return key
+
+
+def namespace_key(key: str) -> str:
+    if key == "kubernetes.io/metadata.name":
+        return NAMESPACE_LABEL
+    return NAMESPACE_LABELS_PREFIX + key
+
+
+def parse_selector(selector: Any, namespace_labels: bool = False) -> Selector:
+    selector = selector if isinstance(selector, dict) else {}
+    key = namespace_key if namespace_labels else canonical_key
+    labels = {key(str(k)): str(v) for k, v in (selector.get("matchLabels") or {}).items()}
+    expressions = {
+        (
+            key(str(e.get("key"))),
+            str(e.get("operator")),
+            tuple(sorted(map(str, e.get("values") or []))),
+        )
+        for e in selector.get("matchExpressions") or []
+    }
+    return Selector(tuple(sorted(labels.items())), tuple(sorted(expressions)))
+
+
+def merge_selectors(a: Selector, b: Selector) -> Selector:
+    return Selector(
+        tuple(sorted(set(a.labels) | set(b.labels))),
+        tuple(sorted(set(a.expressions) | set(b.expressions))),
+    )
+
+
+def references(selector: Selector, key: str) -> bool:
+    return any(k == key for k, _ in selector.labels) or any(
+        k == key for k, _, _ in selector.expressions
+    )
+
+
+# Selectors of namespaced policies only match endpoints in the policy's namespace
+def in_namespace(selector: Selector, namespace: str | None) -> Selector:
+    if namespace is None or references(selector, NAMESPACE_LABEL):
+        return selector
+    return merge_selectors(selector, Selector(((NAMESPACE_LABEL, namespace),)))
+
+
+# Return the values a label can have on the endpoints a selector matches, None if any value
+def allowed_values(selector: Selector, key: str) -> set[str] | None:
+    allowed = None
+    for k, value in selector.labels:
+        if k == key:
+            allowed = {value} if allowed is None else allowed & {value}
+    for k, operator, values in selector.expressions:
+        if k == key and operator == "In":
+            allowed = set(values) if allowed is None else allowed & set(values)
+    return allowed
+
+
+def excluded_values(selector: Selector, key: str) -> set[str]:
+    return {
+        value
+        for k, operator, values in selector.expressions
+        if k == key and operator == "NotIn"
+        for value in values
+    }
+
+
+def requires_key(selector: Selector, key: str) -> bool:
+    return allowed_values(selector, key) is not None or (key, "Exists", ()) in selector.expressions
+
+
+def forbids_key(selector: Selector, key: str) -> bool:
+    return (key, "DoesNotExist", ()) in selector.expressions
+
+
+# Return True if every endpoint matched by `narrow` is also matched by `wide`
+def implies(narrow: Selector, wide: Selector) -> bool:
+    for key, value in wide.labels:
+        allowed = allowed_values(narrow, key)
+        if allowed is None or not allowed <= {value}:
+            return False
+    for key, operator, values in wide.expressions:
+        allowed = allowed_values(narrow, key)
+        if operator == "In":
+            matched = allowed is not None and allowed <= set(values)
+        elif operator == "NotIn":
+            matched = (
+                (allowed is not None and not allowed & set(values))
+                or set(values) <= excluded_values(narrow, key)
+                or forbids_key(narrow, key)
+            )
+        elif operator == "Exists":
+            matched = requires_key(narrow, key)
+        elif operator == "DoesNotExist":
+            matched = forbids_key(narrow, key)
+        else:
+            matched = False
+        if not matched:
+            return False
+    return True
+
+
+# Return False if no endpoint can match both selectors
+def may_overlap(a: Selector, b: Selector) -> bool:
+    keys = {k for k, _ in a.labels + b.labels} | {k for k, _, _ in a.expressions + b.expressions}
+    for key in keys:
+        allowed_a, allowed_b = allowed_values(a, key), allowed_values(b, key)
+        if allowed_a is not None and allowed_b is not None and not allowed_a & allowed_b:
+            return False
+        if (requires_key(a, key) and forbids_key(b, key)) or (
+            requires_key(b, key) and forbids_key(a, key)
+        ):
+            return False
+        if allowed_a is not None and allowed_a <= excluded_values(b, key):
+            return False
+        if allowed_b is not None and allowed_b <= excluded_values(a, key):
+            return False
+    return True
+
+
+def parse_network(value: str) -> ipaddress.IPv4Network | ipaddress.IPv6Network | None:
+    try:
+        return ipaddress.ip_network(value, strict=False)
+    except ValueError:
+        return None
+
+
+# Return the prefixes of a CIDR peer once its exceptions are carved out, as Cilium does
+def carve(peer: Peer) -> list[ipaddress.IPv4Network | ipaddress.IPv6Network]:
+    network = parse_network(peer.value)
+    if network is None:
+        return []
+    prefixes = [network]
+    for value in peer.excepts:
+        excluded = parse_network(value)
+        if excluded is None:
+            continue
+        carved = []
+        for prefix in prefixes:
+            if prefix.version != excluded.version or not prefix.overlaps(excluded):
+                carved.append(prefix)
+            elif not prefix.subnet_of(excluded):  # type: ignore[arg-type]
+                carved += prefix.address_exclude(excluded)  # type: ignore[arg-type]
+        prefixes = carved
+    return prefixes
+
+
+def cidr_covers(wide: Peer, narrow: Peer) -> bool:
+    outer, inner = parse_network(wide.value), parse_network(narrow.value)
+    if outer is None or inner is None or outer.version != inner.version:
+        return False
+    if not inner.subnet_of(outer):  # type: ignore[arg-type]
+        return False
+    # Addresses excluded by the wider peer must be excluded by the narrower one as well
+    for value in wide.excepts:
+        excluded = parse_network(value)
+        if excluded is None or not inner.overlaps(excluded):
+            continue
+        if not any(
+            (own := parse_network(other)) is not None
+            and own.version == excluded.version
+            and excluded.subnet_of(own)  # type: ignore[arg-type]
+            for other in narrow.excepts
+        ):
+            return False
+    return True
+
+
+def peer_covers(wide: Peer, narrow: Peer) -> bool:
+    if wide == narrow or wide.kind == "all":
+        return True
+    if wide.kind == "entity" and wide.value == "cluster":
+        return narrow.kind == "endpoints" or (
+            narrow.kind == "entity" and narrow.value in CLUSTER_ENTITIES
+        )
+    if wide.kind == narrow.kind == "endpoints":
+        return implies(narrow.selector or Selector(), wide.selector or Selector())
+    if wide.kind == narrow.kind == "cidr":
+        return cidr_covers(wide, narrow)
+    return False
+
+
+def port_covers(wide: Port | None, narrow: Port | None) -> bool:
+    if wide is None or wide == narrow:
+        return True
+    if narrow is None:
+        return False
+    if "ICMP" in (wide.protocol, narrow.protocol) or wide.protocol not in ("ANY", narrow.protocol):
+        return False
+    if wide.name or narrow.name:
+        return wide.name == narrow.name
+    if wide.start is None:
+        return True
+    if narrow.start is None or narrow.end is None or wide.end is None:
+        return False
+    return wide.start <= narrow.start and narrow.end <= wide.end
+
+
+# Return True if `wide` applies to everything `narrow` applies to. Allowed traffic with L7
+# rules is only compared to identical entries, since it is handled by the proxy.
+def covers(wide: Entry, narrow: Entry) -> bool:
+    if wide.direction != narrow.direction:
+        return False
+    if not wide.deny and (wide.l7 or narrow.l7) and wide.l7 != narrow.l7:
+        return False
+    return (
+        port_covers(wide.port, narrow.port)
+        and peer_covers(wide.peer, narrow.peer)
+        and implies(narrow.subject, wide.subject)
+    )
+
+
+def k8s_peer(peer: dict[str, Any], namespace: str) -> Peer:
+    if block := peer.get("ipBlock"):
+        return Peer("cidr", value=str(block.get("cidr")), excepts=tuple(block.get("except") or []))
+    selector = parse_selector(peer.get("podSelector"))
+    if "namespaceSelector" in peer:
+        namespaces = parse_selector(peer.get("namespaceSelector"), namespace_labels=True)
+        # A namespace selector without a namespace name matches endpoints in every namespace.
+        # Cilium scopes endpoint selectors without a namespace term to the policy's namespace,
+        # so the term is always explicit.
+        if not references(namespaces, NAMESPACE_LABEL):
+            namespaces = merge_selectors(
+                namespaces, Selector(expressions=((NAMESPACE_LABEL, "Exists", ()),))
+            )
+        return Peer("endpoints", merge_selectors(selector, namespaces))
+    return Peer("endpoints", in_namespace(selector, namespace))
+
+
+def k8s_port(port: dict[str, Any]) -> Port:
+    protocol = str(port.get("protocol") or "TCP").upper()
+    value = port.get("port")
+    if value is None:
+        return Port(protocol)
+    if isinstance(value, str) and not value.isdigit():
+        return Port(protocol, name=value)
+    return Port(protocol, int(value), int(port.get("endPort") or value))
+
+
+def cilium_port(port: dict[str, Any]) -> Port:
+    protocol = str(port.get("protocol") or "ANY").upper()
+    value = str(port.get("port") or "0")
+    if not value.isdigit():
+        return Port(protocol, name=value)
+    if value == "0":
+        return Port(protocol)
+    return Port(protocol, int(value), int(port.get("endPort") or value))
+
+
+def cilium_peers(rule: dict[str, Any], direction: str, namespace: str | None) -> list[Peer]:
+    peers = [
+        Peer("endpoints", in_namespace(parse_selector(selector), namespace))
+        for selector in rule.get(ENDPOINT_FIELDS[direction]) or []
+    ]
+    for entity in rule.get(ENTITY_FIELDS[direction]) or []:
+        peers.append(Peer("all") if entity == "all" else Peer("entity", value=str(entity)))
+    cidr_field, cidr_set_field = CIDR_FIELDS[direction]
+    peers += [Peer("cidr", value=str(cidr)) for cidr in rule.get(cidr_field) or []]
+    for item in rule.get(cidr_set_field) or []:
+        if "cidr" in item:
+            peers.append(
+                Peer("cidr", value=str(item["cidr"]), excepts=tuple(item.get("except") or []))
+            )
+        else:
+            peers.append(Peer("other", value=json.dumps({cidr_set_field: [item]}, sort_keys=True)))
+    if direction == "egress":
+        peers += [
+            Peer("fqdn", value=json.dumps(matcher, sort_keys=True))
+            for matcher in rule.get("toFQDNs") or []
+        ]
+    for field in OTHER_PEER_FIELDS[direction]:
+        peers += [
+            Peer("other", value=json.dumps({field: [item]}, sort_keys=True))
+            for item in rule.get(field) or []
+        ]
+    return peers
+
+
+def cilium_ports(rule: dict[str, Any]) -> list[tuple[Port | None, str]]:
+    ports: list[tuple[Port | None, str]] = []
+    for to_ports in rule.get("toPorts") or []:
+        l7 = json.dumps(to_ports["rules"], sort_keys=True) if to_ports.get("rules") else ""
+        ports += [(cilium_port(port), l7) for port in to_ports.get("ports") or []] or [(None, l7)]
+    for icmp in rule.get("icmps") or []:
+        for field in icmp.get("fields") or []:
+            family = field.get("family") or "IPv4"
+            ports.append((Port("ICMP", name=f"{family}:{field.get('type')}"), ""))
+    return ports
+
+
+# Return the policies of a document of any of the three kinds, flattened into entries
+def parse_policy(resource: Resource) -> list[Policy]:
+    document = resource.document
+    kind = document.get("kind")
+    if kind not in POLICY_KINDS or not str(document.get("apiVersion", "")).startswith(
+        POLICY_KINDS[kind]
+    ):
+        return []
+    metadata = document.get("metadata") or {}
+    namespace = None
+    if kind != "CiliumClusterwideNetworkPolicy":
+        namespace = resource.namespace or metadata.get("namespace") or "default"
+    policy_id = f"{kind}/{namespace + '/' if namespace else ''}{metadata.get('name')}"
+    if kind == "NetworkPolicy":
+        return [parse_k8s_policy(policy_id, resource.file, namespace or "default", document)]
+    specs = ([document["spec"]] if document.get("spec") else []) + list(document.get("specs") or [])
+    return [
+        parse_cilium_policy(
+            policy_id if len(specs) == 1 else f"{policy_id}[{index}]",
+            resource.file,
+            namespace,
+            spec,
+        )
+        for index, spec in enumerate(specs)
+        if isinstance(spec, dict)
+    ]
+
+
+def parse_k8s_policy(policy_id: str, file: str, namespace: str, document: dict[str, Any]) -> Policy:
+    spec = document.get("spec") or {}
+    subject = in_namespace(parse_selector(spec.get("podSelector")), namespace)
+    default_types = ["Ingress"] + (["Egress"] if "egress" in spec else [])
+    types = {str(t).lower() for t in spec.get("policyTypes") or default_types}
+    entries = []
+    unreachable = []
+    for direction, field in (("ingress", "from"), ("egress", "to")):
+        rules = spec.get(direction) or []
+        if rules and direction not in types:
+            unreachable.append(f"{direction} rules are ignored, policyTypes has no {direction}")
+            continue
+        for rule in rules:
+            peers = [k8s_peer(peer, namespace) for peer in rule.get(field) or []] or [Peer("all")]
+            ports = [k8s_port(port) for port in rule.get("ports") or []] or [None]
+            entries += [
+                Entry(policy_id, namespace, subject, direction, False, peer, port, "")
+                for peer in peers
+                for port in ports
+            ]
+    enforced = tuple(d for d in DIRECTIONS if d in types)
+    return Policy(
+        policy_id, "NetworkPolicy", file, namespace, subject, enforced, entries, unreachable
+    )
+
+
+def parse_cilium_policy(
+    policy_id: str, file: str, namespace: str | None, spec: dict[str, Any]
+) -> Policy:
+    kind = "CiliumNetworkPolicy" if namespace else "CiliumClusterwideNetworkPolicy"
+    if "endpointSelector" in spec:
+        subject = in_namespace(parse_selector(spec.get("endpointSelector")), namespace)
+    else:
+        # Node selectors select hosts, which are never compared with endpoints
+        subject = Selector(expressions=(("reserved:host", "Exists", ()),))
+    default_deny = spec.get("enableDefaultDeny") or {}
+    entries = []
+    enforced = []
+    for direction in DIRECTIONS:
+        present = False
+        for deny, field in ((False, direction), (True, f"{direction}Deny")):
+            if field not in spec:
+                continue
+            present = True
+            for rule in spec.get(field) or []:
+                peers = cilium_peers(rule, direction, namespace)
+                ports = cilium_ports(rule)
+                if not peers and ports:
+                    # Rules with only ports apply to every peer, empty rules to none
+                    peers = [Peer("all")]
+                entries += [
+                    Entry(
+                        policy_id,
+                        namespace or CLUSTERWIDE,
+                        subject,
+                        direction,
+                        deny,
+                        peer,
+                        port,
+                        l7,
+                    )
+                    for peer in peers
+                    for port, l7 in ports or [(None, "")]
+                ]
+        if present and default_deny.get(direction, True) is not False:
+            enforced.append(direction)
+    return Policy(
+        policy_id, kind, file, namespace or CLUSTERWIDE, subject, tuple(enforced), entries, []
+    )
+
+
+# Return the policies of every manifest applied from the apps directory: the namespace
+# kustomizations and the paths of the Flux Kustomizations they contain
+def collect(apps_dir: Path, root: Path, errors: list[str]) -> list[Policy]:
+    resources = load_resources(apps_dir, errors=errors)
+    kustomizations = [
+        parse_kustomization(resource.document, Path(resource.file), resource.namespace)
+        for resource in resources
+        if is_flux_kustomization(resource.document)
+    ]
+    for kustomization in kustomizations:
+        if not kustomization.path:
+            continue
+        path = root / kustomization.path
+        if not path.is_dir():
+            errors.append(f"{kustomization.id}: path {kustomization.path} does not exist")
+            continue
+        resources += load_resources(path, kustomization.target_namespace, errors)
+    policies: dict[str, Policy] = {}
+    for resource in resources:
+        for policy in parse_policy(resource):
+            policies.setdefault(policy.id, policy)
+    return list(policies.values())
+
+
+def describe_selector(selector: Selector | None) -> str:
+    if not selector:
+        return "{}"
+    parts = [f"{k}={v}" for k, v in selector.labels]
+    parts += [
+        f"{k} {op} ({','.join(values)})" if values else f"{op} {k}"
+        for k, op, values in selector.expressions
+    ]
+    return "{" + ", ".join(parts) + "}"
+
+
+def describe_peer(peer: Peer) -> str:
+    if peer.kind == "endpoints":
+        return f"endpoints {describe_selector(peer.selector)}"
+    if peer.kind == "cidr" and peer.excepts:
+        return f"cidr {peer.value} except {', '.join(peer.excepts)}"
+    return f"{peer.kind} {peer.value}".strip()
+
+
+def describe_port(port: Port | None) -> str:
+    if port is None:
+        return "any port"
+    if port.name:
+        return f"{port.protocol}/{port.name}"
+    if port.start is None:
+        return f"{port.protocol}/any"
+    if port.start == port.end:
+        return f"{port.protocol}/{port.start}"
+    return f"{port.protocol}/{port.start}-{port.end}"
+
+
+def describe(entry: Entry) -> str:
+    action = "deny" if entry.deny else "allow"
+    preposition = "from" if entry.direction == "ingress" else "to"
+    l7 = " with L7 rules" if entry.l7 else ""
+    return (
+        f"{entry.direction} {action} {preposition} {describe_peer(entry.peer)} on "
+        f"{describe_port(entry.port)}{l7}"
+    )
+
+
+# Number of port and mask pairs Cilium needs for a port range
+def port_prefixes(port: Port | None) -> int:
+    if port is None or port.start is None or port.end is None or port.end < port.start:
+        return 1
+    count, start = 0, port.start
+    while start <= port.end:
+        size = 1
+        while start % (size * 2) == 0 and start + size * 2 - 1 <= port.end:
+            size *= 2
+        start += size
+        count += 1
+    return count
+
+
+# Estimate the policy map entries of the endpoints a subject selects: one per peer identity
+# and port of every entry that may apply to them. Selectors count as one identity each.
+def map_entries(subject: Selector, entries: list[Entry]) -> int:
+    keys = {
+        (entry.direction, entry.deny, entry.peer, entry.port)
+        for entry in entries
+        if may_overlap(subject, entry.subject)
+    }
+    return sum(
+        (len(carve(peer)) if peer.kind == "cidr" else 1) * port_prefixes(port)
+        for _, _, peer, port in keys
+    )
+
+
+class Analysis(NamedTuple):
+    # Entries that never apply: policies' ignored sections, empty CIDRs, invalid port ranges
+    # and allowed traffic that a deny rule blocks
+    unreachable: list[tuple[str, str]]
+    # Entries allowed twice, with the entry they repeat
+    duplicates: list[tuple[Entry, Entry]]
+    # Entries covered by a wider entry, with the wider entry
+    shadowed: list[tuple[Entry, Entry]]
+    # Entries left after compaction
+    kept: list[Entry]
+
+
+def analyze(policies: list[Policy]) -> Analysis:
+    unreachable: list[tuple[str, str]] = [
+        (policy.id, reason) for policy in policies for reason in policy.unreachable
+    ]
+    reachable = []
+    for entry in (entry for policy in policies for entry in policy.entries):
+        if entry.peer.kind == "cidr" and parse_network(entry.peer.value) is None:
+            unreachable.append((entry.policy, f"{describe(entry)}: invalid CIDR"))
+        elif entry.peer.kind == "cidr" and not carve(entry.peer):
+            unreachable.append((entry.policy, f"{describe(entry)}: every address is excluded"))
+        elif entry.port and entry.port.end is not None and entry.port.end < (entry.port.start or 0):
+            unreachable.append((entry.policy, f"{describe(entry)}: endPort is below port"))
+        else:
+            reachable.append(entry)
+
+    denies = [entry for entry in reachable if entry.deny]
+    allows = []
+    for entry in reachable:
+        if entry.deny:
+            continue
+        blocked_by = next((deny for deny in denies if covers(deny, entry)), None)
+        if blocked_by:
+            unreachable.append((entry.policy, f"{describe(entry)}: denied by {blocked_by.policy}"))
+        else:
+            allows.append(entry)
+
+    duplicates = []
+    unique: dict[tuple[Any, ...], Entry] = {}
+    for entry in allows:
+        key = (entry.subject, entry.direction, entry.peer, entry.port, entry.l7)
+        if key in unique:
+            duplicates.append((entry, unique[key]))
+        else:
+            unique[key] = entry
+
+    candidates = list(unique.values())
+    by_direction = defaultdict(list)
+    for index, entry in enumerate(candidates):
+        by_direction[entry.direction].append((index, entry))
+    shadowed = []
+    kept = []
+    for index, entry in enumerate(candidates):
+        wider = next(
+            (
+                other
+                for other_index, other in by_direction[entry.direction]
+                if other_index != index and covers(other, entry)
+                # Of two equivalent entries the first one is kept
+                and (other_index < index or not covers(entry, other))
+            ),
+            None,
+        )
+        if wider:
+            shadowed.append((entry, wider))
+        else:
+            kept.append(entry)
+    return Analysis(unreachable, duplicates, shadowed, kept + denies)
+
+
+def build_report(policies: list[Policy], analysis: Analysis) -> dict[str, Any]:
+    entries = [entry for policy in policies for entry in policy.entries]
+    namespaces: dict[str, dict[str, Any]] = {}
+    for policy in sorted(policies, key=lambda p: (p.namespace, p.id)):
+        namespace = namespaces.setdefault(
+            policy.namespace,
+            {
+                "policies": 0,
+                "rules": 0,
+                "duplicates": 0,
+                "shadowed": 0,
+                "unreachable": 0,
+                "subjects": {},
+            },
+        )
+        namespace["policies"] += 1
+        namespace["rules"] += len(policy.entries)
+        namespace["subjects"][describe_selector(policy.subject)] = policy.subject
+    for field, found in (("duplicates", analysis.duplicates), ("shadowed", analysis.shadowed)):
+        for entry, _ in found:
+            namespaces[entry.namespace][field] += 1
+    policy_namespaces = {policy.id: policy.namespace for policy in policies}
+    for policy_id, _ in analysis.unreachable:
+        namespaces[policy_namespaces[policy_id]]["unreachable"] += 1
+    for namespace in namespaces.values():
+        subjects = namespace.pop("subjects")
+        namespace["policy_map_entries"] = {
+            name: {
+                "before": map_entries(subject, entries),
+                "after": map_entries(subject, analysis.kept),
+            }
+            for name, subject in sorted(subjects.items())
+        }
+
+    return {
+        "version": REPORT_VERSION,
+        "policies": len(policies),
+        "rules": len(entries),
+        "namespaces": namespaces,
+        "unreachable": [
+            {"policy": policy_id, "reason": reason} for policy_id, reason in analysis.unreachable
+        ],
+        "duplicates": [
+            {"policy": entry.policy, "rule": describe(entry), "same_as": other.policy}
+            for entry, other in analysis.duplicates
+        ],
+        "shadowed": [
+            {
+                "policy": entry.policy,
+                "rule": describe(entry),
+                "shadowed_by": other.policy,
+                "by_rule": describe(other),
+            }
+            for entry, other in analysis.shadowed
+        ],
+    }
+
+
+def selector_document(selector: Selector) -> dict[str, Any]:
+    document: dict[str, Any] = {}
+    if selector.labels:
+        document["matchLabels"] = dict(selector.labels)
+    if selector.expressions:
+        document["matchExpressions"] = [
+            {"key": key, "operator": operator, **({"values": list(values)} if values else {})}
+            for key, operator, values in selector.expressions
+        ]
+    return document
+
+
+def peer_fields(kind: str, peers: list[Peer], direction: str) -> list[dict[str, Any]]:
+    if kind == "all":
+        return [{ENTITY_FIELDS[direction]: ["all"]}]
+    if kind == "entity":
+        return [{ENTITY_FIELDS[direction]: [peer.value for peer in peers]}]
+    if kind == "endpoints":
+        return [
+            {
+                ENDPOINT_FIELDS[direction]: [
+                    selector_document(p.selector or Selector()) for p in peers
+                ]
+            }
+        ]
+    if kind == "cidr":
+        return [
+            {
+                CIDR_FIELDS[direction][1]: [
+                    {"cidr": p.value, **({"except": list(p.excepts)} if p.excepts else {})}
+                    for p in peers
+                ]
+            }
+        ]
+    if kind == "fqdn":
+        return [{"toFQDNs": [json.loads(p.value) for p in peers]}]
+    return [json.loads(p.value) for p in peers]
+
+
+# Return the port fields of the rules a set of peers needs. Every port without L7 rules, ports
+# and ICMP types, which Cilium does not allow in the same rule, each get their own rule.
+def port_fields(ports: frozenset[tuple[Port | None, str]]) -> list[dict[str, Any]]:
+    fields: list[dict[str, Any]] = []
+    if (None, "") in ports:
+        fields.append({})
+        ports = ports - {(None, "")}
+    by_l7: dict[str, list[Port]] = defaultdict(list)
+    icmps = []
+    for port, l7 in sorted(ports, key=lambda p: (p[1], str(p[0]))):
+        if port is None:
+            by_l7.setdefault(l7, [])
+        elif port.protocol == "ICMP":
+            family, _, icmp_type = port.name.partition(":")
+            icmps.append(
+                {"type": int(icmp_type) if icmp_type.isdigit() else icmp_type, "family": family}
+            )
+        else:
+            by_l7[l7].append(port)
+    to_ports = []
+    for l7, numbered in by_l7.items():
+        item: dict[str, Any] = {}
+        if numbered:
+            item["ports"] = [
+                {
+                    "port": port.name or str(port.start or 0),
+                    "protocol": port.protocol,
+                    **({"endPort": port.end} if port.end and port.end != port.start else {}),
+                }
+                for port in numbered
+            ]
+        if l7:
+            item["rules"] = json.loads(l7)
+        if item:
+            to_ports.append(item)
+    if to_ports:
+        fields.append({"toPorts": to_ports})
+    if icmps:
+        fields.append({"icmps": [{"fields": icmps}]})
+    return fields
+
+
+# Return the rules of one direction: peers that allow the same ports share a rule
+def compact_rules(entries: list[Entry], direction: str) -> list[dict[str, Any]]:
+    ports: dict[Peer, set[tuple[Port | None, str]]] = defaultdict(set)
+    for entry in entries:
+        ports[entry.peer].add((entry.port, entry.l7))
+    groups: dict[tuple[str, frozenset[tuple[Port | None, str]]], list[Peer]] = defaultdict(list)
+    for peer, peer_ports in ports.items():
+        groups[(peer.kind, frozenset(peer_ports))].append(peer)
+    rules = []
+    for (kind, group_ports), peers in sorted(groups.items(), key=lambda g: str(g[0])):
+        for fields in peer_fields(kind, sorted(peers), direction):
+            rules += [{**fields, **ports} for ports in port_fields(group_ports)]
+    return rules
+
+
+# Return one CiliumNetworkPolicy (or cluster-wide policy) per namespace and selected endpoints,
+# with the entries left after compaction of every policy that selects exactly those endpoints
+def compacted_policies(
+    policies: list[Policy], kept: list[Entry]
+) -> dict[str, list[dict[str, Any]]]:
+    groups: dict[tuple[str, Selector], list[Policy]] = defaultdict(list)
+    for policy in policies:
+        groups[(policy.namespace, policy.subject)].append(policy)
+    kept_by_policy: dict[str, list[Entry]] = defaultdict(list)
+    for entry in kept:
+        kept_by_policy[entry.policy].append(entry)
+
+    documents: dict[str, list[dict[str, Any]]] = defaultdict(list)
+    for (namespace, subject), group in sorted(
+        groups.items(), key=lambda g: (g[0][0], str(g[0][1]))
+    ):
+        entries = [entry for policy in group for entry in kept_by_policy[policy.id]]
+        enforced = {direction for policy in group for direction in policy.enforced}
+        spec: dict[str, Any] = {
+            "description": "Compacted from " + ", ".join(policy.id for policy in group)
+        }
+        clusterwide = namespace == CLUSTERWIDE
+        endpoints = (
+            subject
+            if clusterwide
+            else Selector(
+                tuple(label for label in subject.labels if label[0] != NAMESPACE_LABEL),
+                subject.expressions,
+            )
+        )
+        spec["endpointSelector"] = selector_document(endpoints)
+        default_deny = {}
+        for direction in DIRECTIONS:
+            allowed = [e for e in entries if e.direction == direction and not e.deny]
+            denied = [e for e in entries if e.direction == direction and e.deny]
+            if allowed or direction in enforced:
+                # An empty rule selects nothing, it only turns on the default deny
+                spec[direction] = compact_rules(allowed, direction) or [{}]
+            if denied:
+                spec[f"{direction}Deny"] = compact_rules(denied, direction)
+            if (allowed or denied) and direction not in enforced:
+                default_deny[direction] = False
+        if default_deny:
+            spec["enableDefaultDeny"] = default_deny
+        name = group[0].id.rpartition("/")[2]
+        metadata = {"name": name if len(group) == 1 else f"{name}-merged"}
+        if not clusterwide:
+            metadata["namespace"] = namespace
+        documents[namespace].append(
+            {
+                "apiVersion": "cilium.io/v2",
+                "kind": "CiliumClusterwideNetworkPolicy" if clusterwide else "CiliumNetworkPolicy",
+                "metadata": metadata,
+                "spec": spec,
+            }
+        )
+    return documents
+
+
+def write_compacted(documents: dict[str, list[dict[str, Any]]], directory: Path) -> None:
+    directory.mkdir(parents=True, exist_ok=True)
+    for namespace, policies in documents.items():
+        name = "clusterwide" if namespace == CLUSTERWIDE else namespace
+        (directory / f"{name}.yaml").write_text(
+            yaml.safe_dump_all(policies, explicit_start=True, sort_keys=False)
+        )
+
+
+def write_report(report: dict[str, Any], report_file: Path) -> None:
+    report_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = report_file.with_suffix(".tmp")
+    tmp_file.write_text(json.dumps(report, indent=2) + "\n")
+    tmp_file.replace(report_file)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Find duplicate, shadowed and unreachable rules in the rendered "
+        "NetworkPolicies and CiliumNetworkPolicies"
+    )
+    parser.add_argument(
+        "path",
+        type=Path,
+        nargs="?",
+        default=Path("kubernetes/apps"),
+        help="directory applied by the cluster-apps Kustomization (default: kubernetes/apps)",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=REPORT_FILE,
+        help=f"JSON report file (default: {REPORT_FILE})",
+    )
+    parser.add_argument(
+        "--emit",
+        type=Path,
+        help="write the compacted policies as CiliumNetworkPolicies, one file per namespace, "
+        "to this directory",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="list every duplicate and shadowed rule"
+    )
+    parser.add_argument(
+        "--config", type=Path, default=Path("makejinja.toml"), help="makejinja config file"
+    )
+    args = parser.parse_args()
+
+    if not args.path.is_dir():
+        print(f"Directory does not exist: {args.path}, run `task configure` first")
+        return 1
+    config = attrs.evolve(load_config(args.config), quiet=True)
+    errors: list[str] = []
+    policies = collect(args.path, Path(config.output), errors)
+    analysis = analyze(policies)
+    report = build_report(policies, analysis)
+    report["errors"] = errors
+    write_report(report, args.output)
+    if args.emit:
+        write_compacted(compacted_policies(policies, analysis.kept), args.emit)
+
+    for error in errors:
+        print(f"Warning: {error}")
+    header = ("NAMESPACE", "POLICIES", "RULES", "DUPLICATE", "SHADOWED", "UNREACHABLE")
+    print(f"{header[0]:<24}" + "".join(f"{column:>12}" for column in header[1:]) + "  MAP ENTRIES")
+    for name, namespace in report["namespaces"].items():
+        before = sum(s["before"] for s in namespace["policy_map_entries"].values())
+        after = sum(s["after"] for s in namespace["policy_map_entries"].values())
+        counts = [
+            namespace[key] for key in ("policies", "rules", "duplicates", "shadowed", "unreachable")
+        ]
+        print(
+            f"{name:<24}" + "".join(f"{count:>12}" for count in counts) + f"  {before} -> {after}"
+        )
+    for item in report["unreachable"]:
+        print(f"Unreachable: {item['policy']}: {item['reason']}")
+    if args.verbose:
+        for item in report["duplicates"]:
+            print(f"Duplicate: {item['policy']}: {item['rule']} (also in {item['same_as']})")
+        for item in report["shadowed"]:
+            print(
+                f"Shadowed: {item['policy']}: {item['rule']} "
+                f"(covered by {item['shadowed_by']}: {item['by_rule']})"
+            )
+    print(
+        f"{report['policies']} policies with {report['rules']} rules: "
+        f"{len(report['duplicates'])} duplicate, {len(report['shadowed'])} shadowed, "
+        f"{len(report['unreachable'])} unreachable"
+    )
+    if args.emit:
+        print(f"Compacted policies written to {args.emit}")
+    print(f"Report written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
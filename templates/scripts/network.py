@@ -0,0 +1,219 @@
+import functools
+import hashlib
+import ipaddress
+import json
+from typing import Any, NamedTuple
+
+# Networks of the cluster: name, the key holding its CIDR and the default CIDR
+NETWORKS = [
+    ("node", "node_cidr", None),
+    ("pod", "cluster_pod_cidr", "10.42.0.0/16"),
+    ("service", "cluster_svc_cidr", "10.43.0.0/16"),
+]
+# `*_addr` keys of devices outside the cluster, which may share an address with the cluster
+EXTERNAL_ADDRESS_KEYS = {"cilium_bgp_router_addr"}
+
+IPNetwork = ipaddress.IPv4Network | ipaddress.IPv6Network
+IPAddress = ipaddress.IPv4Address | ipaddress.IPv6Address
+
+
+@functools.cache
+def _parse_network(value: str | int) -> IPNetwork | None:
+    try:
+        return ipaddress.ip_network(value, strict=False)
+    except ValueError:
+        return None
+
+
+@functools.cache
+def _parse_address(value: str | int) -> IPAddress | None:
+    try:
+        return ipaddress.ip_address(value)
+    except ValueError:
+        return None
+
+
+# Return a CIDR as a network object, parsed once, or None if it is not a valid CIDR
+def parse_network(value: Any) -> IPNetwork | None:
+    return _parse_network(value) if isinstance(value, (str, int)) else None
+
+
+# Return an address as an address object, parsed once, or None if it is not a valid address
+def parse_address(value: Any) -> IPAddress | None:
+    return _parse_address(value) if isinstance(value, (str, int)) else None
+
+
+# A network as an inclusive range of integers, so membership and overlap are integer compares
+class AddressRange(NamedTuple):
+    version: int
+    first: int
+    last: int
+    cidr: str
+
+    @classmethod
+    def from_network(cls, network: IPNetwork) -> "AddressRange":
+        first = int(network.network_address)
+        return cls(network.version, first, first + network.num_addresses - 1, str(network))
+
+    def __contains__(self, address: object) -> bool:
+        return (
+            isinstance(address, (ipaddress.IPv4Address, ipaddress.IPv6Address))
+            and address.version == self.version
+            and self.first <= int(address) <= self.last
+        )
+
+    def overlaps(self, other: "AddressRange") -> bool:
+        return (
+            self.version == other.version and self.first <= other.last and other.first <= self.last
+        )
+
+
+# Return True if an address is inside a CIDR
+def in_network(address: str, cidr: str) -> bool:
+    network, ip = parse_network(cidr), parse_address(address)
+    return network is not None and ip is not None and ip in AddressRange.from_network(network)
+
+
+# The cluster network parsed once from the data: the node, pod and service CIDRs as integer
+# ranges, and every address in use (nodes, VIPs, LoadBalancer addresses and the default gateway)
+# keyed by its integer value. Lookups, conflict checks and allocations never parse again.
+class NetworkModel:
+    def __init__(self, data: dict[str, Any] | None = None):
+        self.load(data or {})
+
+    def load(self, data: dict[str, Any]) -> None:
+        self._ranges: dict[str, AddressRange] = {}
+        self._keys: dict[str, str] = {}
+        for name, key, default in NETWORKS:
+            network = parse_network(data.get(key) or default)
+            if network is not None:
+                self._ranges[name] = AddressRange.from_network(network)
+                self._keys[name] = key
+
+        # Owners of each address in use, in the order they were declared
+        self._owners: dict[tuple[int, int], list[str]] = {}
+        self._addresses: dict[str, IPAddress] = {}
+        nodes = data.get("nodes")
+        for index, node in enumerate(nodes if isinstance(nodes, list) else []):
+            if isinstance(node, dict):
+                self._add(f"nodes[{index}].address ({node.get('name')})", node.get("address"))
+        for key, value in data.items():
+            if key.endswith("_addr") and key not in EXTERNAL_ADDRESS_KEYS:
+                self._add(key, value)
+        gateway = data.get("node_default_gateway")
+        if not gateway and "node" in self._ranges:
+            gateway = str(ipaddress.ip_address(self._ranges["node"].first + 1))
+        self._add("node_default_gateway", gateway)
+
+        # Owner of each allocated address, to catch two owners that probe to the same address
+        self._allocated: dict[tuple[int, int], str] = {}
+        self._digest: str | None = None
+
+    def _add(self, owner: str, value: Any) -> None:
+        address = parse_address(value) if value else None
+        if address is not None:
+            self._addresses[owner] = address
+            self._owners.setdefault((address.version, int(address)), []).append(owner)
+
+    # Return the range of a network name ("node", "pod" or "service") or of a CIDR
+    def range(self, network: str) -> AddressRange | None:
+        if network in self._ranges:
+            return self._ranges[network]
+        parsed = parse_network(network)
+        return AddressRange.from_network(parsed) if parsed is not None else None
+
+    # Return what uses an address: node names and VIP and LoadBalancer keys
+    def owners(self, address: str) -> list[str]:
+        ip = parse_address(address)
+        if ip is None:
+            return []
+        return list(self._owners.get((ip.version, int(ip)), []))
+
+    # Return a host address of a network for an owner. The address is derived from the owner
+    # alone: a hash of the owner picks a host, and addresses in use by nodes, VIPs or the gateway
+    # are skipped by probing the next ones. It does not depend on which templates were rendered
+    # before or in which worker, so it is covered by digest(). Hashed owners collide like any
+    # hash (in a /24, likely from about 20 owners on), and two owners on the same address are an
+    # error; `index` pins an owner to a host number instead, like nthhost.
+    def allocate(self, owner: str, network: str = "node", index: int | None = None) -> str:
+        address_range = self.range(network)
+        if address_range is None:
+            raise ValueError(f"Unknown network: {network}")
+        # Skip the network address (and the broadcast address of IPv4 networks)
+        first = address_range.first + 1
+        size = address_range.last - (1 if address_range.version == 4 else 0) - first + 1
+        if index is not None:
+            if not 1 <= index <= size:
+                raise ValueError(
+                    f"allocate_address({owner!r}): no host {index} in {address_range.cidr}"
+                )
+            value = address_range.first + index
+            if used_by := self._owners.get((address_range.version, value)):
+                raise ValueError(
+                    f"allocate_address({owner!r}): {ipaddress.ip_address(value)} is used by "
+                    f"{', '.join(used_by)}"
+                )
+        else:
+            if size <= 0:
+                raise ValueError(f"No free addresses left in {address_range.cidr}")
+            digest = hashlib.sha256(owner.encode("utf-8")).digest()
+            start = int.from_bytes(digest[:16], "big") % size
+            for offset in range(min(size, len(self._owners) + 1)):
+                value = first + (start + offset) % size
+                if (address_range.version, value) not in self._owners:
+                    break
+            else:
+                raise ValueError(f"No free addresses left in {address_range.cidr}")
+
+        address = str(ipaddress.ip_address(value))
+        previous = self._allocated.setdefault((address_range.version, value), owner)
+        if previous != owner:
+            raise ValueError(
+                f"allocate_address({owner!r}): {address} is also allocated to {previous!r}, "
+                "pin one of them to another host with index="
+            )
+        return address
+
+    # Return every conflict: overlapping networks, addresses used twice, nodes or the API VIP
+    # outside node_cidr, and addresses inside the pod or service network
+    def conflicts(self) -> list[str]:
+        conflicts = []
+        names = list(self._ranges)
+        for index, name in enumerate(names):
+            for other in names[index + 1 :]:
+                if self._ranges[name].overlaps(self._ranges[other]):
+                    conflicts.append(
+                        f"{self._keys[name]} {self._ranges[name].cidr} overlaps "
+                        f"{self._keys[other]} {self._ranges[other].cidr}"
+                    )
+
+        node_range = self._ranges.get("node")
+        for owner, address in self._addresses.items():
+            if node_range and owner.startswith(("nodes[", "cluster_api_addr")):
+                if address not in node_range:
+                    conflicts.append(f"{owner}: {address} is not in node_cidr {node_range.cidr}")
+            for name in ("pod", "service"):
+                if name in self._ranges and address in self._ranges[name]:
+                    conflicts.append(
+                        f"{owner}: {address} is inside {self._keys[name]} {self._ranges[name].cidr}"
+                    )
+
+        for (version, value), owners in self._owners.items():
+            if len(owners) > 1:
+                address = ipaddress.ip_address(value)
+                used_by = ", ".join(owners[:-1])
+                conflicts.append(f"{owners[-1]}: {address} is also used by {used_by}")
+        return conflicts
+
+    # Digest of the networks and addresses, so incremental renders notice changes to them
+    def digest(self) -> str:
+        if self._digest is None:
+            state = [
+                sorted(self._ranges.items()),
+                sorted(
+                    (f"{version}:{value}", owners)
+                    for (version, value), owners in self._owners.items()
+                ),
+            ]
+            self._digest = hashlib.sha256(json.dumps(state).encode("utf-8")).hexdigest()
+        return self._digest
@@ -0,0 +1,133 @@
+import base64
+import gzip
+import json
+from typing import Any
+
+import yaml
+
+# The API server rejects ConfigMaps and Secrets whose data is larger than 1 MiB. Renders fail
+# once an object reaches 90% of that, so there is room left for the next dashboard or model.
+OBJECT_DATA_LIMIT = 1024 * 1024
+OBJECT_DATA_MARGIN = 0.9
+SIZED_KINDS = ("ConfigMap", "Secret")
+
+
+class ObjectSizeError(ValueError):
+    pass
+
+
+# Return compact JSON, keeping a trailing newline so the value of a `|` block scalar keeps it
+def dump_compact(value: Any, source: str) -> str:
+    compact = json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+    return compact + "\n" if source.endswith("\n") else compact
+
+
+# Return a Grafana dashboard without exact duplicate panels, and without the datasource of
+# every query that uses the datasource of its panel, which Grafana falls back to anyway
+def dedupe_dashboard(dashboard: Any) -> Any:
+    if not isinstance(dashboard, dict) or not isinstance(dashboard.get("panels"), list):
+        return dashboard
+    return {**dashboard, "panels": dedupe_panels(dashboard["panels"])}
+
+
+def dedupe_panels(panels: list[Any]) -> list[Any]:
+    seen: set[str] = set()
+    deduped = []
+    for panel in panels:
+        key = json.dumps(panel, sort_keys=True)
+        if key in seen:
+            continue
+        seen.add(key)
+        if isinstance(panel, dict):
+            panel = dict(panel)
+            if isinstance(panel.get("panels"), list):
+                panel["panels"] = dedupe_panels(panel["panels"])
+            datasource = panel.get("datasource")
+            if datasource and isinstance(panel.get("targets"), list):
+                panel["targets"] = [
+                    {k: v for k, v in target.items() if k != "datasource"}
+                    if isinstance(target, dict) and target.get("datasource") == datasource
+                    else target
+                    for target in panel["targets"]
+                ]
+        deduped.append(panel)
+    return deduped
+
+
+# Filter: minify embedded JSON, e.g. `#% filter minify_json(dedupe=true) | indent(4, true) %#`
+# around a Grafana dashboard. dedupe=true also drops repeated panels and query datasources.
+def minify_json(value: str, dedupe: bool = False) -> str:
+    document = json.loads(value)
+    if dedupe:
+        document = dedupe_dashboard(document)
+    return dump_compact(document, value)
+
+
+# Writes multi-line strings double-quoted with `\n` escapes, so the document stays on one line,
+# and sets in sorted order, so renders do not depend on the hash seed
+class CompactDumper(yaml.SafeDumper):
+    def represent_str(self, data: str) -> yaml.Node:
+        style = '"' if "\n" in data else None
+        return self.represent_scalar("tag:yaml.org,2002:str", data, style=style)
+
+    def represent_set(self, data: Any) -> yaml.Node:
+        items = {item: None for item in sorted(data, key=str)}
+        return self.represent_mapping("tag:yaml.org,2002:set", items)
+
+
+CompactDumper.add_representer(str, CompactDumper.represent_str)
+CompactDumper.add_representer(set, CompactDumper.represent_set)
+
+
+# Filter: minify an embedded YAML document by writing it in flow style on one line. Unlike JSON,
+# flow style keeps every YAML type, e.g. dates, binary values and sets. Comments are dropped.
+def minify_yaml(value: str) -> str:
+    compact = yaml.dump(
+        yaml.safe_load(value),
+        Dumper=CompactDumper,
+        default_flow_style=True,
+        sort_keys=False,
+        allow_unicode=True,
+        width=float("inf"),
+    ).removesuffix("\n")
+    # Plain scalars end with a document end marker that the filter block does not need
+    compact = compact.removesuffix("\n...")
+    return compact + "\n" if value.endswith("\n") else compact
+
+
+# Filter: gzip and base64-encode a value for the `binaryData` of a ConfigMap, for consumers
+# that decompress it themselves. The gzip header has no timestamp, so renders are reproducible.
+def gzip_base64(value: str) -> str:
+    return base64.b64encode(gzip.compress(value.encode("utf-8"), mtime=0)).decode("ascii")
+
+
+# Return the size the API server counts for the data of a ConfigMap or Secret
+def object_data_size(document: dict[str, Any]) -> int:
+    size = 0
+    for field, encoded in (("data", document.get("kind") == "Secret"), ("binaryData", True)):
+        for key, value in (document.get(field) or {}).items():
+            value = str(value).encode("utf-8")
+            size += len(str(key)) + (len(base64.b64decode(value)) if encoded else len(value))
+    for key, value in (document.get("stringData") or {}).items():
+        size += len(str(key)) + len(str(value).encode("utf-8"))
+    return size
+
+
+# Render callback: fail the render when a ConfigMap or Secret nears the size limit. The data
+# of an object is never larger than the text it is rendered from, so smaller outputs are not
+# parsed.
+def check_object_sizes(name: str, rendered: str, elapsed: float) -> None:
+    limit = int(OBJECT_DATA_LIMIT * OBJECT_DATA_MARGIN)
+    if len(rendered.encode("utf-8")) < limit:
+        return
+    if not any(f"kind: {kind}" in rendered for kind in SIZED_KINDS):
+        return
+    for document in yaml.safe_load_all(rendered):
+        if isinstance(document, dict) and document.get("kind") in SIZED_KINDS:
+            size = object_data_size(document)
+            if size >= limit:
+                raise ObjectSizeError(
+                    f"{name}: {document['kind']} {document.get('metadata', {}).get('name')} "
+                    f"holds {size} bytes of data, close to the limit of {OBJECT_DATA_LIMIT} "
+                    "bytes; pack it with the minify_json or minify_yaml filters or split it"
+                )
@@ -0,0 +1,371 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import attrs
+import yaml
+from makejinja import app
+
+from render import OutputFile, load_config, render_stream
+
+YAML_SUFFIXES = (".yaml", ".yml")
+SOPS_STATE_FILE = Path(".cache/sops/state.json")
+SOPS_STATE_VERSION = 1
+# Metadata sops adds to encrypted YAML, JSON and dotenv files
+ENCRYPTED = re.compile(rb'^sops:\s*$|"sops":\s*\{|^sops_mac=', re.MULTILINE)
+ENCRYPTED_VALUE = re.compile(r"^ENC\[\w+,")
+SENSITIVE = "(sensitive)"
+MAX_VALUE_LENGTH = 80
+# Marks a field that only exists on one side of a diff
+MISSING = object()
+
+
+# A YAML document of a rendered or existing file. Resources are identified by apiVersion, kind,
+# namespace and name, so they are matched even when they move to another file; other documents
+# by their file and position.
+class Document(NamedTuple):
+    identity: str
+    file: str
+    content: Any
+    # Values of secrets are never printed, and values sops encrypted cannot be compared
+    sensitive: bool
+    encrypted: bool
+
+
+class FieldChange(NamedTuple):
+    path: str
+    old: Any
+    new: Any
+
+
+# The differences between the rendered tree and the tree on disk
+class Plan(NamedTuple):
+    added: list[Document]
+    removed: list[Document]
+    changed: list[tuple[Document, Document, list[FieldChange]]]
+    # Files compared as text because they are not YAML or did not parse, e.g. Helm templates
+    changed_files: list[tuple[str, str]]
+    # Files that changed only in formatting or comments
+    reformatted: list[str]
+    # Files below the rendered directories that are no longer rendered but are left in place
+    stale: list[str]
+    unchanged: int
+
+
+def sha256(value: bytes) -> str:
+    return hashlib.sha256(value).hexdigest()
+
+
+def is_encrypted(content: bytes) -> bool:
+    return ENCRYPTED.search(content) is not None
+
+
+def is_sensitive(file: str, document: Any) -> bool:
+    return ".sops." in Path(file).name or (
+        isinstance(document, dict) and document.get("kind") == "Secret"
+    )
+
+
+# Return the plaintext and ciphertext hashes recorded by the encrypt-secrets task
+def load_sops_state(state_file: Path) -> dict[str, dict[str, str]]:
+    try:
+        state = json.loads(state_file.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if state.get("version") != SOPS_STATE_VERSION:
+        return {}
+    return state.get("files", {})
+
+
+def document_identity(document: Any, file: str, index: int, count: int) -> str:
+    if isinstance(document, dict):
+        metadata = document.get("metadata")
+        name = metadata.get("name") if isinstance(metadata, dict) else None
+        if document.get("kind") and name:
+            namespace = metadata.get("namespace")
+            name = f"{namespace}/{name}" if namespace else name
+            return f"{document['kind']} {name} ({document.get('apiVersion')})"
+    return f"{file}[{index}]" if count > 1 else file
+
+
+# Return the documents of a YAML file, or None if the file is not YAML or does not parse
+def load_documents(content: bytes, file: str) -> list[Document] | None:
+    if not file.endswith(YAML_SUFFIXES):
+        return None
+    try:
+        documents = [d for d in yaml.safe_load_all(content) if d is not None]
+    except yaml.YAMLError:
+        return None
+    encrypted = is_encrypted(content)
+    loaded = []
+    for index, document in enumerate(documents):
+        if encrypted and isinstance(document, dict):
+            document = {key: value for key, value in document.items() if key != "sops"}
+        loaded.append(
+            Document(
+                document_identity(document, file, index, len(documents)),
+                file,
+                document,
+                is_sensitive(file, document),
+                encrypted,
+            )
+        )
+    return loaded
+
+
+# Return the key of every item if the list is a list of objects with unique names, like
+# containers, ports or volumes, so items are matched by name instead of position
+def list_keys(items: list[Any]) -> list[str] | None:
+    if not items or not all(isinstance(item, dict) and "name" in item for item in items):
+        return None
+    keys = [str(item["name"]) for item in items]
+    return keys if len(set(keys)) == len(keys) else None
+
+
+# Return the fields that differ between two values, as dotted paths. Values sops encrypted are
+# skipped, only fields that were added or removed can be told apart there.
+def diff_values(old: Any, new: Any, path: str = "") -> list[FieldChange]:
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = []
+        for key in [*old, *(key for key in new if key not in old)]:
+            child = f"{path}.{key}" if path else str(key)
+            changes += diff_values(old.get(key, MISSING), new.get(key, MISSING), child)
+        return changes
+    if isinstance(old, list) and isinstance(new, list):
+        old_keys, new_keys = list_keys(old), list_keys(new)
+        if old_keys is not None and new_keys is not None:
+            old_items, new_items = dict(zip(old_keys, old)), dict(zip(new_keys, new))
+            return [
+                change
+                for key in [*old_keys, *(key for key in new_keys if key not in old_items)]
+                for change in diff_values(
+                    old_items.get(key, MISSING), new_items.get(key, MISSING), f"{path}[{key}]"
+                )
+            ]
+        return [
+            change
+            for index in range(max(len(old), len(new)))
+            for change in diff_values(
+                old[index] if index < len(old) else MISSING,
+                new[index] if index < len(new) else MISSING,
+                f"{path}[{index}]",
+            )
+        ]
+    if isinstance(old, str) and ENCRYPTED_VALUE.match(old) and new is not MISSING:
+        return []
+    if old == new:
+        return []
+    return [FieldChange(path, old, new)]
+
+
+# Compare the rendered files with the files in the output directory. Files with the same bytes,
+# and secrets whose plaintext hash matches the one recorded when they were encrypted, are skipped
+# without being parsed.
+def plan(
+    files: list[OutputFile], output: Path, sops_state: dict[str, dict[str, str]]
+) -> Plan:
+    old_documents: dict[str, Document] = {}
+    new_documents: dict[str, Document] = {}
+    changed_files: list[tuple[str, str]] = []
+    reformatted: list[str] = []
+    unchanged = 0
+
+    def register(documents: dict[str, Document], document: Document) -> None:
+        # The same resource in two files, e.g. without a namespace, is told apart by the file
+        key = document.identity
+        if key in documents:
+            key = f"{key} in {document.file}"
+        documents[key] = document
+
+    for file in files:
+        target = output / file.path
+        name = os.path.relpath(target)
+        try:
+            existing = target.read_bytes()
+        except FileNotFoundError:
+            existing = None
+        if existing == file.data:
+            unchanged += 1
+            continue
+        if existing is not None and is_encrypted(existing):
+            entry = sops_state.get(name, {})
+            if entry.get("plaintext") == sha256(file.data) and entry.get("ciphertext") == sha256(
+                existing
+            ):
+                unchanged += 1
+                continue
+
+        new = load_documents(file.data, name)
+        old = load_documents(existing, name) if existing is not None else []
+        if new is None or old is None:
+            changed_files.append((name, "added" if existing is None else "changed"))
+            continue
+        if [d.content for d in old] == [d.content for d in new] and not any(
+            d.encrypted for d in old
+        ):
+            reformatted.append(name)
+            continue
+        for document in old:
+            register(old_documents, document)
+        for document in new:
+            register(new_documents, document)
+
+    added = [d for key, d in new_documents.items() if key not in old_documents]
+    removed = [d for key, d in old_documents.items() if key not in new_documents]
+    changed = []
+    for key, new_document in new_documents.items():
+        if old_document := old_documents.get(key):
+            changes = diff_values(old_document.content, new_document.content)
+            if changes or old_document.encrypted:
+                changed.append((old_document, new_document, changes))
+    return Plan(
+        sorted(added),
+        sorted(removed),
+        sorted(changed),
+        sorted(changed_files),
+        sorted(reformatted),
+        stale_files(files, output),
+        unchanged,
+    )
+
+
+# Return the files below the rendered top-level directories that are not rendered anymore.
+# Files git ignores, e.g. the Talos machine configs generated from talconfig.yaml, are left out.
+def stale_files(files: list[OutputFile], output: Path) -> list[str]:
+    rendered = {os.path.relpath(output / file.path) for file in files}
+    directories = sorted(
+        {os.path.relpath(output / file.path.parts[0]) for file in files if len(file.path.parts) > 1}
+    )
+    if not directories:
+        return []
+    try:
+        result = subprocess.run(
+            ["git", "ls-files", "--cached", "--others", "--exclude-standard", "-z", "--"]
+            + directories,
+            capture_output=True,
+            text=True,
+        )
+    except FileNotFoundError:
+        result = None
+    if result is not None and result.returncode == 0:
+        existing = {path for path in result.stdout.split("\0") if path and Path(path).is_file()}
+    else:
+        existing = {
+            os.path.relpath(path)
+            for directory in directories
+            for path in Path(directory).rglob("*")
+            if path.is_file()
+        }
+    return sorted(existing - rendered)
+
+
+# Return a value of a sensitive document with every scalar in it masked, so maps and lists only
+# show their keys and length
+def mask(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: mask(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [mask(item) for item in value]
+    return SENSITIVE
+
+
+def format_value(value: Any, sensitive: bool) -> str:
+    if sensitive and not isinstance(value, (dict, list)):
+        return SENSITIVE
+    text = json.dumps(mask(value) if sensitive else value, default=str)
+    if len(text) > MAX_VALUE_LENGTH:
+        text = text[: MAX_VALUE_LENGTH - 3] + "..."
+    return text
+
+
+def format_change(change: FieldChange, sensitive: bool) -> str:
+    if change.old is MISSING:
+        return f"+ {change.path}: {format_value(change.new, sensitive)}"
+    if change.new is MISSING:
+        return f"- {change.path}: {format_value(change.old, sensitive)}"
+    old, new = format_value(change.old, sensitive), format_value(change.new, sensitive)
+    return f"~ {change.path}: {old} -> {new}"
+
+
+def print_plan(result: Plan) -> None:
+    for document in result.added:
+        print(f"+ {document.identity}  {document.file}")
+    for old, new, changes in result.changed:
+        location = new.file if old.file == new.file else f"{old.file} -> {new.file}"
+        print(f"~ {new.identity}  {location}")
+        for change in changes:
+            print(f"    {format_change(change, new.sensitive)}")
+        if old.encrypted and not changes:
+            print("    encrypted values changed")
+    for document in result.removed:
+        print(f"- {document.identity}  {document.file}")
+    for name, action in result.changed_files:
+        print(f"{'+' if action == 'added' else '~'} {name}  (compared as text)")
+    if result.reformatted:
+        print(f"Only formatting or comments changed in: {', '.join(result.reformatted)}")
+    if result.stale:
+        print("No longer rendered, left in place:")
+        for name in result.stale:
+            print(f"  {name}")
+    print(
+        f"Plan: {len(result.added)} to add, {len(result.changed)} to change, "
+        f"{len(result.removed)} to remove, {len(result.changed_files)} other files changed, "
+        f"{result.unchanged} files unchanged"
+    )
+
+
+def has_changes(result: Plan) -> bool:
+    return bool(
+        result.added
+        or result.removed
+        or result.changed
+        or result.changed_files
+        or result.reformatted
+        or result.stale
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Render in memory and show how the rendered resources differ from the files "
+        "on disk"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--sops-state",
+        type=Path,
+        default=SOPS_STATE_FILE,
+        help=f"plaintext hashes of the encrypted secrets (default: {SOPS_STATE_FILE})",
+    )
+    parser.add_argument(
+        "--exit-code",
+        action="store_true",
+        help="exit with 1 if the render would change anything, like `git diff --exit-code`",
+    )
+    parser.add_argument(
+        "--config", type=Path, default=Path("makejinja.toml"), help="makejinja config file"
+    )
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    if app.single_input_output_file(config):
+        parser.error("rendering a single input file is not supported, use makejinja")
+    files = render_stream(attrs.evolve(config, quiet=True), args.workers)
+    result = plan(files, config.output, load_sops_state(args.sops_state))
+    print_plan(result)
+    return 1 if args.exit_code and has_changes(result) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
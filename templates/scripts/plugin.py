@@ -1,12 +1,104 @@
+import atexit
 import base64
-import ipaddress
+import functools
 import json
-import re
+import os
+import time
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable
 
+import jinja2
 import makejinja
 
+from defaults import Default, DefaultsTable, fallback
+from gating import GateIndex
+from incremental import IncrementalRender, output_path, path_digest
+from network import NetworkModel, in_network, parse_address, parse_network
+from packing import check_object_sizes, gzip_base64, minify_json, minify_yaml
+from profiling import RenderProfile
+from schema import validate_config
+from secret_sources import SecretStore
+from talos_fingerprints import update_manifest
+from template_cache import TemplateBytecodeCache
+
+TALOS_PATCHES_DIR = "templates/config/talos/patches"
+TALOS_CONFIG_FILE = Path("talos/talconfig.yaml")
+SECRET_OUTPUTS_FILE = Path(".cache/render/secrets.json")
+
+# Secrets are read once per render from environment variables, a decrypted SOPS file or the
+# files created by `task init`, see secret_sources.py
+SECRETS = SecretStore.from_environment()
+
+# Node, pod and service networks and the addresses in use, loaded from the data by Plugin.data()
+NETWORK = NetworkModel()
+
+# Fingerprints of the inputs read by the plugin functions, used to detect changes for incremental renders
+FUNCTION_DIGESTS: dict[str, Callable[[], str]] = {
+    "age_key": lambda: SECRETS.fingerprint("age_key"),
+    "cloudflare_tunnel_id": lambda: SECRETS.fingerprint("cloudflare_tunnel"),
+    "cloudflare_tunnel_secret": lambda: SECRETS.fingerprint("cloudflare_tunnel"),
+    "github_deploy_key": lambda: SECRETS.fingerprint("github_deploy_key"),
+    "github_push_token": lambda: SECRETS.fingerprint("github_push_token"),
+    "talos_patches": lambda: path_digest(Path(TALOS_PATCHES_DIR)),
+    "talos_patch_map": lambda: path_digest(Path(TALOS_PATCHES_DIR)),
+    "address_owners": lambda: NETWORK.digest(),
+    "address_conflicts": lambda: NETWORK.digest(),
+    "allocate_address": lambda: NETWORK.digest(),
+}
+
+
+# Return True if an environment variable is set to a truthy value
+def env_flag(name: str) -> bool:
+    return os.environ.get(name, "").lower() in ("1", "true", "yes")
+
+
+# Call back after every successful template render with the template name, its output and the render time.
+# While a template renders, its name is available as env.template_class.rendering.
+def track_renders(
+    env: jinja2.Environment, callback: Callable[[str, str, float], None]
+) -> None:
+    if not hasattr(env.template_class, "render_callbacks"):
+
+        class TrackedTemplate(env.template_class):
+            render_callbacks: list[Callable[[str, str, float], None]] = []
+            rendering: str | None = None
+
+            def render(self, *args: Any, **kwargs: Any) -> str:
+                outer, TrackedTemplate.rendering = TrackedTemplate.rendering, self.name
+                start = time.perf_counter()
+                try:
+                    rendered = super().render(*args, **kwargs)
+                finally:
+                    TrackedTemplate.rendering = outer
+                elapsed = time.perf_counter() - start
+                for render_callback in self.render_callbacks:
+                    render_callback(self.name, rendered, elapsed)
+                return rendered
+
+        env.template_class = TrackedTemplate
+    env.template_class.render_callbacks.append(callback)
+
+
+# Record the SOPS secret files written by a render, so the encryption step that follows only
+# has to look at those
+class SecretOutputs:
+    def __init__(self, config: makejinja.config.Config, outputs_file: Path = SECRET_OUTPUTS_FILE):
+        self._config = config
+        self._outputs_file = outputs_file
+        self._outputs: set[str] = set()
+
+    # Render callback: remember the output of every non-empty `*.sops.*` template
+    def rendered(self, name: str, rendered: str, elapsed: float) -> None:
+        stem, sops, _ = Path(name).name.partition(".sops.")
+        if stem and sops and (rendered.strip() or self._config.keep_empty):
+            self._outputs.add(os.path.relpath(output_path(self._config, Path(name))))
+
+    def save(self) -> None:
+        self._outputs_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self._outputs_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(sorted(self._outputs), indent=2) + "\n")
+        tmp_file.replace(self._outputs_file)
+
 
 # Return the filename of a path without the j2 extension
 def basename(value: str) -> str:
@@ -15,624 +107,728 @@ def basename(value: str) -> str:
 
 # Return the nth host in a CIDR range
 def nthhost(value: str, query: int) -> str:
-    try:
-        network = ipaddress.ip_network(value, strict=False)
-        if 0 <= query < network.num_addresses:
-            return str(network[query])
-    except ValueError:
-        pass
+    network = parse_network(value)
+    if network is not None and 0 <= query < network.num_addresses:
+        return str(network[query])
     return False
 
 
+# Return the names of the nodes, VIPs and LoadBalancers using an address
+def address_owners(address: str) -> list[str]:
+    return NETWORK.owners(address)
+
+
+# Return every address conflict in cluster.yaml and nodes.yaml
+def address_conflicts() -> list[str]:
+    return NETWORK.conflicts()
+
+
+# Return a free address of a network ("node", "pod", "service" or a CIDR), the same one for
+# every call with the same owner, or host `index` of the network if it is free
+def allocate_address(owner: str, network: str = "node", index: int | None = None) -> str:
+    return NETWORK.allocate(owner, network, index)
+
+
 # Return the age public or private key from age.key
-def age_key(key_type: str, file_path: str = "age.key") -> str:
+def age_key(key_type: str, file_path: str | None = None) -> str:
+    if key_type not in ("public", "private"):
+        raise ValueError("Invalid key type. Use 'public' or 'private'.")
     try:
-        with open(file_path, "r") as file:
-            file_content = file.read().strip()
-        if key_type == "public":
-            key_match = re.search(r"# public key: (age1[\w]+)", file_content)
-            if not key_match:
-                raise ValueError("Could not find public key in the age key file.")
-            return key_match.group(1)
-        elif key_type == "private":
-            key_match = re.search(r"(AGE-SECRET-KEY-[\w]+)", file_content)
-            if not key_match:
-                raise ValueError("Could not find private key in the age key file.")
-            return key_match.group(1)
-        else:
-            raise ValueError("Invalid key type. Use 'public' or 'private'.")
-    except FileNotFoundError:
-        raise FileNotFoundError(f"File not found: {file_path}")
-    except Exception as e:
-        raise RuntimeError(f"Unexpected error while processing {file_path}: {e}")
+        return SECRETS.get("age_key", file_path)[key_type]
+    except ValueError as e:
+        raise RuntimeError(f"Unexpected error while processing {file_path or 'age.key'}: {e}")
 
 
 # Return cloudflare tunnel fields from cloudflare-tunnel.json
-def cloudflare_tunnel_id(file_path: str = "cloudflare-tunnel.json") -> str:
-    try:
-        with open(file_path, "r") as file:
-            data = json.load(file)
-        tunnel_id = data.get("TunnelID")
-        if tunnel_id is None:
-            raise KeyError(f"Missing 'TunnelID' key in {file_path}")
-        return tunnel_id
-
-    except FileNotFoundError:
-        raise FileNotFoundError(f"File not found: {file_path}")
-    except json.JSONDecodeError:
-        raise ValueError(f"Could not decode JSON file: {file_path}")
-    except KeyError as e:
-        raise KeyError(f"Error in JSON structure: {e}")
-    except Exception as e:
-        raise RuntimeError(f"Unexpected error while processing {file_path}: {e}")
+def cloudflare_tunnel_id(file_path: str | None = None) -> str:
+    return SECRETS.get("cloudflare_tunnel", file_path)["TunnelID"]
 
 
 # Return cloudflare tunnel fields from cloudflare-tunnel.json in TUNNEL_TOKEN format
-def cloudflare_tunnel_secret(file_path: str = "cloudflare-tunnel.json") -> str:
-    try:
-        with open(file_path, "r") as file:
-            data = json.load(file)
-        transformed_data = {
-            "a": data["AccountTag"],
-            "t": data["TunnelID"],
-            "s": data["TunnelSecret"],
-        }
-        json_string = json.dumps(transformed_data, separators=(",", ":"))
-        return base64.b64encode(json_string.encode("utf-8")).decode("utf-8")
-
-    except FileNotFoundError:
-        raise FileNotFoundError(f"File not found: {file_path}")
-    except json.JSONDecodeError:
-        raise ValueError(f"Could not decode JSON file: {file_path}")
-    except KeyError as e:
-        raise KeyError(f"Missing key in JSON file {file_path}: {e}")
-    except Exception as e:
-        raise RuntimeError(f"Unexpected error while processing {file_path}: {e}")
+def cloudflare_tunnel_secret(file_path: str | None = None) -> str:
+    data = SECRETS.get("cloudflare_tunnel", file_path)
+    transformed_data = {
+        "a": data["AccountTag"],
+        "t": data["TunnelID"],
+        "s": data["TunnelSecret"],
+    }
+    json_string = json.dumps(transformed_data, separators=(",", ":"))
+    return base64.b64encode(json_string.encode("utf-8")).decode("utf-8")
 
 
 # Return the GitHub deploy key from github-deploy.key
-def github_deploy_key(file_path: str = "github-deploy.key") -> str:
-    try:
-        with open(file_path, "r") as file:
-            return file.read().strip()
-    except FileNotFoundError:
-        raise FileNotFoundError(f"File not found: {file_path}")
-    except Exception as e:
-        raise RuntimeError(f"Unexpected error while reading {file_path}: {e}")
+def github_deploy_key(file_path: str | None = None) -> str:
+    return SECRETS.get("github_deploy_key", file_path)
 
 
 # Return the Flux / GitHub push token from github-push-token.txt
-def github_push_token(file_path: str = "github-push-token.txt") -> str:
-    try:
-        with open(file_path, "r") as file:
-            return file.read().strip()
-    except FileNotFoundError:
-        raise FileNotFoundError(f"File not found: {file_path}")
-    except Exception as e:
-        raise RuntimeError(f"Unexpected error while reading {file_path}: {e}")
+def github_push_token(file_path: str | None = None) -> str:
+    return SECRETS.get("github_push_token", file_path)
+
+
+# Return the talos patch files keyed by directory (global, controller, worker or a node name),
+# scanned once per render
+@functools.cache
+def talos_patch_index(root: str = TALOS_PATCHES_DIR) -> dict[str, list[str]]:
+    index: dict[str, list[str]] = {}
+    if not os.path.isdir(root):
+        return index
+    with os.scandir(root) as directories:
+        for directory in directories:
+            if not directory.is_dir():
+                continue
+            with os.scandir(directory.path) as files:
+                index[directory.name] = sorted(
+                    str(Path(root, directory.name, f.name))
+                    for f in files
+                    if f.name.endswith(".yaml.j2") and f.is_file()
+                )
+    return index
 
 
 # Return a list of files in the talos patches directory
 def talos_patches(value: str) -> list[str]:
-    path = Path(f"templates/config/talos/patches/{value}")
-    if not path.is_dir():
-        return []
-    return [str(f) for f in sorted(path.glob("*.yaml.j2")) if f.is_file()]
+    return list(talos_patch_index().get(value, []))
 
 
-class Plugin(makejinja.plugin.Plugin):
-    def __init__(self, data: dict[str, Any]):
-        self._data = data
+# Return all talos patch files keyed by directory, to look up every node and role in one call
+def talos_patch_map() -> dict[str, list[str]]:
+    return {key: list(files) for key, files in talos_patch_index().items()}
 
-    def data(self) -> makejinja.plugin.Data:
-        data = self._data
 
-        # Handle multi-domain configuration with backward compatibility
-        # Convert old cloudflare_domain (string) to new cloudflare_domains (array) format
-        if "cloudflare_domain" in data and data["cloudflare_domain"]:
-            if "cloudflare_domains" not in data or not data["cloudflare_domains"]:
-                data["cloudflare_domains"] = [data["cloudflare_domain"]]
+BGP_KEYS = ["cilium_bgp_router_addr", "cilium_bgp_router_asn", "cilium_bgp_node_asn"]
 
-        # Ensure cloudflare_domains is a list
-        domains = data.get("cloudflare_domains", [])
-        if isinstance(domains, str):
-            domains = [domains]
-        data["cloudflare_domains"] = domains
 
-        # Set primary_domain for convenience (first domain in list)
-        data["primary_domain"] = domains[0] if domains else ""
+# Return the default gateway, the first host in the node network
+def default_gateway(data: dict[str, Any]) -> str:
+    return nthhost(data.get("node_cidr"), 1)
 
+
+# Return the public DNS servers from node_dns_servers plus 1.1.1.1, as k8s_gateway fallback.
+# Private IPs are filtered out to avoid DNS loops.
+def k8s_gateway_fallback_dns(data: dict[str, Any]) -> list[str]:
+    fallback_dns = []
+    for dns in data.get("node_dns_servers", ["1.1.1.1", "1.0.0.1"]):
+        ip = parse_address(dns)
+        # Only include public (non-private) IP addresses
+        if ip is not None and not ip.is_private:
+            fallback_dns.append(dns)
+    # Ensure we always have at least 1.1.1.1 as a fallback
+    if "1.1.1.1" not in fallback_dns:
+        fallback_dns.append("1.1.1.1")
+    return fallback_dns
+
+
+# Return True if all BGP keys are set
+def bgp_enabled(data: dict[str, Any]) -> bool:
+    return all(data.get(key) for key in BGP_KEYS)
+
+
+# Return True if the Proxmox CSI token is configured
+def proxmox_csi_enabled(data: dict[str, Any]) -> bool:
+    return bool(data.get("proxmox_csi_token_id") and data.get("proxmox_csi_token_secret"))
+
+
+# Defaults for the optional cluster.yaml keys, resolved in dependency order (see defaults.py).
+# Derived defaults list the keys they read in `depends`.
+DEFAULTS = DefaultsTable(
+    [
         # Set default values for optional fields
-        data.setdefault("node_default_gateway", nthhost(data.get("node_cidr"), 1))
-        data.setdefault("node_dns_servers", ["1.1.1.1", "1.0.0.1"])
+        Default(
+            "node_default_gateway",
+            compute=default_gateway,
+            depends=("node_cidr",),
+        ),
+        Default("node_dns_servers", ["1.1.1.1", "1.0.0.1"]),
 
         # Set k8s_gateway fallback DNS (filter out private IPs to avoid DNS loops)
         # Only use public DNS servers from node_dns_servers, plus 1.1.1.1 as backup
-        node_dns = data.get("node_dns_servers", ["1.1.1.1", "1.0.0.1"])
-        fallback_dns = []
-        for dns in node_dns:
-            try:
-                ip = ipaddress.ip_address(dns)
-                # Only include public (non-private) IP addresses
-                if not ip.is_private:
-                    fallback_dns.append(dns)
-            except ValueError:
-                pass
-        # Ensure we always have at least 1.1.1.1 as a fallback
-        if "1.1.1.1" not in fallback_dns:
-            fallback_dns.append("1.1.1.1")
-        data.setdefault("k8s_gateway_fallback_dns", fallback_dns)
-        data.setdefault("node_ntp_servers", ["162.159.200.1", "162.159.200.123"])
-        data.setdefault("cluster_pod_cidr", "10.42.0.0/16")
-        data.setdefault("cluster_svc_cidr", "10.43.0.0/16")
-        data.setdefault("repository_branch", "main")
-        data.setdefault("repository_visibility", "public")
-        data.setdefault("cilium_loadbalancer_mode", "dsr")
+        Default(
+            "k8s_gateway_fallback_dns",
+            compute=k8s_gateway_fallback_dns,
+            depends=("node_dns_servers",),
+        ),
+        Default("node_ntp_servers", ["162.159.200.1", "162.159.200.123"]),
+        Default("cluster_pod_cidr", "10.42.0.0/16"),
+        Default("cluster_svc_cidr", "10.43.0.0/16"),
+        Default("repository_branch", "main"),
+        Default("repository_visibility", "public"),
+        Default("cilium_loadbalancer_mode", "dsr"),
 
         # If all BGP keys are set, enable BGP
-        bgp_keys = [
-            "cilium_bgp_router_addr",
-            "cilium_bgp_router_asn",
-            "cilium_bgp_node_asn",
-        ]
-        bgp_enabled = all(data.get(key) for key in bgp_keys)
-        data.setdefault("cilium_bgp_enabled", bgp_enabled)
+        Default("cilium_bgp_enabled", compute=bgp_enabled, depends=tuple(BGP_KEYS)),
 
         # Cilium prerelease version toggle (stable 1.18.x vs prerelease 1.19.x)
-        data.setdefault("cilium_use_prerelease", False)
-        data.setdefault("cilium_prerelease_version", "1.19.0-pre.3")
+        Default("cilium_use_prerelease", False),
+        Default("cilium_prerelease_version", "1.19.0-pre.3"),
 
         # Control plane scheduling (allow workloads on control plane nodes)
-        data.setdefault("allow_scheduling_on_control_planes", True)
+        Default("allow_scheduling_on_control_planes", True),
 
         # If there is more than one node, enable spegel
-        spegel_enabled = len(data.get("nodes")) > 1
-        data.setdefault("spegel_enabled", spegel_enabled)
+        Default(
+            "spegel_enabled",
+            compute=lambda data: len(data.get("nodes")) > 1,
+            depends=("nodes",),
+        ),
 
         # Proxmox CCM/CSI defaults
-        data.setdefault("proxmox_insecure", True)
-        data.setdefault("proxmox_region", "talos-k8s")
-        data.setdefault("proxmox_storage", "local-lvm")
+        Default("proxmox_insecure", True),
+        Default("proxmox_region", "talos-k8s"),
+        Default("proxmox_storage", "local-lvm"),
+        # CSI is enabled when both token fields are set
+        Default(
+            "proxmox_csi_enabled",
+            compute=proxmox_csi_enabled,
+            depends=("proxmox_csi_token_id", "proxmox_csi_token_secret"),
+        ),
 
         # Azure OpenAI region defaults (used by LiteLLM for multi-region routing)
         # NOTE: NOT deprecated - still required for LiteLLM model configuration
-        data.setdefault("azure_openai_us_east_api_key", "")
-        data.setdefault("azure_openai_us_east_resource_name", "")
-        data.setdefault("azure_openai_us_east2_api_key", "")
-        data.setdefault("azure_openai_us_east2_resource_name", "")
+        Default("azure_openai_us_east_api_key", ""),
+        Default("azure_openai_us_east_resource_name", ""),
+        Default("azure_openai_us_east2_api_key", ""),
+        Default("azure_openai_us_east2_resource_name", ""),
         # Azure Cohere Rerank API default
-        data.setdefault("azure_cohere_rerank_api_key", "")
-        data.setdefault("azure_cohere_rerank_api_base", "")
+        Default("azure_cohere_rerank_api_key", ""),
+        Default("azure_cohere_rerank_api_base", ""),
         # Azure Cohere Embed API default
-        data.setdefault("azure_cohere_embed_api_key", "")
-        data.setdefault("azure_cohere_embed_api_base", "")
+        Default("azure_cohere_embed_api_key", ""),
+        Default("azure_cohere_embed_api_base", ""),
         # Azure Anthropic API default
-        data.setdefault("azure_anthropic_api_key", "")
-        data.setdefault("azure_anthropic_api_base", "")
+        Default("azure_anthropic_api_key", ""),
+        Default("azure_anthropic_api_base", ""),
 
         # Observability Stack defaults (VictoriaMetrics/Grafana for K8s metrics)
         # NOTE: observability_enabled is auto-set to True when victoria_metrics_enabled is True
         # This enables metrics scraping, ServiceMonitors, and NetworkPolicy rules
-        data.setdefault("grafana_admin_password", "admin")
-        data.setdefault("grafana_storage_size", "10Gi")
+        Default("grafana_admin_password", "admin"),
+        Default("grafana_storage_size", "10Gi"),
 
         # Proxmox Dashboards default (enabled when Proxmox CSI is configured)
         # Requires Proxmox to push metrics via InfluxDB protocol to VictoriaMetrics
-        data.setdefault(
-            "proxmox_dashboards_enabled", data.get("proxmox_csi_enabled", False)
-        )
+        fallback("proxmox_dashboards_enabled", "proxmox_csi_enabled", False),
 
         # UniFi Monitoring defaults (UnPoller metrics collection from UniFi Controller)
         # REF: https://unpoller.com/
-        data.setdefault("unifi_enabled", False)
-        data.setdefault("unifi_verify_ssl", False)
+        Default("unifi_enabled", False),
+        Default("unifi_verify_ssl", False),
 
         # VictoriaMetrics Stack defaults (replaces kube-prometheus-stack)
-        data.setdefault("victoria_metrics_enabled", False)
-        data.setdefault("vm_storage_size", "50Gi")
-        data.setdefault("vm_retention_days", 14)
-        data.setdefault("vm_storage_class", "proxmox-csi")
-        data.setdefault("alertmanager_storage_size", "1Gi")
-        data.setdefault("vm_cpu_request", "200m")
-        data.setdefault("vm_cpu_limit", "1000m")
-        data.setdefault("vm_memory_request", "512Mi")
-        data.setdefault("vm_memory_limit", "2Gi")
+        Default("victoria_metrics_enabled", False),
+        Default("vm_storage_size", "50Gi"),
+        Default("vm_retention_days", 14),
+        Default("vm_storage_class", "proxmox-csi"),
+        Default("alertmanager_storage_size", "1Gi"),
+        Default("vm_cpu_request", "200m"),
+        Default("vm_cpu_limit", "1000m"),
+        Default("vm_memory_request", "512Mi"),
+        Default("vm_memory_limit", "2Gi"),
 
         # Auto-enable observability features when VictoriaMetrics is enabled
         # This enables metrics scraping (ServiceMonitors/PodMonitors) and NetworkPolicy rules
-        data.setdefault(
-            "observability_enabled", data.get("victoria_metrics_enabled", False)
-        )
+        fallback("observability_enabled", "victoria_metrics_enabled", False),
 
         # VictoriaLogs defaults (replaces Loki)
-        data.setdefault("victoria_logs_enabled", False)
-        data.setdefault("vl_storage_size", "20Gi")
-        data.setdefault("vl_retention_days", 14)
-        data.setdefault("vl_storage_class", "proxmox-csi")
-        data.setdefault("vl_cpu_request", "100m")
-        data.setdefault("vl_cpu_limit", "500m")
-        data.setdefault("vl_memory_request", "256Mi")
-        data.setdefault("vl_memory_limit", "1Gi")
+        Default("victoria_logs_enabled", False),
+        Default("vl_storage_size", "20Gi"),
+        Default("vl_retention_days", 14),
+        Default("vl_storage_class", "proxmox-csi"),
+        Default("vl_cpu_request", "100m"),
+        Default("vl_cpu_limit", "500m"),
+        Default("vl_memory_request", "256Mi"),
+        Default("vl_memory_limit", "1Gi"),
 
         # Vector Agent defaults (log collection for VictoriaLogs)
         # Defaults to victoria_logs_enabled if not explicitly set
-        data.setdefault("vector_enabled", data.get("victoria_logs_enabled", False))
-        data.setdefault("vector_cpu_request", "50m")
-        data.setdefault("vector_cpu_limit", "200m")
-        data.setdefault("vector_memory_request", "128Mi")
-        data.setdefault("vector_memory_limit", "512Mi")
+        fallback("vector_enabled", "victoria_logs_enabled", False),
+        Default("vector_cpu_request", "50m"),
+        Default("vector_cpu_limit", "200m"),
+        Default("vector_memory_request", "128Mi"),
+        Default("vector_memory_limit", "512Mi"),
 
         # OpenTelemetry Operator defaults (manages OTEL Collectors via CRDs)
         # Defaults to victoria_logs_enabled - required for k8s events collection
-        data.setdefault(
-            "opentelemetry_operator_enabled", data.get("victoria_logs_enabled", False)
-        )
+        fallback("opentelemetry_operator_enabled", "victoria_logs_enabled", False),
 
         # OpenTelemetry K8s Events Collector defaults (captures ephemeral K8s events)
         # Defaults to victoria_logs_enabled - requires OTEL Operator and VictoriaLogs
         # REF: Part 11 of monitoring guide - replaces abandoned kubernetes-event-exporter
-        data.setdefault(
-            "opentelemetry_k8s_events_enabled", data.get("victoria_logs_enabled", False)
-        )
+        fallback("opentelemetry_k8s_events_enabled", "victoria_logs_enabled", False),
 
         # Talos System Logs defaults (kernel and service logs via Vector)
         # Defaults to victoria_logs_enabled - requires Vector as syslog receiver
-        data.setdefault(
-            "talos_system_logs_enabled", data.get("victoria_logs_enabled", False)
-        )
+        fallback("talos_system_logs_enabled", "victoria_logs_enabled", False),
 
         # API Server Audit Logs defaults (K8s audit logs via Vector)
         # Enabled by default when VictoriaLogs is enabled
-        data.setdefault("api_server_audit_logs_enabled", True)
+        Default("api_server_audit_logs_enabled", True),
 
         # Tempo defaults (distributed tracing)
-        data.setdefault("tempo_enabled", False)
-        data.setdefault("tempo_storage_size", "10Gi")
-        data.setdefault("tempo_retention_days", 7)
-        data.setdefault("tempo_storage_class", "proxmox-csi")
-        data.setdefault("tempo_s3_bucket", "tempo-traces")
-        data.setdefault("tempo_cpu_request", "100m")
-        data.setdefault("tempo_cpu_limit", "500m")
-        data.setdefault("tempo_memory_request", "256Mi")
-        data.setdefault("tempo_memory_limit", "1Gi")
+        Default("tempo_enabled", False),
+        Default("tempo_storage_size", "10Gi"),
+        Default("tempo_retention_days", 7),
+        Default("tempo_storage_class", "proxmox-csi"),
+        Default("tempo_s3_bucket", "tempo-traces"),
+        Default("tempo_cpu_request", "100m"),
+        Default("tempo_cpu_limit", "500m"),
+        Default("tempo_memory_request", "256Mi"),
+        Default("tempo_memory_limit", "1Gi"),
 
         # kgateway Observability defaults
-        data.setdefault("kgateway_tracing_enabled", False)
-        data.setdefault("kgateway_trace_sampling_percentage", 100)
+        Default("kgateway_tracing_enabled", False),
+        Default("kgateway_trace_sampling_percentage", 100),
 
         # kgateway OAuth2 defaults (OIDC authentication for internal Gateway)
-        data.setdefault("kgateway_oauth2_enabled", False)
+        Default("kgateway_oauth2_enabled", False),
 
         # OneDev defaults (Git Server with CI/CD)
-        data.setdefault("onedev_enabled", False)
-        data.setdefault("onedev_admin_password", "")
-        data.setdefault("onedev_storage_size", "100Gi")
-        data.setdefault("onedev_storage_class", "proxmox-csi")
-        data.setdefault("onedev_database_type", "")
-        data.setdefault("onedev_database_host", "")
-        data.setdefault("onedev_database_port", "3306")
-        data.setdefault("onedev_database_name", "onedev")
-        data.setdefault("onedev_database_user", "onedev")
-        data.setdefault("onedev_database_password", "")
-        data.setdefault("onedev_ssh_port", 6611)
-        data.setdefault("onedev_cpu_limit", "2000m")
-        data.setdefault("onedev_memory_limit", "4Gi")
-        data.setdefault("onedev_cpu_request", "500m")
-        data.setdefault("onedev_memory_request", "2Gi")
+        Default("onedev_enabled", False),
+        Default("onedev_admin_password", ""),
+        Default("onedev_storage_size", "100Gi"),
+        Default("onedev_storage_class", "proxmox-csi"),
+        Default("onedev_database_type", ""),
+        Default("onedev_database_host", ""),
+        Default("onedev_database_port", "3306"),
+        Default("onedev_database_name", "onedev"),
+        Default("onedev_database_user", "onedev"),
+        Default("onedev_database_password", ""),
+        Default("onedev_ssh_port", 6611),
+        Default("onedev_cpu_limit", "2000m"),
+        Default("onedev_memory_limit", "4Gi"),
+        Default("onedev_cpu_request", "500m"),
+        Default("onedev_memory_request", "2Gi"),
 
         # WorkOS AuthKit defaults (OAuth 2.1 / MCP authentication)
-        data.setdefault("workos_client_id", "")
-        data.setdefault("workos_client_secret", "")
-        data.setdefault("workos_subdomain", "")
+        Default("workos_client_id", ""),
+        Default("workos_client_secret", ""),
+        Default("workos_subdomain", ""),
 
         # MCP Gateway defaults (Model Context Protocol)
-        data.setdefault("mcp_gateway_enabled", False)
-        data.setdefault("mcp_gateway_addr", "")
-        data.setdefault("mcp_session_timeout", 3600)
+        Default("mcp_gateway_enabled", False),
+        Default("mcp_gateway_addr", ""),
+        Default("mcp_session_timeout", 3600),
 
         # Keycloak defaults (OIDC Authentication Provider)
-        data.setdefault("keycloak_enabled", False)
-        data.setdefault("keycloak_admin_password", "")
-        data.setdefault("keycloak_db_password", "")
-        data.setdefault("keycloak_replicas", 2)
-        data.setdefault("keycloak_cpu_request", "250m")
-        data.setdefault("keycloak_memory_request", "512Mi")
-        data.setdefault("keycloak_cpu_limit", "1000m")
-        data.setdefault("keycloak_memory_limit", "1Gi")
-        data.setdefault("keycloak_postgresql_enabled", True)
-        data.setdefault("keycloak_postgresql_replicas", 3)
-        data.setdefault("keycloak_postgresql_storage_size", "10Gi")
-        data.setdefault("keycloak_oidc_client_secret", "")
-        data.setdefault("keycloak_oidc_cookie_domain", "")
+        Default("keycloak_enabled", False),
+        Default("keycloak_admin_password", ""),
+        Default("keycloak_db_password", ""),
+        Default("keycloak_replicas", 2),
+        Default("keycloak_cpu_request", "250m"),
+        Default("keycloak_memory_request", "512Mi"),
+        Default("keycloak_cpu_limit", "1000m"),
+        Default("keycloak_memory_limit", "1Gi"),
+        Default("keycloak_postgresql_enabled", True),
+        Default("keycloak_postgresql_replicas", 3),
+        Default("keycloak_postgresql_storage_size", "10Gi"),
+        Default("keycloak_oidc_client_secret", ""),
+        Default("keycloak_oidc_cookie_domain", ""),
 
         # Keycloak Entra ID Identity Provider defaults
-        data.setdefault("keycloak_entra_id_enabled", False)
-        data.setdefault("keycloak_entra_id_tenant_id", "")
-        data.setdefault("keycloak_entra_id_client_id", "")
-        data.setdefault("keycloak_entra_id_client_secret", "")
+        Default("keycloak_entra_id_enabled", False),
+        Default("keycloak_entra_id_tenant_id", ""),
+        Default("keycloak_entra_id_client_id", ""),
+        Default("keycloak_entra_id_client_secret", ""),
 
         # Keycloak Google Identity Provider defaults
-        data.setdefault("keycloak_google_enabled", False)
-        data.setdefault("keycloak_google_client_id", "")
-        data.setdefault("keycloak_google_client_secret", "")
+        Default("keycloak_google_enabled", False),
+        Default("keycloak_google_client_id", ""),
+        Default("keycloak_google_client_secret", ""),
 
         # Keycloak GitHub Identity Provider defaults
-        data.setdefault("keycloak_github_enabled", False)
-        data.setdefault("keycloak_github_client_id", "")
-        data.setdefault("keycloak_github_client_secret", "")
+        Default("keycloak_github_enabled", False),
+        Default("keycloak_github_client_id", ""),
+        Default("keycloak_github_client_secret", ""),
 
         # kgateway defaults (Envoy Control Plane)
-        data.setdefault("kgateway_enabled", True)
-        data.setdefault("gateway_api_version", "v1.4.1")
-        data.setdefault("kgateway_version", "v2.2.0-beta.4")
-        data.setdefault("agentgateway_version", "v2.2.0-beta.4")
+        Default("kgateway_enabled", True),
+        Default("gateway_api_version", "v1.4.1"),
+        Default("kgateway_version", "v2.2.0-beta.4"),
+        Default("agentgateway_version", "v2.2.0-beta.4"),
 
         # agentgateway defaults (MCP 2025-11-25 OAuth Proxy)
-        data.setdefault("agentgateway_enabled", False)
-        data.setdefault("agentgateway_addr", "")
-        data.setdefault(
-            "agentgateway_scopes", ["openid", "profile", "email", "offline_access"]
-        )
-        data.setdefault("keycloak_agentgateway_client_secret", "")
+        Default("agentgateway_enabled", False),
+        Default("agentgateway_addr", ""),
+        Default(
+            "agentgateway_scopes",
+            ["openid", "profile", "email", "offline_access"],
+        ),
+        Default("keycloak_agentgateway_client_secret", ""),
 
         # obot defaults (Multi-tenant MCP Gateway)
-        data.setdefault("obot_enabled", False)
-        data.setdefault("obot_hostname", "obot")
-        data.setdefault("obot_entra_tenant_id", "")
-        data.setdefault("obot_entra_client_id", "")
-        data.setdefault("obot_entra_client_secret", "")
+        Default("obot_enabled", False),
+        Default("obot_hostname", "obot"),
+        Default("obot_entra_tenant_id", ""),
+        Default("obot_entra_client_id", ""),
+        Default("obot_entra_client_secret", ""),
         # Keycloak authentication (alternative to Entra ID)
-        data.setdefault("obot_keycloak_enabled", False)
-        data.setdefault("obot_keycloak_client_id", "obot")
-        data.setdefault("obot_keycloak_client_secret", "")
+        Default("obot_keycloak_enabled", False),
+        Default("obot_keycloak_client_id", "obot"),
+        Default("obot_keycloak_client_secret", ""),
         # PostgreSQL configuration
-        data.setdefault("obot_postgres_host", "")
-        data.setdefault("obot_postgres_db", "obot")
-        data.setdefault("obot_postgres_user", "obot")
-        data.setdefault("obot_postgres_password", "")
-        data.setdefault("obot_mcp_namespace", "obot-mcp")
+        Default("obot_postgres_host", ""),
+        Default("obot_postgres_db", "obot"),
+        Default("obot_postgres_user", "obot"),
+        Default("obot_postgres_password", ""),
+        Default("obot_mcp_namespace", "obot-mcp"),
         # Secrets
-        data.setdefault("obot_cookie_secret", "")
-        data.setdefault("obot_encryption_key", "")
-        data.setdefault("obot_bootstrap_token", "")
+        Default("obot_cookie_secret", ""),
+        Default("obot_encryption_key", ""),
+        Default("obot_bootstrap_token", ""),
         # User management
-        data.setdefault("obot_admin_emails", "")
-        data.setdefault("obot_owner_emails", "")
+        Default("obot_admin_emails", ""),
+        Default("obot_owner_emails", ""),
         # Storage
-        data.setdefault("obot_storage_size", "20Gi")
-        data.setdefault("obot_storage_class", "proxmox-csi")
-        data.setdefault("obot_postgresql_replicas", 3)
-        data.setdefault("obot_postgresql_storage_size", "10Gi")
+        Default("obot_storage_size", "20Gi"),
+        Default("obot_storage_class", "proxmox-csi"),
+        Default("obot_postgresql_replicas", 3),
+        Default("obot_postgresql_storage_size", "10Gi"),
         # Resources
-        data.setdefault("obot_replicas", 1)
-        data.setdefault("obot_version", "v0.2.16")
-        data.setdefault("obot_cpu_request", "500m")
-        data.setdefault("obot_cpu_limit", "2000m")
-        data.setdefault("obot_memory_request", "1Gi")
-        data.setdefault("obot_memory_limit", "4Gi")
+        Default("obot_replicas", 1),
+        Default("obot_version", "v0.2.16"),
+        Default("obot_cpu_request", "500m"),
+        Default("obot_cpu_limit", "2000m"),
+        Default("obot_memory_request", "1Gi"),
+        Default("obot_memory_limit", "4Gi"),
         # Advanced
-        data.setdefault("obot_encryption_provider", "custom")
-        data.setdefault("obot_use_ai_gateway", True)
-        data.setdefault("obot_use_agentgateway", False)
+        Default("obot_encryption_provider", "custom"),
+        Default("obot_use_ai_gateway", True),
+        Default("obot_use_agentgateway", False),
         # S3/MinIO Workspace Storage (enables multi-replica scaling)
-        data.setdefault("obot_workspace_provider", "directory")
-        data.setdefault("obot_s3_bucket", "")
-        data.setdefault("obot_s3_endpoint", "")
-        data.setdefault("obot_s3_region", "us-east-1")
-        data.setdefault("obot_s3_access_key", "")
-        data.setdefault("obot_s3_secret_key", "")
-        data.setdefault("obot_s3_use_path_style", False)
+        Default("obot_workspace_provider", "directory"),
+        Default("obot_s3_bucket", ""),
+        Default("obot_s3_endpoint", ""),
+        Default("obot_s3_region", "us-east-1"),
+        Default("obot_s3_access_key", ""),
+        Default("obot_s3_secret_key", ""),
+        Default("obot_s3_use_path_style", False),
         # OpenTelemetry observability (traces, metrics, logs)
-        data.setdefault("obot_otel_enabled", False)
-        data.setdefault("obot_otel_sample_prob", 0.1)
-        data.setdefault("obot_otel_cpu_request", "50m")
-        data.setdefault("obot_otel_cpu_limit", "200m")
-        data.setdefault("obot_otel_memory_request", "64Mi")
-        data.setdefault("obot_otel_memory_limit", "256Mi")
+        Default("obot_otel_enabled", False),
+        Default("obot_otel_sample_prob", 0.1),
+        Default("obot_otel_cpu_request", "50m"),
+        Default("obot_otel_cpu_limit", "200m"),
+        Default("obot_otel_memory_request", "64Mi"),
+        Default("obot_otel_memory_limit", "256Mi"),
 
         # MinIO defaults (S3-compatible object storage in storage namespace)
-        data.setdefault("minio_enabled", False)
-        data.setdefault("minio_chart_version", "5.4.0")
-        data.setdefault("minio_mode", "standalone")
-        data.setdefault("minio_replicas", 1)
-        data.setdefault("minio_root_user", "admin")
-        data.setdefault("minio_root_password", "")
-        data.setdefault("minio_storage_class", "proxmox-csi")
-        data.setdefault("minio_storage_size", "50Gi")
-        data.setdefault("minio_memory_request", "512Mi")
-        data.setdefault("minio_memory_limit", "2Gi")
-        data.setdefault("minio_cpu_request", "250m")
-        data.setdefault("minio_ingress_enabled", False)
-        data.setdefault("minio_console_hostname", "minio")
-        data.setdefault("minio_buckets", [])
-        data.setdefault("minio_users", [])
-
-        # Compute proxmox_csi_enabled for dependency checking
-        proxmox_csi_enabled = bool(
-            data.get("proxmox_csi_token_id") and data.get("proxmox_csi_token_secret")
-        )
-        data.setdefault("proxmox_csi_enabled", proxmox_csi_enabled)
+        Default("minio_enabled", False),
+        Default("minio_chart_version", "5.4.0"),
+        Default("minio_mode", "standalone"),
+        Default("minio_replicas", 1),
+        Default("minio_root_user", "admin"),
+        Default("minio_root_password", ""),
+        Default("minio_storage_class", "proxmox-csi"),
+        Default("minio_storage_size", "50Gi"),
+        Default("minio_memory_request", "512Mi"),
+        Default("minio_memory_limit", "2Gi"),
+        Default("minio_cpu_request", "250m"),
+        Default("minio_ingress_enabled", False),
+        Default("minio_console_hostname", "minio"),
+        Default("minio_buckets", []),
+        Default("minio_users", []),
 
         # kagent defaults (Kubernetes-native AI Agent Framework)
-        data.setdefault("kagent_enabled", False)
-        data.setdefault("kagent_provider", "anthropic")
-        data.setdefault("kagent_default_model", "claude-3-5-haiku")
-        data.setdefault("kagent_anthropic_api_key", "")
-        data.setdefault("kagent_openai_api_key", "")
-        data.setdefault("kagent_openai_api_base", "")
-        data.setdefault("kagent_gemini_api_key", "")
-        data.setdefault("kagent_azure_endpoint", "")
-        data.setdefault("kagent_azure_deployment", "")
-        data.setdefault("kagent_ollama_host", "ollama.ollama.svc.cluster.local:11434")
-        data.setdefault("kagent_ui_enabled", True)
-        data.setdefault("kagent_ui_replicas", 1)
-        data.setdefault("kagent_controller_replicas", 1)
-        data.setdefault("kagent_controller_log_level", "info")
-        data.setdefault("kagent_agents_enabled", ["k8s", "helm", "observability"])
-        data.setdefault("kagent_otlp_enabled", False)
-        data.setdefault("kagent_otlp_endpoint", "")
-        data.setdefault("kagent_database_type", "sqlite")
-        data.setdefault("kagent_postgres_url", "")
-        data.setdefault("kagent_kmcp_enabled", True)
-        data.setdefault("kagent_write_operations_enabled", False)
+        Default("kagent_enabled", False),
+        Default("kagent_provider", "anthropic"),
+        Default("kagent_default_model", "claude-3-5-haiku"),
+        Default("kagent_anthropic_api_key", ""),
+        Default("kagent_openai_api_key", ""),
+        Default("kagent_openai_api_base", ""),
+        Default("kagent_gemini_api_key", ""),
+        Default("kagent_azure_endpoint", ""),
+        Default("kagent_azure_deployment", ""),
+        Default("kagent_ollama_host", "ollama.ollama.svc.cluster.local:11434"),
+        Default("kagent_ui_enabled", True),
+        Default("kagent_ui_replicas", 1),
+        Default("kagent_controller_replicas", 1),
+        Default("kagent_controller_log_level", "info"),
+        Default("kagent_agents_enabled", ["k8s", "helm", "observability"]),
+        Default("kagent_otlp_enabled", False),
+        Default("kagent_otlp_endpoint", ""),
+        Default("kagent_database_type", "sqlite"),
+        Default("kagent_postgres_url", ""),
+        Default("kagent_kmcp_enabled", True),
+        Default("kagent_write_operations_enabled", False),
         # kagent Grafana MCP settings (uses VictoriaMetrics Grafana)
-        data.setdefault(
-            "kagent_grafana_url",
-            "http://vm-grafana.observability.svc:80/api",
-        )
-        data.setdefault("kagent_grafana_api_key", "")
+        Default("kagent_grafana_url", "http://vm-grafana.observability.svc:80/api"),
+        Default("kagent_grafana_api_key", ""),
         # kagent CloudNativePG (CNPG) PostgreSQL settings
-        data.setdefault("kagent_postgresql_replicas", 3)
-        data.setdefault("kagent_postgresql_storage_size", "10Gi")
-        data.setdefault("kagent_postgres_user", "kagent")
-        data.setdefault("kagent_postgres_password", "")
+        Default("kagent_postgresql_replicas", 3),
+        Default("kagent_postgresql_storage_size", "10Gi"),
+        Default("kagent_postgres_user", "kagent"),
+        Default("kagent_postgres_password", ""),
 
         # LiteLLM defaults (LLM Proxy with Multi-Provider Routing)
-        data.setdefault("litellm_enabled", False)
-        data.setdefault("litellm_master_key", "")
-        data.setdefault("litellm_salt_key", "")
-        data.setdefault("litellm_db_password", "")
-        data.setdefault("litellm_cache_password", "")
-        data.setdefault("litellm_database_url", "")
-        data.setdefault("litellm_redis_url", "")
-        data.setdefault("litellm_mcp_enabled", True)
-        data.setdefault("litellm_replicas_min", 2)
-        data.setdefault("litellm_replicas_max", 5)
-        data.setdefault("litellm_cpu_request", "500m")
-        data.setdefault("litellm_cpu_limit", "2000m")
-        data.setdefault("litellm_memory_request", "512Mi")
-        data.setdefault("litellm_memory_limit", "2Gi")
-        data.setdefault("litellm_postgresql_replicas", 3)
-        data.setdefault("litellm_postgresql_storage_size", "20Gi")
-        data.setdefault("litellm_cache_memory", "1Gi")
-        data.setdefault("litellm_langfuse_enabled", False)
-        data.setdefault("litellm_langfuse_host", "https://cloud.langfuse.com")
-        data.setdefault("litellm_langfuse_public_key", "")
-        data.setdefault("litellm_langfuse_secret_key", "")
+        Default("litellm_enabled", False),
+        Default("litellm_master_key", ""),
+        Default("litellm_salt_key", ""),
+        Default("litellm_db_password", ""),
+        Default("litellm_cache_password", ""),
+        Default("litellm_database_url", ""),
+        Default("litellm_redis_url", ""),
+        Default("litellm_mcp_enabled", True),
+        Default("litellm_replicas_min", 2),
+        Default("litellm_replicas_max", 5),
+        Default("litellm_cpu_request", "500m"),
+        Default("litellm_cpu_limit", "2000m"),
+        Default("litellm_memory_request", "512Mi"),
+        Default("litellm_memory_limit", "2Gi"),
+        Default("litellm_postgresql_replicas", 3),
+        Default("litellm_postgresql_storage_size", "20Gi"),
+        Default("litellm_cache_memory", "1Gi"),
+        Default("litellm_langfuse_enabled", False),
+        Default("litellm_langfuse_host", "https://cloud.langfuse.com"),
+        Default("litellm_langfuse_public_key", ""),
+        Default("litellm_langfuse_secret_key", ""),
 
         # Cognee Graph RAG defaults
-        data.setdefault("cognee_enabled", False)
-        data.setdefault("cognee_dedicated_db", True)
-        data.setdefault("cognee_db_name", "cognee")
-        data.setdefault("cognee_db_password", "")
-        data.setdefault("cognee_neo4j_password", "")
-        data.setdefault("cognee_neo4j_version", "5.26.0")
-        data.setdefault("cognee_neo4j_storage_size", "10Gi")
-        primary_domain = data.get("primary_domain", "example.com")
-        data.setdefault("cognee_llm_base_url", f"https://llms.{primary_domain}/v1")
-        data.setdefault("cognee_llm_model", "gpt-5-mini")
-        data.setdefault("cognee_embedding_model", "text-embedding-3-large")
-        data.setdefault("cognee_embedding_dimensions", 3072)
-        data.setdefault("cognee_mcp_server_name", "cognee-mcp")
-        data.setdefault("cognee_litellm_api_key", "")
+        Default("cognee_enabled", False),
+        Default("cognee_dedicated_db", True),
+        Default("cognee_db_name", "cognee"),
+        Default("cognee_db_password", ""),
+        Default("cognee_neo4j_password", ""),
+        Default("cognee_neo4j_version", "5.26.0"),
+        Default("cognee_neo4j_storage_size", "10Gi"),
+        Default(
+            "cognee_llm_base_url",
+            compute=lambda data: f"https://llms.{data['primary_domain']}/v1",
+            depends=("primary_domain",),
+        ),
+        Default("cognee_llm_model", "gpt-5-mini"),
+        Default("cognee_embedding_model", "text-embedding-3-large"),
+        Default("cognee_embedding_dimensions", 3072),
+        Default("cognee_mcp_server_name", "cognee-mcp"),
+        Default("cognee_litellm_api_key", ""),
         # Cognee MCP Server defaults
-        data.setdefault("cognee_mcp_enabled", False)
-        data.setdefault("cognee_mcp_version", "main")
-        data.setdefault("cognee_mcp_replicas", 1)
-        data.setdefault("cognee_mcp_resources_requests_cpu", "100m")
-        data.setdefault("cognee_mcp_resources_requests_memory", "512Mi")
-        data.setdefault("cognee_mcp_resources_limits_cpu", "1000m")
-        data.setdefault("cognee_mcp_resources_limits_memory", "2Gi")
+        Default("cognee_mcp_enabled", False),
+        Default("cognee_mcp_version", "main"),
+        Default("cognee_mcp_replicas", 1),
+        Default("cognee_mcp_resources_requests_cpu", "100m"),
+        Default("cognee_mcp_resources_requests_memory", "512Mi"),
+        Default("cognee_mcp_resources_limits_cpu", "1000m"),
+        Default("cognee_mcp_resources_limits_memory", "2Gi"),
         # Cognee API Server defaults
-        data.setdefault("cognee_api_enabled", False)
-        data.setdefault("cognee_api_hostname", "cognee-api")
-        data.setdefault("cognee_version", "main")
-        data.setdefault("cognee_replicas", 1)
-        data.setdefault("cognee_gateway", "external")
-        data.setdefault("cognee_api_resources_requests_cpu", "100m")
-        data.setdefault("cognee_api_resources_requests_memory", "512Mi")
-        data.setdefault("cognee_api_resources_limits_cpu", "2000m")
-        data.setdefault("cognee_api_resources_limits_memory", "4Gi")
+        Default("cognee_api_enabled", False),
+        Default("cognee_api_hostname", "cognee-api"),
+        Default("cognee_version", "main"),
+        Default("cognee_replicas", 1),
+        Default("cognee_gateway", "external"),
+        Default("cognee_api_resources_requests_cpu", "100m"),
+        Default("cognee_api_resources_requests_memory", "512Mi"),
+        Default("cognee_api_resources_limits_cpu", "2000m"),
+        Default("cognee_api_resources_limits_memory", "4Gi"),
         # Cognee Frontend defaults
-        data.setdefault("cognee_frontend_enabled", False)
-        data.setdefault("cognee_frontend_hostname", "cognee")
-        data.setdefault("cognee_frontend_version", "main")
-        data.setdefault("cognee_frontend_replicas", 1)
-        data.setdefault("cognee_frontend_url", f"https://cognee.{primary_domain}")
-        data.setdefault("cognee_frontend_resources_requests_cpu", "100m")
-        data.setdefault("cognee_frontend_resources_requests_memory", "256Mi")
-        data.setdefault("cognee_frontend_resources_limits_cpu", "500m")
-        data.setdefault("cognee_frontend_resources_limits_memory", "512Mi")
+        Default("cognee_frontend_enabled", False),
+        Default("cognee_frontend_hostname", "cognee"),
+        Default("cognee_frontend_version", "main"),
+        Default("cognee_frontend_replicas", 1),
+        Default(
+            "cognee_frontend_url",
+            compute=lambda data: f"https://cognee.{data['primary_domain']}",
+            depends=("primary_domain",),
+        ),
+        Default("cognee_frontend_resources_requests_cpu", "100m"),
+        Default("cognee_frontend_resources_requests_memory", "256Mi"),
+        Default("cognee_frontend_resources_limits_cpu", "500m"),
+        Default("cognee_frontend_resources_limits_memory", "512Mi"),
         # Cognee Auth0 defaults (optional)
-        data.setdefault("cognee_auth0_domain", "")
-        data.setdefault("cognee_auth0_client_id", "")
-        data.setdefault("cognee_auth0_client_secret", "")
-        data.setdefault("cognee_auth0_secret", "")
+        Default("cognee_auth0_domain", ""),
+        Default("cognee_auth0_client_id", ""),
+        Default("cognee_auth0_client_secret", ""),
+        Default("cognee_auth0_secret", ""),
 
         # Cognee JWT Security defaults (v0.5.2+ - REQUIRED when cognee_api_enabled)
         # NOTE: cognee_jwt_secret has no default - must be explicitly set
-        data.setdefault(
-            "cognee_reset_password_token_secret", data.get("cognee_jwt_secret", "")
-        )
-        data.setdefault(
-            "cognee_verification_token_secret", data.get("cognee_jwt_secret", "")
-        )
+        fallback("cognee_reset_password_token_secret", "cognee_jwt_secret", ""),
+        fallback("cognee_verification_token_secret", "cognee_jwt_secret", ""),
 
         # Cognee Security Settings defaults (v0.5.2+)
-        data.setdefault("cognee_auth_rate_limit_enabled", True)
-        data.setdefault("cognee_auth_rate_limit_login_requests", 5)
-        data.setdefault("cognee_auth_rate_limit_login_window", 300)
-        data.setdefault("cognee_auth_rate_limit_oauth_requests", 10)
-        data.setdefault("cognee_auth_rate_limit_oauth_window", 60)
-        data.setdefault("cognee_auth_rate_limit_callback_requests", 5)
-        data.setdefault("cognee_auth_rate_limit_callback_window", 60)
-        data.setdefault("cognee_ssrf_protection_enabled", True)
-        data.setdefault("cognee_allow_private_urls", False)
-        data.setdefault("cognee_oauth_state_redis_url", "")
-        data.setdefault("cognee_oauth_state_ttl", 600)
+        Default("cognee_auth_rate_limit_enabled", True),
+        Default("cognee_auth_rate_limit_login_requests", 5),
+        Default("cognee_auth_rate_limit_login_window", 300),
+        Default("cognee_auth_rate_limit_oauth_requests", 10),
+        Default("cognee_auth_rate_limit_oauth_window", 60),
+        Default("cognee_auth_rate_limit_callback_requests", 5),
+        Default("cognee_auth_rate_limit_callback_window", 60),
+        Default("cognee_ssrf_protection_enabled", True),
+        Default("cognee_allow_private_urls", False),
+        Default("cognee_oauth_state_redis_url", ""),
+        Default("cognee_oauth_state_ttl", 600),
 
         # Cognee OIDC defaults (optional)
-        data.setdefault("cognee_oidc_enabled", False)
-        data.setdefault("cognee_oidc_provider_name", "keycloak")
-        data.setdefault("cognee_oidc_client_id", "")
-        data.setdefault("cognee_oidc_client_secret", "")
-        data.setdefault("cognee_oidc_server_metadata_url", "")
-        data.setdefault("cognee_oidc_scopes", "openid profile email")
-        data.setdefault("cognee_oidc_group_claim", "groups")
-        data.setdefault("cognee_oidc_default_role", "viewer")
-        data.setdefault("cognee_oidc_auto_provision_users", True)
+        Default("cognee_oidc_enabled", False),
+        Default("cognee_oidc_provider_name", "keycloak"),
+        Default("cognee_oidc_client_id", ""),
+        Default("cognee_oidc_client_secret", ""),
+        Default("cognee_oidc_server_metadata_url", ""),
+        Default("cognee_oidc_scopes", "openid profile email"),
+        Default("cognee_oidc_group_claim", "groups"),
+        Default("cognee_oidc_default_role", "viewer"),
+        Default("cognee_oidc_auto_provision_users", True),
 
         # Flux Web UI defaults (GitOps dashboard)
-        data.setdefault("flux_web_enabled", False)
-        data.setdefault("flux_web_hostname", "flux")
+        Default("flux_web_enabled", False),
+        Default("flux_web_hostname", "flux"),
         # OAuth2 defaults to True when Keycloak is enabled
-        data.setdefault(
-            "flux_web_oauth2_enabled", data.get("keycloak_enabled", False)
-        )
-        data.setdefault("flux_web_anonymous_username", "flux-viewer")
-        data.setdefault("flux_web_anonymous_groups", ["flux-readonly"])
-        data.setdefault("flux_web_session_duration", "168h")
-        data.setdefault("flux_web_user_cache_size", 100)
+        fallback("flux_web_oauth2_enabled", "keycloak_enabled", False),
+        Default("flux_web_anonymous_username", "flux-viewer"),
+        Default("flux_web_anonymous_groups", ["flux-readonly"]),
+        Default("flux_web_session_duration", "168h"),
+        Default("flux_web_user_cache_size", 100),
         # Client secret defaults to keycloak_oidc_client_secret if not set
-        data.setdefault(
-            "keycloak_flux_web_client_secret",
-            data.get("keycloak_oidc_client_secret", ""),
-        )
+        fallback("keycloak_flux_web_client_secret", "keycloak_oidc_client_secret", ""),
 
         # Flux MCP Server defaults
-        data.setdefault("flux_mcp_enabled", False)
-        data.setdefault("flux_mcp_version", "*")
-        data.setdefault("flux_mcp_transport", "http")
-        data.setdefault("flux_mcp_port", 9090)
-        data.setdefault("flux_mcp_read_only", True)
-        data.setdefault("flux_mcp_mask_secrets", True)
-        data.setdefault("flux_mcp_replicas", 1)
-        data.setdefault("flux_mcp_cpu_request", "50m")
-        data.setdefault("flux_mcp_memory_request", "128Mi")
-        data.setdefault("flux_mcp_cpu_limit", "500m")
-        data.setdefault("flux_mcp_memory_limit", "256Mi")
+        Default("flux_mcp_enabled", False),
+        Default("flux_mcp_version", "*"),
+        Default("flux_mcp_transport", "http"),
+        Default("flux_mcp_port", 9090),
+        Default("flux_mcp_read_only", True),
+        Default("flux_mcp_mask_secrets", True),
+        Default("flux_mcp_replicas", 1),
+        Default("flux_mcp_cpu_request", "50m"),
+        Default("flux_mcp_memory_request", "128Mi"),
+        Default("flux_mcp_cpu_limit", "500m"),
+        Default("flux_mcp_memory_limit", "256Mi"),
+    ]
+)
+
+
+# Return the template context: the data from cluster.yaml and nodes.yaml with all defaults applied
+def build_context(data: dict[str, Any]) -> dict[str, Any]:
+    # Handle multi-domain configuration with backward compatibility
+    # Convert old cloudflare_domain (string) to new cloudflare_domains (array) format
+    if "cloudflare_domain" in data and data["cloudflare_domain"]:
+        if "cloudflare_domains" not in data or not data["cloudflare_domains"]:
+            data["cloudflare_domains"] = [data["cloudflare_domain"]]
+
+    # Ensure cloudflare_domains is a list
+    domains = data.get("cloudflare_domains", [])
+    if isinstance(domains, str):
+        domains = [domains]
+    data["cloudflare_domains"] = domains
+
+    # Set primary_domain for convenience (first domain in list)
+    data["primary_domain"] = domains[0] if domains else ""
+
+    return DEFAULTS.resolve(data)
+
 
+class Plugin(makejinja.plugin.Plugin):
+    def __init__(
+        self,
+        data: dict[str, Any],
+        env: jinja2.Environment,
+        config: makejinja.config.Config,
+    ):
+        self._data = data
+        self._env = env
+        self._config = config
+
+        # Fail early on malformed secrets instead of halfway through the render
+        SECRETS.validate()
+
+        # Compiled templates are cached in .cache/jinja, unless disabled with TEMPLATE_NO_BYTECODE_CACHE=1
+        if not env_flag("TEMPLATE_NO_BYTECODE_CACHE"):
+            env.bytecode_cache = TemplateBytecodeCache(env)
+
+        # Directories gated off by their `.gate` expression are pruned before they are rendered
+        self._gates = GateIndex(env, config)
+
+        # Profiling mode (TEMPLATE_PROFILE=1) writes per-template and per-function timings to .cache/profile
+        self._profile = None
+        if env_flag("TEMPLATE_PROFILE"):
+            self._profile = RenderProfile(env)
+            track_renders(env, self._profile.rendered)
+
+        # Dry runs (TEMPLATE_DRY_RUN=1, e.g. the stream output of render.py) write nothing to the
+        # output, so they keep no render state: no list of secrets and no incremental manifest
+        self._dry_run = env_flag("TEMPLATE_DRY_RUN")
+
+        # The secrets written by this render are picked up by the encrypt-secrets task
+        self._secret_outputs = SecretOutputs(config)
+        track_renders(env, self._secret_outputs.rendered)
+
+        # Incremental render mode (TEMPLATE_INCREMENTAL=1) skips templates whose inputs are unchanged
+        self._incremental = None
+        if env_flag("TEMPLATE_INCREMENTAL") and not self._dry_run:
+            self._incremental = IncrementalRender(env, config, FUNCTION_DIGESTS)
+            track_renders(env, self._incremental.rendered)
+
+        # ConfigMaps and Secrets nearing the 1 MiB limit of the API server fail the render
+        track_renders(env, check_object_sizes)
+
+        atexit.register(self.save)
+
+    # Write the render state: the rendered secrets, the Talos node fingerprints, the incremental
+    # manifest and the profile
+    def save(self) -> None:
+        if not self._dry_run:
+            self._secret_outputs.save()
+            # Fingerprinted from the files on disk, so templates skipped by an incremental
+            # render are covered as well
+            talconfig = self._config.output / TALOS_CONFIG_FILE
+            if talconfig.is_file():
+                update_manifest(talconfig.parent)
+        if self._incremental:
+            self._incremental.save()
+        if self._profile:
+            self._profile.save()
+
+    # Start another render pass in the same process (watch mode), with new data from cluster.yaml
+    # and nodes.yaml if given. Cached secrets, Talos patches and gate results are dropped; batch
+    # renders keep the secrets, which are the same for every variant.
+    def reload(self, data: dict[str, Any] | None = None, clear_secrets: bool = True) -> None:
+        if data is not None:
+            previous = set(self._data)
+            self._data = data
+            context = self.data()
+            for key in previous - set(context):
+                self._env.globals.pop(key, None)
+            self._env.globals.update(context)
+        if clear_secrets:
+            SECRETS.clear()
+            SECRETS.validate()
+        talos_patch_index.cache_clear()
+        self._gates = GateIndex(self._env, self._config)
+        if self._incremental:
+            self._incremental.restart()
+
+    def data(self) -> makejinja.plugin.Data:
+        start = time.perf_counter()
+        NETWORK.load(self._data)
+        # cluster.yaml and nodes.yaml are checked against the CUE schemas before defaults are applied
+        validate_config(self._data, NETWORK)
+        data = build_context(self._data)
+        if self._profile:
+            self._profile.data_time(time.perf_counter() - start)
         return data
 
+    def path_filters(self) -> makejinja.plugin.PathFilters:
+        path_filters = [self._gates.path_filter]
+        if self._incremental:
+            path_filters.append(self._incremental.path_filter)
+        return path_filters
+
     def filters(self) -> makejinja.plugin.Filters:
-        return [basename, nthhost]
+        filters = [basename, nthhost, in_network, minify_json, minify_yaml, gzip_base64]
+        if self._profile:
+            return [self._profile.wrap("filter", f) for f in filters]
+        return filters
 
     def functions(self) -> makejinja.plugin.Functions:
-        return [
+        functions = [
             age_key,
             cloudflare_tunnel_id,
             cloudflare_tunnel_secret,
             github_deploy_key,
             github_push_token,
             talos_patches,
+            talos_patch_map,
+            address_owners,
+            address_conflicts,
+            allocate_address,
         ]
+        if self._profile:
+            return [self._profile.wrap("function", f) for f in functions]
+        return functions
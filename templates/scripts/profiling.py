@@ -0,0 +1,108 @@
+import functools
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+import jinja2
+
+PROFILE_DIR = Path(".cache/profile")
+
+
+# Call counts and cumulative time of a filter or function
+class CallStats:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.time = 0.0
+
+    def add(self, elapsed: float) -> None:
+        self.calls += 1
+        self.time += elapsed
+
+    def report(self) -> dict[str, Any]:
+        return {"calls": self.calls, "time": round(self.time, 6)}
+
+
+# Render profile: wall time and output size per template, and calls and time per filter and
+# function, attributed to the template that called them. The report is written as JSON and as
+# collapsed stacks, which flamegraph.pl and speedscope read directly.
+class RenderProfile:
+    def __init__(self, env: jinja2.Environment, profile_dir: Path = PROFILE_DIR):
+        self._env = env
+        self._profile_dir = profile_dir
+        self._start = time.perf_counter()
+        self._data_time = 0.0
+        self._calls: dict[str, CallStats] = {}
+        self._template_calls: dict[str, dict[str, CallStats]] = {}
+        self._templates: dict[str, dict[str, float]] = {}
+
+    # Return a wrapper around a filter or function that counts its calls; kind is "filter" or
+    # "function" and the wrapper keeps the name makejinja registers it under
+    def wrap(self, kind: str, func: Callable[..., Any]) -> Callable[..., Any]:
+        key = f"{kind}:{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self._calls.setdefault(key, CallStats()).add(elapsed)
+                template = getattr(self._env.template_class, "rendering", None)
+                if template is not None:
+                    stats = self._template_calls.setdefault(template, {})
+                    stats.setdefault(key, CallStats()).add(elapsed)
+
+        return wrapper
+
+    # Record the time spent computing the plugin data
+    def data_time(self, elapsed: float) -> None:
+        self._data_time += elapsed
+
+    # Render callback: record the wall time and output size of a template
+    def rendered(self, name: str, rendered: str, elapsed: float) -> None:
+        entry = self._templates.setdefault(name, {"renders": 0, "time": 0.0, "size": 0})
+        entry["renders"] += 1
+        entry["time"] += elapsed
+        entry["size"] += len(rendered.encode("utf-8"))
+
+    def report(self) -> dict[str, Any]:
+        templates = sorted(self._templates.items(), key=lambda item: -item[1]["time"])
+        calls = sorted(self._calls.items(), key=lambda item: -item[1].time)
+        return {
+            "total_time": round(time.perf_counter() - self._start, 6),
+            "data_time": round(self._data_time, 6),
+            "render_time": round(sum(entry["time"] for entry in self._templates.values()), 6),
+            "templates": {
+                name: {
+                    "renders": entry["renders"],
+                    "time": round(entry["time"], 6),
+                    "size": entry["size"],
+                    "calls": {
+                        key: stats.report()
+                        for key, stats in sorted(self._template_calls.get(name, {}).items())
+                    },
+                }
+                for name, entry in templates
+            },
+            "calls": {key: stats.report() for key, stats in calls},
+        }
+
+    # Return the profile as collapsed stacks in microseconds, with the time a template spent in
+    # filters and functions split off from its own time
+    def folded(self) -> list[str]:
+        lines = [f"data {round(self._data_time * 1e6)}"]
+        for name, entry in sorted(self._templates.items()):
+            calls = self._template_calls.get(name, {})
+            own_time = entry["time"] - sum(stats.time for stats in calls.values())
+            lines.append(f"render;{name} {max(0, round(own_time * 1e6))}")
+            for key, stats in sorted(calls.items()):
+                lines.append(f"render;{name};{key} {round(stats.time * 1e6)}")
+        return lines
+
+    # Write profile.json and profile.folded
+    def save(self) -> None:
+        self._profile_dir.mkdir(parents=True, exist_ok=True)
+        (self._profile_dir / "profile.json").write_text(json.dumps(self.report(), indent=2) + "\n")
+        (self._profile_dir / "profile.folded").write_text("\n".join(self.folded()) + "\n")
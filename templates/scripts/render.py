@@ -0,0 +1,339 @@
+import argparse
+import contextlib
+import io
+import itertools
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import tarfile
+from pathlib import Path
+from typing import BinaryIO, Iterable, NamedTuple
+
+import attrs
+import typed_settings as ts
+from jinja2 import Environment
+from makejinja import app
+from makejinja.config import Config
+from makejinja.plugin import Plugin
+
+from plugin import env_flag, track_renders
+
+YAML_SUFFIXES = (".yaml", ".yml")
+# Comments and the document marker a file starts with, replaced by the marker of the YAML stream
+LEADING_DOCUMENT_MARKER = re.compile(r"\A(?:[ \t]*(?:#[^\n]*)?\n)*---[ \t]*(?:\n|\Z)")
+
+
+class Job(NamedTuple):
+    input: Path
+    template_name: str
+    output: Path
+    enforce_jinja_suffix: bool
+
+
+class RenderEvent(NamedTuple):
+    index: int
+    template_name: str
+    rendered: str
+    elapsed: float
+
+
+# A rendered or copied file, with its path relative to the output directory
+class OutputFile(NamedTuple):
+    path: Path
+    data: bytes
+    input: Path
+
+
+# Load the makejinja configuration the same way the makejinja CLI does
+def load_config(config_file: Path = Path("makejinja.toml")) -> Config:
+    return ts.load(Config, appname="makejinja", config_files=[config_file])
+
+
+# Load the data files and all plugins, so that Plugin.data() is only computed once
+def init_environment(config: Config) -> tuple[Environment, list[Plugin]]:
+    for path in config.import_paths:
+        if str(path.resolve()) not in sys.path:
+            sys.path.append(str(path.resolve()))
+    data = app.load_data(config)
+    env = app.init_jinja_env(config, data)
+    plugins = [
+        app.load_plugin(name, env, data, config)
+        for name in itertools.chain(config.plugins, config.loaders)
+    ]
+    return env, plugins
+
+
+# Walk the inputs exactly like makejinja, creating output directories and returning the files to render.
+# With create_dirs=False nothing is created, for renders that do not write to the output.
+def collect_jobs(
+    config: Config, plugins: list[Plugin], create_dirs: bool = True
+) -> tuple[list[Job], dict[Path, Path]]:
+    path_filters = [
+        path_filter
+        for plugin in plugins
+        if hasattr(plugin, "path_filters")
+        for path_filter in plugin.path_filters()
+    ]
+    jobs: list[Job] = []
+    rendered_files: set[Path] = set()
+    rendered_dirs: dict[Path, Path] = {}
+
+    for user_input_path in config.inputs:
+        if user_input_path.is_file():
+            relative_path = Path(user_input_path.name)
+            output_path = app.generate_output_path(config, relative_path)
+            if output_path not in rendered_files:
+                jobs.append(Job(user_input_path, str(relative_path), output_path, False))
+                rendered_files.add(output_path)
+            continue
+
+        input_paths = (
+            input_path
+            for include_pattern in config.include_patterns
+            for input_path in sorted(user_input_path.glob(include_pattern))
+        )
+        for input_path in input_paths:
+            relative_path = input_path.relative_to(user_input_path)
+            output_path = app.generate_output_path(config, relative_path)
+            exclude_pattern_match = any(
+                input_path.match(x) for x in config.exclude_patterns
+            )
+            path_filter_match = any(
+                not path_filter(input_path) for path_filter in path_filters
+            )
+            if exclude_pattern_match or path_filter_match:
+                app.log(f"Skip excluded path '{input_path}'", config)
+            elif input_path.is_file() and output_path not in rendered_files:
+                jobs.append(
+                    Job(input_path, str(relative_path), output_path, bool(config.jinja_suffix))
+                )
+                rendered_files.add(output_path)
+            elif input_path.is_dir() and output_path not in rendered_dirs:
+                if create_dirs:
+                    app.render_dir(input_path, output_path, config)
+                rendered_dirs[output_path] = input_path
+
+    return jobs, rendered_dirs
+
+
+# Return what makejinja would write for a job, or None for an empty template it would skip
+def render_data(job: Job, config: Config, env: Environment) -> bytes | None:
+    if job.input.suffix != config.jinja_suffix and job.enforce_jinja_suffix:
+        return job.input.read_bytes()
+    template = env.get_template(job.template_name)
+    rendered = template.render(app.load_file_data(job.template_name, config))
+    if rendered.strip() == "" and not config.keep_empty:
+        return None
+    return rendered.encode("utf-8")
+
+
+# Shared with the forked workers, which inherit the environment and the plugin data
+_env: Environment | None = None
+_config: Config | None = None
+_jobs: list[Job] = []
+_stream = False
+
+
+def _render_shard(shard: tuple[int, int]) -> tuple[list[RenderEvent], list[tuple[int, bytes]]]:
+    offset, step = shard
+    events: list[RenderEvent] = []
+    outputs: list[tuple[int, bytes]] = []
+    index = offset
+
+    def collect(name: str, rendered: str, elapsed: float) -> None:
+        events.append(RenderEvent(index, name, rendered, elapsed))
+
+    # Render callbacks run in the parent once all workers are done, in template order
+    _env.template_class.render_callbacks[:] = [collect]
+    for index in range(offset, len(_jobs), step):
+        job = _jobs[index]
+        if _stream:
+            data = render_data(job, _config, _env)
+            if data is not None:
+                outputs.append((index, data))
+            continue
+        app.render_file(
+            job.input,
+            job.template_name,
+            job.output,
+            _config,
+            _env,
+            job.enforce_jinja_suffix,
+        )
+    return events, outputs
+
+
+# Render the jobs across a pool of forked workers, each rendering every n-th template. With
+# stream=True nothing is written and the files are returned in template order instead.
+def render_jobs(
+    config: Config, env: Environment, jobs: list[Job], workers: int, stream: bool = False
+) -> list[OutputFile]:
+    global _env, _config, _jobs, _stream
+
+    # Ensure a callback hook exists so rendered templates can be reported back to the parent
+    if not hasattr(env.template_class, "render_callbacks"):
+        track_renders(env, lambda name, rendered, elapsed: None)
+    callbacks = list(env.template_class.render_callbacks)
+    _env, _config, _jobs, _stream = env, attrs.evolve(config, quiet=True), jobs, stream
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        workers = 1
+    workers = max(1, min(workers, len(jobs)))
+    shards = [(offset, workers) for offset in range(workers)]
+    if workers == 1:
+        results = [_render_shard(shards[0])]
+    else:
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            results = pool.map(_render_shard, shards)
+
+    env.template_class.render_callbacks[:] = callbacks
+    for event in sorted(itertools.chain.from_iterable(events for events, _ in results)):
+        job = jobs[event.index]
+        if event.rendered.strip() == "" and not config.keep_empty:
+            app.log(f"Skip empty file '{job.input}'", config)
+        else:
+            app.log(f"Render file '{job.input}' -> '{job.output}'", config)
+        for callback in callbacks:
+            callback(event.template_name, event.rendered, event.elapsed)
+
+    return [
+        OutputFile(jobs[index].output.relative_to(config.output), data, jobs[index].input)
+        for index, data in sorted(itertools.chain.from_iterable(outputs for _, outputs in results))
+    ]
+
+
+# Return the number of workers to render with: the profiling mode counts filter and function
+# calls in the rendering process only
+def worker_count(config: Config, workers: int) -> int:
+    if env_flag("TEMPLATE_PROFILE") and workers > 1:
+        app.log("Profiling enabled, rendering with a single worker", config)
+        return 1
+    return workers
+
+
+# Render the templates like makejinja does, but with the files spread over several processes
+def render(config: Config, workers: int) -> None:
+    for cmd in config.exec_pre:
+        app.exec(cmd)
+
+    if config.output.is_dir() and config.clean:
+        app.log(f"Remove output '{config.output}'", config)
+        shutil.rmtree(config.output)
+    config.output.mkdir(exist_ok=True, parents=True)
+
+    workers = worker_count(config, workers)
+    env, plugins = init_environment(config)
+    jobs, rendered_dirs = collect_jobs(config, plugins)
+    render_jobs(config, env, jobs, workers)
+    app.postprocess_rendered_dirs(config, rendered_dirs)
+
+    for cmd in config.exec_post:
+        app.exec(cmd)
+
+
+# Render the templates without touching the output directory and return the files makejinja
+# would write, in template order. The exec_pre and exec_post commands, which work on the output
+# directory, are not run.
+def render_stream(config: Config, workers: int) -> list[OutputFile]:
+    os.environ["TEMPLATE_DRY_RUN"] = "1"
+    workers = worker_count(config, workers)
+    env, plugins = init_environment(config)
+    jobs, _ = collect_jobs(config, plugins, create_dirs=False)
+    return render_jobs(config, env, jobs, workers, stream=True)
+
+
+# Write the files as an uncompressed tar archive, with the permissions and modification times
+# of their inputs
+def write_tar(files: Iterable[OutputFile], fileobj: BinaryIO) -> None:
+    with tarfile.open(fileobj=fileobj, mode="w|") as tar:
+        for file in files:
+            stat = file.input.stat()
+            info = tarfile.TarInfo(file.path.as_posix())
+            info.size = len(file.data)
+            info.mode = stat.st_mode & 0o777
+            info.mtime = int(stat.st_mtime)
+            tar.addfile(info, io.BytesIO(file.data))
+
+
+# Write the YAML files as one multi-document stream, each file starting with a `# Source:`
+# comment naming its path. Returns the number of files skipped because they are not YAML
+# manifests: other file types and the Go templates of local Helm charts.
+def write_yaml_stream(files: Iterable[OutputFile], fileobj: BinaryIO) -> int:
+    files = list(files)
+    charts = {file.path.parent for file in files if file.path.name == "Chart.yaml"}
+    skipped = 0
+    for file in files:
+        is_chart_template = any(
+            file.path.is_relative_to(chart / "templates") for chart in charts
+        )
+        if file.path.suffix not in YAML_SUFFIXES or is_chart_template:
+            skipped += 1
+            continue
+        text = LEADING_DOCUMENT_MARKER.sub("", file.data.decode("utf-8"), count=1)
+        fileobj.write(f"---\n# Source: {file.path.as_posix()}\n{text}".encode("utf-8"))
+        if text and not text.endswith("\n"):
+            fileobj.write(b"\n")
+    return skipped
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Render the templates with makejinja using a pool of worker processes"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--config", type=Path, default=Path("makejinja.toml"), help="makejinja config file"
+    )
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument(
+        "--output",
+        type=Path,
+        help="render into this directory instead of the configured output, e.g. a tmpfs, "
+        "without touching the working tree or its render state",
+    )
+    target.add_argument(
+        "--stream",
+        choices=["tar", "yaml"],
+        help="write the rendered files as a tar archive or a multi-document YAML stream "
+        "instead of writing them to the output directory",
+    )
+    parser.add_argument(
+        "--stream-file",
+        default="-",
+        help="file to write the stream to (default: - for stdout)",
+    )
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    if app.single_input_output_file(config):
+        parser.error("rendering a single input file is not supported, use makejinja")
+
+    if args.output:
+        os.environ["TEMPLATE_DRY_RUN"] = "1"
+        render(attrs.evolve(config, output=args.output), args.workers)
+    elif args.stream:
+        to_stdout = args.stream_file == "-"
+        # Nothing is written to the paths makejinja would log, and on stdout the log messages
+        # would end up in the stream
+        files = render_stream(attrs.evolve(config, quiet=True), args.workers)
+        stream = contextlib.nullcontext(sys.stdout.buffer) if to_stdout else open(
+            args.stream_file, "wb"
+        )
+        with stream as fileobj:
+            if args.stream == "tar":
+                write_tar(files, fileobj)
+            elif skipped := write_yaml_stream(files, fileobj):
+                print(f"Skipped {skipped} files that are not YAML manifests", file=sys.stderr)
+    else:
+        render(config, args.workers)
+
+
+if __name__ == "__main__":
+    main()
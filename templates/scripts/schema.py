@@ -0,0 +1,643 @@
+import argparse
+import hashlib
+import ipaddress
+import json
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any
+
+import yaml
+
+from network import NetworkModel
+
+COMPILER_VERSION = 2
+SCHEMA_DIR = Path(".taskfiles/template/resources")
+CACHE_DIR = Path(".cache/schema")
+# Schemas of the data files, keyed by the file they describe
+SCHEMA_FILES = {"cluster.yaml": "cluster.schema.cue", "nodes.yaml": "nodes.schema.cue"}
+
+TOKEN = re.compile(
+    r"""
+    (?P<space>\s+|//[^\n]*)
+    | (?P<string>"(?:[^"\\]|\\.)*")
+    | (?P<number>-?\d+(?:\.\d+)?)
+    | (?P<op>_\|_|\.\.\.|=~|!=|>=|<=|[&|*:?,\[\]{}()<>.])
+    | (?P<ident>[#_A-Za-z][A-Za-z0-9_]*)
+    """,
+    re.VERBOSE,
+)
+TYPES = {
+    "_": lambda value: True,
+    "string": lambda value: isinstance(value, str),
+    "bool": lambda value: isinstance(value, bool),
+    "int": lambda value: isinstance(value, int) and not isinstance(value, bool),
+    "float": lambda value: isinstance(value, float),
+    "number": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+}
+FQDN = re.compile(
+    r"^(?=.{1,253}\.?$)(?:(?!-)[A-Za-z0-9-]{1,63}(?<!-)\.)*(?!-)[A-Za-z0-9-]{1,63}(?<!-)\.?$"
+)
+# An unescaped `\(` in a string literal starts an interpolation
+INTERPOLATION = re.compile(r"(?<!\\)(?:\\\\)*\\\(")
+COMPARISONS = {
+    "!=": lambda value, other: value != other,
+    ">=": lambda value, other: value >= other,
+    "<=": lambda value, other: value <= other,
+    ">": lambda value, other: value > other,
+    "<": lambda value, other: value < other,
+}
+# Value of a field that is neither in the data nor has a default
+MISSING = object()
+
+
+class SchemaError(ValueError):
+    def __init__(self, errors: list[str]):
+        super().__init__("Invalid configuration:\n" + "\n".join(f"  {e}" for e in errors))
+        self.errors = errors
+
+
+# Raised for CUE the compiler does not understand. A schema is either compiled completely or not
+# at all, so no part of it is silently skipped during validation.
+class UnsupportedSchema(ValueError):
+    def __init__(self, message: str):
+        super().__init__(
+            f"{message} (schema.py supports a subset of CUE, validate with `cue vet` instead)"
+        )
+
+
+def is_ip(value: Any, parse: Any) -> bool:
+    try:
+        parse(value)
+    except (TypeError, ValueError):
+        return False
+    return isinstance(value, str)
+
+
+def is_unique(value: Any) -> bool:
+    if not isinstance(value, list):
+        return False
+    items = [json.dumps(item, sort_keys=True) for item in value]
+    return len(items) == len(set(items))
+
+
+BUILTINS = {
+    "net.IPv4": lambda value: is_ip(value, ipaddress.IPv4Address),
+    # Like Go's net.ParseCIDR, host bits may be set, e.g. 10.10.10.5/24
+    "net.IPCIDR": lambda value: is_ip(value, lambda text: ipaddress.ip_network(text, strict=False))
+    and "/" in value,
+    "net.FQDN": lambda value: isinstance(value, str) and FQDN.match(value) is not None,
+    "list.UniqueItems": is_unique,
+}
+
+
+# Parser for the subset of CUE the schemas use: definitions of closed structs with required and
+# optional fields, basic types, net and list builtins, regular expressions, comparisons against
+# literals and sibling fields, disjunctions with defaults, lists and list comprehensions. The
+# result is plain JSON, so it can be cached:
+#   ["type", name], ["builtin", name], ["literal", value], ["match", regex],
+#   ["compare", op, operand], ["and", parts], ["or", alternatives, default index],
+#   ["list", items, rest], ["struct", fields, patterns], ["ref", name],
+#   ["select", expr, name], ["for", name, source, body]
+# Anything else, including references that do not resolve, raises UnsupportedSchema.
+class Parser:
+    def __init__(self, source: str, origin: str):
+        self._origin = origin
+        self._tokens: list[tuple[str, str, int]] = []
+        self._imports: set[str] = set()
+        self._index = 0
+        position, line = 0, 1
+        while position < len(source):
+            match = TOKEN.match(source, position)
+            if match is None:
+                raise UnsupportedSchema(f"{origin}:{line}: unexpected {source[position]!r}")
+            if match.lastgroup != "space":
+                self._tokens.append((match.lastgroup, match.group(), line))
+            line += match.group().count("\n")
+            position = match.end()
+
+    def _peek(self, offset: int = 0) -> str | None:
+        index = self._index + offset
+        return self._tokens[index][1] if index < len(self._tokens) else None
+
+    def _next(self) -> tuple[str, str, int]:
+        if self._index >= len(self._tokens):
+            raise UnsupportedSchema(f"{self._origin}: unexpected end of file")
+        token = self._tokens[self._index]
+        self._index += 1
+        return token
+
+    def _expect(self, text: str) -> None:
+        _, found, line = self._next()
+        if found != text:
+            raise UnsupportedSchema(f"{self._origin}:{line}: expected {text!r}, found {found!r}")
+
+    # Return the value of a string token; interpolations and multi-line strings are not supported
+    def _string(self, text: str, line: int) -> str:
+        if INTERPOLATION.search(text) or "\n" in text:
+            raise UnsupportedSchema(f"{self._origin}:{line}: unsupported string {text}")
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            raise UnsupportedSchema(f"{self._origin}:{line}: unsupported string {text}") from None
+
+    def parse(self) -> dict[str, Any]:
+        if self._peek() == "package":
+            self._next()
+            self._next()
+        if self._peek() == "import":
+            self._next()
+            parenthesized = self._peek() == "("
+            if parenthesized:
+                self._next()
+            while self._peek() is not None and self._peek() != ")":
+                _, text, line = self._next()
+                self._imports.add(self._string(text, line).rsplit("/", 1)[-1])
+                if not parenthesized:
+                    break
+            if parenthesized:
+                self._expect(")")
+
+        definitions: dict[str, Any] = {}
+        root = None
+        while self._peek() is not None:
+            kind, name, line = self._tokens[self._index]
+            if kind == "ident" and name.startswith("#") and self._peek(1) == ":":
+                self._index += 2
+                definitions[name] = self._expression()
+            elif root is None:
+                root = self._expression()
+            else:
+                raise UnsupportedSchema(f"{self._origin}:{line}: unexpected {name!r}")
+        for expression in [*definitions.values(), root]:
+            if expression is not None:
+                self._check_references(expression, [set(definitions)])
+        return {"definitions": definitions, "root": root}
+
+    # Raise for references that are not a definition, a field of an enclosing struct or a
+    # comprehension variable. Those would evaluate to nothing and accept any value.
+    def _check_references(self, expression: list[Any], scope: list[set[str]]) -> None:
+        kind = expression[0]
+        if kind == "ref" and not any(expression[1] in names for names in scope):
+            raise UnsupportedSchema(f"{self._origin}: unresolved reference {expression[1]}")
+        if kind == "select":
+            self._check_references(expression[1], scope)
+        elif kind == "compare":
+            self._check_references(expression[2], scope)
+        elif kind in ("and", "or"):
+            for part in expression[1]:
+                self._check_references(part, scope)
+        elif kind == "list":
+            for item in [*expression[1], *([expression[2]] if expression[2] else [])]:
+                self._check_references(item, scope)
+        elif kind == "for":
+            self._check_references(expression[2], scope)
+            self._check_references(expression[3], [*scope, {expression[1]}])
+        elif kind == "struct":
+            inner = [*scope, {name for name, _, _ in expression[1]}]
+            for _, _, field in expression[1]:
+                self._check_references(field, inner)
+            for label, pattern in expression[2]:
+                self._check_references(label, inner)
+                self._check_references(pattern, inner)
+
+    def _expression(self) -> list[Any]:
+        alternatives, default = [], None
+        while True:
+            if self._peek() == "*":
+                self._next()
+                default = len(alternatives)
+            alternatives.append(self._conjunction())
+            if self._peek() != "|":
+                break
+            self._next()
+        if len(alternatives) == 1 and default is None:
+            return alternatives[0]
+        return ["or", alternatives, default]
+
+    def _conjunction(self) -> list[Any]:
+        parts = [self._unary()]
+        while self._peek() == "&":
+            self._next()
+            parts.append(self._unary())
+        return parts[0] if len(parts) == 1 else ["and", parts]
+
+    def _unary(self) -> list[Any]:
+        if self._peek() == "=~":
+            self._next()
+            kind, text, line = self._next()
+            if kind != "string":
+                raise UnsupportedSchema(f"{self._origin}:{line}: unsupported pattern {text}")
+            return ["match", self._string(text, line)]
+        if self._peek() in COMPARISONS:
+            _, op, _ = self._next()
+            return ["compare", op, self._primary()]
+        return self._primary()
+
+    def _primary(self) -> list[Any]:
+        kind, text, line = self._next()
+        if kind == "string":
+            return ["literal", self._string(text, line)]
+        if kind == "number":
+            return ["literal", float(text) if "." in text else int(text)]
+        if text == "[":
+            return self._list()
+        if text == "{":
+            return self._struct()
+        if text == "(":
+            expression = self._expression()
+            self._expect(")")
+            return expression
+        if kind != "ident":
+            raise UnsupportedSchema(f"{self._origin}:{line}: unexpected {text!r}")
+        if text in ("true", "false", "null"):
+            return ["literal", json.loads(text)]
+        if text in TYPES:
+            return ["type", text]
+        if text in self._imports and self._peek() == ".":
+            self._next()
+            _, name, _ = self._next()
+            builtin = f"{text}.{name}"
+            if builtin not in BUILTINS:
+                raise UnsupportedSchema(f"{self._origin}:{line}: unsupported builtin {builtin}")
+            if self._peek() == "(":
+                self._next()
+                self._expect(")")
+            return ["builtin", builtin]
+        expression: list[Any] = ["ref", text]
+        while self._peek() == ".":
+            self._next()
+            expression = ["select", expression, self._next()[1]]
+        return expression
+
+    def _list(self) -> list[Any]:
+        if self._peek() == "for":
+            self._next()
+            _, name, _ = self._next()
+            self._expect("in")
+            source = self._primary()
+            self._expect("{")
+            body = self._expression()
+            self._expect("}")
+            self._expect("]")
+            return ["for", name, source, body]
+
+        items, rest = [], None
+        while self._peek() != "]":
+            if self._peek() == "...":
+                self._next()
+                rest = ["type", "_"] if self._peek() in ("]", ",") else self._expression()
+            else:
+                items.append(self._expression())
+            if self._peek() == ",":
+                self._next()
+        self._expect("]")
+        return ["list", items, rest]
+
+    def _struct(self) -> list[Any]:
+        fields, patterns = [], []
+        while self._peek() != "}":
+            if self._peek() == "[":
+                self._next()
+                label = self._expression()
+                self._expect("]")
+                self._expect(":")
+                patterns.append([label, self._expression()])
+            else:
+                kind, name, line = self._next()
+                if kind == "string":
+                    name = self._string(name, line)
+                elif kind != "ident" or name.startswith("#"):
+                    # Nested definitions, embeddings, comprehensions and `...` are not supported
+                    raise UnsupportedSchema(f"{self._origin}:{line}: unexpected {name!r}")
+                optional = self._peek() == "?"
+                if optional:
+                    self._next()
+                self._expect(":")
+                fields.append([name, optional, self._expression()])
+            if self._peek() == ",":
+                self._next()
+        self._expect("}")
+        return ["struct", fields, patterns]
+
+
+# Return the value of an expression as CUE would write it in an error message
+def describe(expression: list[Any]) -> str:
+    kind = expression[0]
+    if kind in ("type", "builtin", "ref"):
+        return expression[1]
+    if kind == "literal":
+        return json.dumps(expression[1])
+    if kind == "match":
+        return f"=~{json.dumps(expression[1])}"
+    if kind == "compare":
+        return f"{expression[1]}{describe(expression[2])}"
+    if kind == "and":
+        return " & ".join(describe(part) for part in expression[1])
+    if kind == "or":
+        return " | ".join(
+            ("*" if index == expression[2] else "") + describe(alternative)
+            for index, alternative in enumerate(expression[1])
+        )
+    if kind == "list":
+        items = [describe(item) for item in expression[1]]
+        if expression[2] is not None:
+            items.append("..." if expression[2] == ["type", "_"] else f"...{describe(expression[2])}")
+        return f"[{', '.join(items)}]"
+    if kind == "select":
+        return f"{describe(expression[1])}.{expression[2]}"
+    if kind == "for":
+        return f"[for {expression[1]} in {describe(expression[2])} {{{describe(expression[3])}}}]"
+    return "{...}"
+
+
+def show(value: Any) -> str:
+    text = json.dumps(value, default=str)
+    return text if len(text) <= 80 else text[:77] + "..."
+
+
+def join(path: str, name: str | int) -> str:
+    if isinstance(name, int):
+        return f"{path}[{name}]"
+    return f"{path}.{name}" if path else name
+
+
+# Return the default of a field expression, e.g. "10.42.0.0/16" for `*"10.42.0.0/16" | net.IPCIDR`
+def default_value(expression: list[Any]) -> Any:
+    if expression[0] == "or" and expression[2] is not None:
+        default = expression[1][expression[2]]
+        if default[0] == "literal":
+            return default[1]
+    return MISSING
+
+
+# A compiled schema. Definitions and all structs in them are closed, like CUE definitions:
+# fields that are not in the schema are errors. Every error is collected, not just the first.
+class Schema:
+    def __init__(self, compiled: dict[str, Any]):
+        self._definitions = compiled["definitions"]
+        self._root = compiled["root"]
+
+    # Return every error of a value against the schema
+    def validate(self, value: Any) -> list[str]:
+        errors: list[str] = []
+        if self._root is not None:
+            self._check(self._root, value, "", [], errors)
+        return errors
+
+    # Scopes are a stack of (struct fields, data) and (comprehension variable, value) frames
+    def _resolve(self, name: str, scope: list[tuple[Any, Any]]) -> Any:
+        for names, values in reversed(scope):
+            if isinstance(names, str):
+                if names == name:
+                    return values
+            elif name in names:
+                if isinstance(values, dict) and name in values:
+                    return values[name]
+                return default_value(names[name])
+        return MISSING
+
+    # Return the concrete value of an expression, e.g. the list a comprehension produces
+    def _evaluate(self, expression: list[Any], scope: list[tuple[Any, Any]]) -> Any:
+        kind = expression[0]
+        if kind == "literal":
+            return expression[1]
+        if kind == "ref":
+            return self._resolve(expression[1], scope)
+        if kind == "select":
+            value = self._evaluate(expression[1], scope)
+            return value.get(expression[2], MISSING) if isinstance(value, dict) else MISSING
+        if kind == "for":
+            source = self._evaluate(expression[2], scope)
+            values = [
+                self._evaluate(expression[3], [*scope, (expression[1], item)])
+                for item in (source if isinstance(source, list) else [])
+            ]
+            return [value for value in values if value is not MISSING]
+        if kind == "and":
+            for part in expression[1]:
+                value = self._evaluate(part, scope)
+                if value is not MISSING:
+                    return value
+            return MISSING
+        if kind == "struct":
+            inner = [*scope, ({name: field for name, _, field in expression[1]}, None)]
+            values = {name: self._evaluate(field, inner) for name, _, field in expression[1]}
+            return {name: value for name, value in values.items() if value is not MISSING}
+        return default_value(expression)
+
+    def _check(
+        self,
+        expression: list[Any],
+        value: Any,
+        path: str,
+        scope: list[tuple[Any, Any]],
+        errors: list[str],
+    ) -> None:
+        kind = expression[0]
+        if kind == "and":
+            # Report the first constraint a value breaks, e.g. the type rather than a range
+            for part in expression[1]:
+                before = len(errors)
+                self._check(part, value, path, scope, errors)
+                if len(errors) > before:
+                    return
+            return
+        if kind == "or":
+            for alternative in expression[1]:
+                if not self._errors(alternative, value, path, scope):
+                    return
+            errors.append(f"{path}: invalid value {show(value)} (does not satisfy {describe(expression)})")
+            return
+        if kind == "struct":
+            self._check_struct(expression, value, path, scope, errors)
+            return
+        if kind == "list":
+            self._check_list(expression, value, path, scope, errors)
+            return
+        if kind == "ref" and expression[1] in self._definitions:
+            self._check(self._definitions[expression[1]], value, path, scope, errors)
+            return
+        if not self._satisfies(expression, value, scope):
+            errors.append(f"{path}: invalid value {show(value)} (does not satisfy {describe(expression)})")
+
+    def _errors(
+        self, expression: list[Any], value: Any, path: str, scope: list[tuple[Any, Any]]
+    ) -> list[str]:
+        errors: list[str] = []
+        self._check(expression, value, path, scope, errors)
+        return errors
+
+    def _satisfies(self, expression: list[Any], value: Any, scope: list[tuple[Any, Any]]) -> bool:
+        kind = expression[0]
+        if kind == "type":
+            return TYPES[expression[1]](value)
+        if kind == "builtin":
+            return BUILTINS[expression[1]](value)
+        if kind == "literal":
+            return type(value) is type(expression[1]) and value == expression[1]
+        if kind == "match":
+            return isinstance(value, str) and re.search(expression[1], value) is not None
+        if kind == "compare":
+            other = self._evaluate(expression[2], scope)
+            if other is MISSING:
+                return True
+            if expression[1] != "!=" and not (TYPES["number"](value) and TYPES["number"](other)):
+                return False
+            return COMPARISONS[expression[1]](value, other)
+        # References, selectors and comprehensions unify with the value they evaluate to
+        other = self._evaluate(expression, scope)
+        return other is MISSING or value == other
+
+    def _check_list(
+        self,
+        expression: list[Any],
+        value: Any,
+        path: str,
+        scope: list[tuple[Any, Any]],
+        errors: list[str],
+    ) -> None:
+        items, rest = expression[1], expression[2]
+        if not isinstance(value, list) or len(value) < len(items) or (
+            rest is None and len(value) > len(items)
+        ):
+            errors.append(f"{path}: invalid value {show(value)} (does not satisfy {describe(expression)})")
+            return
+        for index, item in enumerate(value):
+            element = items[index] if index < len(items) else rest
+            self._check(element, item, join(path, index), scope, errors)
+
+    def _check_struct(
+        self,
+        expression: list[Any],
+        value: Any,
+        path: str,
+        scope: list[tuple[Any, Any]],
+        errors: list[str],
+    ) -> None:
+        if not isinstance(value, dict):
+            errors.append(f"{path or 'value'}: invalid value {show(value)} (expected a struct)")
+            return
+        fields = {name: field for name, _, field in expression[1]}
+        inner = [*scope, (fields, value)]
+        for name, optional, field in expression[1]:
+            field_path = join(path, name)
+            if name in value:
+                self._check(field, value[name], field_path, inner, errors)
+            elif name.startswith("_"):
+                # Hidden fields are not part of the data, they hold checks over other fields
+                computed = self._evaluate(field, inner)
+                if computed is not MISSING:
+                    self._check(field, computed, field_path, inner, errors)
+            elif not optional and default_value(field) is MISSING:
+                errors.append(f"{field_path}: field is required but not present")
+
+        for name, item in value.items():
+            if name in fields:
+                continue
+            matching = [
+                pattern for label, pattern in expression[2] if self._satisfies(label, name, inner)
+            ]
+            if not matching:
+                errors.append(f"{join(path, name)}: field not allowed")
+            for pattern in matching:
+                self._check(pattern, item, join(path, name), inner, errors)
+
+
+# In-memory cache of compiled schemas, keyed by the digest of their source
+_schemas: dict[str, Schema] = {}
+
+
+# Return the compiled schema of a CUE file. The compiled form is cached in .cache/schema until
+# the file or the compiler change, and in memory for the rest of the process.
+def load_schema(path: Path, cache_dir: Path = CACHE_DIR) -> Schema:
+    source = path.read_text()
+    digest = hashlib.sha256(f"{COMPILER_VERSION}\n{source}".encode("utf-8")).hexdigest()
+    if digest in _schemas:
+        return _schemas[digest]
+
+    cache_file = cache_dir / f"{path.stem}-{digest[:16]}.json"
+    try:
+        compiled = json.loads(cache_file.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        compiled = Parser(source, str(path)).parse()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        for stale in cache_dir.glob(f"{path.stem}-*.json"):
+            stale.unlink()
+        tmp_file = cache_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(compiled) + "\n")
+        tmp_file.replace(cache_file)
+    _schemas[digest] = Schema(compiled)
+    return _schemas[digest]
+
+
+# Return the errors of `cue vet` for data against a schema the compiler does not support
+def cue_vet(data: dict[str, Any], schema_file: Path) -> list[str]:
+    with tempfile.NamedTemporaryFile("w", suffix=".json") as data_file:
+        json.dump(data, data_file, default=str)
+        data_file.flush()
+        result = subprocess.run(
+            ["cue", "vet", data_file.name, str(schema_file)], capture_output=True, text=True
+        )
+    if result.returncode == 0:
+        return []
+    lines = [line.strip() for line in result.stderr.splitlines() if line.strip()]
+    return lines or [f"cue vet {schema_file} failed with exit code {result.returncode}"]
+
+
+# Validate the merged cluster.yaml and nodes.yaml data against both schemas in one pass and
+# raise a SchemaError listing every error, including the address conflicts of the network
+# model. Schemas that do not exist are skipped. A schema the compiler does not support is
+# checked with `cue vet` when cue is installed, and raises UnsupportedSchema otherwise.
+def validate_config(
+    data: dict[str, Any], network: NetworkModel | None = None, schema_dir: Path = SCHEMA_DIR
+) -> None:
+    parts = {
+        "cluster.yaml": {key: value for key, value in data.items() if key != "nodes"},
+        "nodes.yaml": {key: value for key, value in data.items() if key == "nodes"},
+    }
+    errors: list[str] = []
+    for data_file, schema_file in SCHEMA_FILES.items():
+        if not (schema_dir / schema_file).is_file():
+            continue
+        try:
+            schema_errors = load_schema(schema_dir / schema_file).validate(parts[data_file])
+        except UnsupportedSchema:
+            if shutil.which("cue") is None:
+                raise
+            schema_errors = cue_vet(parts[data_file], schema_dir / schema_file)
+        errors.extend(f"{data_file}: {error}" for error in schema_errors)
+    errors.extend((network or NetworkModel(data)).conflicts())
+    if errors:
+        raise SchemaError(errors)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Validate cluster.yaml and nodes.yaml against the CUE schemas"
+    )
+    parser.add_argument("--cluster", type=Path, default=Path("cluster.yaml"), help="cluster config")
+    parser.add_argument("--nodes", type=Path, default=Path("nodes.yaml"), help="node config")
+    parser.add_argument(
+        "--schema-dir",
+        type=Path,
+        default=SCHEMA_DIR,
+        help="directory with the *.schema.cue files (default: .taskfiles/template/resources)",
+    )
+    args = parser.parse_args()
+
+    data = yaml.safe_load(args.cluster.read_text()) or {}
+    data["nodes"] = (yaml.safe_load(args.nodes.read_text()) or {}).get("nodes")
+    try:
+        validate_config(data, schema_dir=args.schema_dir)
+    except (SchemaError, UnsupportedSchema) as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
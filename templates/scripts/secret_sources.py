@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Any, Callable
+
+import yaml
+
+# Default locations of the secret files in the repository root
+SECRET_FILES = {
+    "age_key": "age.key",
+    "cloudflare_tunnel": "cloudflare-tunnel.json",
+    "github_deploy_key": "github-deploy.key",
+    "github_push_token": "github-push-token.txt",
+}
+
+# Environment variables that can provide the secret material instead of the files
+SECRET_ENV_VARS = {
+    "age_key": "TEMPLATE_AGE_KEY",
+    "cloudflare_tunnel": "TEMPLATE_CLOUDFLARE_TUNNEL",
+    "github_deploy_key": "TEMPLATE_GITHUB_DEPLOY_KEY",
+    "github_push_token": "TEMPLATE_GITHUB_PUSH_TOKEN",
+}
+
+# Environment variable pointing to a decrypted SOPS file holding the secrets by name
+SECRETS_FILE_ENV_VAR = "TEMPLATE_SECRETS_FILE"
+
+
+# Parse the age key file into its public and private keys
+def parse_age_key(content: str, origin: str) -> dict[str, str]:
+    public_key = re.search(r"# public key: (age1[\w]+)", content)
+    if not public_key:
+        raise ValueError(f"Could not find public key in {origin}")
+    private_key = re.search(r"(AGE-SECRET-KEY-[\w]+)", content)
+    if not private_key:
+        raise ValueError(f"Could not find private key in {origin}")
+    return {"public": public_key.group(1), "private": private_key.group(1)}
+
+
+# Parse the cloudflare tunnel credentials, which must contain the account, tunnel ID and secret
+def parse_cloudflare_tunnel(content: str, origin: str) -> dict[str, str]:
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        raise ValueError(f"Could not decode JSON: {origin}")
+    for key in ("AccountTag", "TunnelID", "TunnelSecret"):
+        if data.get(key) is None:
+            raise KeyError(f"Missing '{key}' key in {origin}")
+    return data
+
+
+# Parse a plain text secret such as the deploy key or the push token
+def parse_text(content: str, origin: str) -> str:
+    return content.strip()
+
+
+SECRET_PARSERS: dict[str, Callable[[str, str], Any]] = {
+    "age_key": parse_age_key,
+    "cloudflare_tunnel": parse_cloudflare_tunnel,
+    "github_deploy_key": parse_text,
+    "github_push_token": parse_text,
+}
+
+
+# Read secrets from files, by default the ones created by `task init`
+class FileSource:
+    def __init__(self, files: dict[str, str]):
+        self._files = files
+
+    def describe(self, name: str) -> str:
+        return self._files[name]
+
+    def read(self, name: str) -> str | None:
+        path = self._files.get(name)
+        if path is None or not os.path.isfile(path):
+            return None
+        with open(path, "r") as file:
+            return file.read()
+
+
+# Read secrets from environment variables
+class EnvSource:
+    def __init__(self, env_vars: dict[str, str]):
+        self._env_vars = env_vars
+
+    def describe(self, name: str) -> str:
+        return f"environment variable {self._env_vars[name]}"
+
+    def read(self, name: str) -> str | None:
+        env_var = self._env_vars.get(name)
+        return os.environ.get(env_var) if env_var else None
+
+
+# Read secrets from an already decrypted SOPS file (YAML or JSON), for example
+# `sops exec-file secrets.sops.yaml 'TEMPLATE_SECRETS_FILE={} task configure'`
+class SopsFileSource:
+    def __init__(self, path: Path):
+        self._path = path
+        self._data: dict[str, Any] | None = None
+
+    def describe(self, name: str) -> str:
+        return f"key '{name}' of {self._path}"
+
+    def read(self, name: str) -> str | None:
+        if self._data is None:
+            with open(self._path, "r") as file:
+                self._data = yaml.safe_load(file) or {}
+            if "sops" in self._data:
+                raise ValueError(f"SOPS file is still encrypted: {self._path}")
+        value = self._data.get(name)
+        if value is None:
+            return None
+        if isinstance(value, (dict, list)):
+            return json.dumps(value)
+        return str(value)
+
+
+# Load each secret once from the first source that provides it, validate it and serve it from memory
+class SecretStore:
+    def __init__(self, sources: list[FileSource | EnvSource | SopsFileSource]):
+        self._sources = sources
+        self._cache: dict[tuple[str, str | None], tuple[Any, Exception | None]] = {}
+
+    @classmethod
+    def from_environment(cls) -> "SecretStore":
+        sources: list[FileSource | EnvSource | SopsFileSource] = [EnvSource(SECRET_ENV_VARS)]
+        if secrets_file := os.environ.get(SECRETS_FILE_ENV_VAR):
+            sources.append(SopsFileSource(Path(secrets_file)))
+        sources.append(FileSource(SECRET_FILES))
+        return cls(sources)
+
+    def _load(self, name: str, file_path: str | None) -> Any:
+        sources = [FileSource({name: file_path})] if file_path else self._sources
+        for source in sources:
+            content = source.read(name)
+            if content is not None:
+                return SECRET_PARSERS[name](content, source.describe(name))
+        raise FileNotFoundError(f"File not found: {file_path or SECRET_FILES[name]}")
+
+    # Return a parsed secret, optionally read from a specific file instead of the configured sources
+    def get(self, name: str, file_path: str | None = None) -> Any:
+        key = (name, file_path)
+        if key not in self._cache:
+            try:
+                self._cache[key] = (self._load(name, file_path), None)
+            except Exception as e:
+                self._cache[key] = (None, e)
+        value, error = self._cache[key]
+        if error is not None:
+            raise error
+        return value
+
+    # Load and validate every available secret up front; missing secrets only fail when used
+    def validate(self) -> None:
+        for name in SECRET_PARSERS:
+            try:
+                self.get(name)
+            except FileNotFoundError:
+                pass
+
+    # Return a digest of a secret's content, used to detect changes for incremental renders
+    def fingerprint(self, name: str) -> str:
+        try:
+            value = self.get(name)
+        except FileNotFoundError:
+            return "missing"
+        content = json.dumps(value, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(content).hexdigest()
+
+    # Forget all loaded secrets, so they are read again on next use
+    def clear(self) -> None:
+        self._cache.clear()
@@ -0,0 +1,175 @@
+import argparse
+import hashlib
+import json
+import sys
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import yaml
+
+MANIFEST_VERSION = 1
+MANIFEST_FILE = Path(".cache/talos/fingerprints.json")
+# Sections of talconfig.yaml that are resolved per node instead of being shared by every node
+NODE_SECTIONS = ("nodes", "patches", "controlPlane", "worker")
+# Files next to talconfig.yaml that talhelper reads for every node
+SHARED_FILES = ("talenv.yaml", "talsecret.sops.yaml")
+
+
+class NodeFingerprint(NamedTuple):
+    address: str
+    controller: bool
+    fingerprint: str
+
+
+def sha256(value: bytes) -> str:
+    return hashlib.sha256(value).hexdigest()
+
+
+# Return the contents of talhelper patches: inline patches as they are, `@file` references as
+# the content of the file they point to
+def resolve_patches(patches: Any, talos_dir: Path) -> list[str]:
+    resolved = []
+    for patch in patches if isinstance(patches, list) else []:
+        if isinstance(patch, str) and patch.startswith("@"):
+            path = talos_dir / patch[1:]
+            resolved.append(path.read_text() if path.is_file() else f"missing: {patch}")
+        else:
+            resolved.append(json.dumps(patch, sort_keys=True))
+    return resolved
+
+
+# Return a role section (controlPlane or worker) with its patches resolved
+def resolve_section(section: Any, talos_dir: Path) -> dict[str, Any]:
+    if not isinstance(section, dict):
+        return {}
+    return {**section, "patches": resolve_patches(section.get("patches"), talos_dir)}
+
+
+# Return the fingerprint of every node in the rendered talconfig.yaml: a digest of the node's
+# own fields and patches, the global patches, the patches of its role and the cluster-wide
+# settings, which is everything talhelper generates the node's machine config from
+def node_fingerprints(talos_dir: Path) -> dict[str, NodeFingerprint]:
+    talconfig = yaml.safe_load((talos_dir / "talconfig.yaml").read_text()) or {}
+    shared = {
+        "cluster": {k: v for k, v in talconfig.items() if k not in NODE_SECTIONS},
+        "files": {
+            name: sha256((talos_dir / name).read_bytes()) if (talos_dir / name).is_file() else None
+            for name in SHARED_FILES
+        },
+        "patches": resolve_patches(talconfig.get("patches"), talos_dir),
+    }
+    roles = {
+        True: resolve_section(talconfig.get("controlPlane"), talos_dir),
+        False: resolve_section(talconfig.get("worker"), talos_dir),
+    }
+
+    fingerprints = {}
+    for node in talconfig.get("nodes") or []:
+        controller = bool(node.get("controlPlane"))
+        state = {
+            **shared,
+            "role": roles[controller],
+            "node": {**node, "patches": resolve_patches(node.get("patches"), talos_dir)},
+        }
+        fingerprints[str(node.get("hostname"))] = NodeFingerprint(
+            str(node.get("ipAddress")),
+            controller,
+            sha256(json.dumps(state, sort_keys=True, default=str).encode("utf-8")),
+        )
+    return fingerprints
+
+
+def load_manifest(manifest_file: Path) -> dict[str, Any]:
+    try:
+        manifest = json.loads(manifest_file.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return manifest if manifest.get("version") == MANIFEST_VERSION else {}
+
+
+def save_manifest(manifest: dict[str, Any], manifest_file: Path) -> None:
+    manifest_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = manifest_file.with_suffix(".tmp")
+    tmp_file.write_text(json.dumps(manifest, indent=2) + "\n")
+    tmp_file.replace(manifest_file)
+
+
+# Return the manifest with the pending nodes: every node whose fingerprint differs from the
+# one its machine config was last applied with
+def with_pending(nodes: dict[str, dict[str, Any]], changed: list[str]) -> dict[str, Any]:
+    return {
+        "version": MANIFEST_VERSION,
+        "nodes": nodes,
+        "changed": changed,
+        "pending": sorted(
+            name for name, node in nodes.items() if node["applied"] != node["fingerprint"]
+        ),
+    }
+
+
+# Fingerprint the nodes of the rendered talconfig.yaml and write the manifest: `changed` lists
+# the nodes whose machine config changed since the last render, `pending` the nodes whose
+# machine config changed since it was last applied. Nodes are recorded as applied by the
+# talos:apply-node and talos:apply-changed tasks.
+def update_manifest(talos_dir: Path, manifest_file: Path = MANIFEST_FILE) -> dict[str, Any]:
+    previous = load_manifest(manifest_file).get("nodes", {})
+    nodes = {}
+    changed = []
+    for name, node in sorted(node_fingerprints(talos_dir).items()):
+        before = previous.get(name, {})
+        if before.get("fingerprint") != node.fingerprint:
+            changed.append(name)
+        nodes[name] = {
+            "address": node.address,
+            "controller": node.controller,
+            "fingerprint": node.fingerprint,
+            "applied": before.get("applied"),
+        }
+    manifest = with_pending(nodes, changed)
+    save_manifest(manifest, manifest_file)
+    return manifest
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="List the nodes whose Talos machine config changed since it was last applied"
+    )
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        default=MANIFEST_FILE,
+        help=f"fingerprint manifest written by the render (default: {MANIFEST_FILE})",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("pending", help="print the address of every pending node")
+    applied = commands.add_parser("applied", help="record nodes as applied")
+    applied.add_argument("addresses", nargs="*", help="node addresses or hostnames")
+    applied.add_argument("--all", action="store_true", help="record every node as applied")
+    args = parser.parse_args()
+
+    manifest = load_manifest(args.manifest)
+    if not manifest:
+        print(f"No fingerprints in {args.manifest}, run `task configure` first", file=sys.stderr)
+        return 1
+    nodes = manifest["nodes"]
+    if args.command == "pending":
+        for name in manifest["pending"]:
+            print(nodes[name]["address"])
+        return 0
+
+    selected = [
+        name
+        for name, node in nodes.items()
+        if args.all or name in args.addresses or node["address"] in args.addresses
+    ]
+    unknown = set(args.addresses) - {*selected, *(nodes[name]["address"] for name in selected)}
+    for name in selected:
+        nodes[name]["applied"] = nodes[name]["fingerprint"]
+    save_manifest(with_pending(nodes, manifest["changed"]), args.manifest)
+    for address in sorted(unknown):
+        print(f"Unknown node: {address}", file=sys.stderr)
+    return 1 if unknown else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
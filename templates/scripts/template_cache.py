@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+
+import jinja2
+
+CACHE_DIR = Path(".cache/jinja")
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+
+# Return a digest of the environment settings that change the code a template compiles to
+def environment_fingerprint(env: jinja2.Environment) -> str:
+    settings = [
+        jinja2.__version__,
+        sys.version,
+        env.block_start_string,
+        env.block_end_string,
+        env.variable_start_string,
+        env.variable_end_string,
+        env.comment_start_string,
+        env.comment_end_string,
+        env.line_statement_prefix,
+        env.line_comment_prefix,
+        env.trim_blocks,
+        env.lstrip_blocks,
+        env.newline_sequence,
+        env.keep_trailing_newline,
+        env.optimized,
+        env.autoescape,
+        sorted(env.extensions),
+    ]
+    return hashlib.sha256(json.dumps(settings, default=repr).encode("utf-8")).hexdigest()
+
+
+# On-disk cache of compiled templates. Entries are keyed by the template name and the
+# environment fingerprint (delimiters, whitespace options, Jinja and Python version); Jinja
+# itself checks the source checksum stored with each entry and recompiles changed templates.
+# The least recently used entries are evicted once the cache grows beyond max_bytes.
+class TemplateBytecodeCache(jinja2.FileSystemBytecodeCache):
+    def __init__(
+        self,
+        env: jinja2.Environment,
+        directory: Path = CACHE_DIR,
+        max_bytes: int = MAX_CACHE_BYTES,
+    ):
+        directory.mkdir(parents=True, exist_ok=True)
+        super().__init__(str(directory), "%s.cache")
+        self._fingerprint = environment_fingerprint(env)
+        self._max_bytes = max_bytes
+        self.prune()
+
+    def get_cache_key(self, name: str, filename: str | None = None) -> str:
+        key = f"{self._fingerprint}\n{name}\n{filename}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    # Mark entries as used, so eviction removes the ones that have not been loaded for longest
+    def load_bytecode(self, bucket: jinja2.bccache.Bucket) -> None:
+        super().load_bytecode(bucket)
+        if bucket.code is not None:
+            try:
+                os.utime(self._get_cache_filename(bucket))
+            except OSError:
+                pass
+
+    # Remove the least recently used entries until the cache fits in max_bytes
+    def prune(self) -> None:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".cache") and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self._max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
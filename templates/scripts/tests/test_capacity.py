@@ -0,0 +1,73 @@
+import unittest
+
+import yaml
+
+from capacity import GIB, Resources, parse_manifest, plan
+
+# An app-template release with a sidecar and an init container, and operator defaults
+HELM_RELEASE = """
+apiVersion: helm.toolkit.fluxcd.io/v2
+kind: HelmRelease
+metadata:
+  name: cognee
+  namespace: ai-system
+spec:
+  values:
+    controllers:
+      frontend:
+        replicas: 2
+        initContainers:
+          migrate:
+            resources:
+              requests: {cpu: 500m, memory: 128Mi}
+        containers:
+          app:
+            resources:
+              requests: {cpu: 100m, memory: 256Mi}
+              limits: {memory: 512Mi}
+          mcp-sidecar:
+            resources:
+              requests: {cpu: 50m, memory: 256Mi}
+    mcpServerDefaults:
+      resources:
+        requests: {cpu: 100m, memory: 256Mi}
+"""
+
+
+class HelmReleaseWorkloadsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.workloads, _ = parse_manifest(yaml.safe_load(HELM_RELEASE), None)
+        self.by_name = {workload.name: workload for workload in self.workloads}
+
+    def test_containers_of_a_controller_are_one_pod(self) -> None:
+        pod = self.by_name["ai-system/HelmRelease/cognee/controllers/frontend"]
+        self.assertEqual(pod.replicas, 2)
+        # The init container runs alone first, so its CPU is the larger request of the pod
+        self.assertAlmostEqual(pod.requests.cpu, 0.5)
+        self.assertEqual(pod.requests.memory, 512 * 2**20)
+        self.assertEqual(pod.limits.memory, 512 * 2**20)
+        self.assertFalse(pod.unattributed)
+
+    def test_defaults_are_unattributed(self) -> None:
+        defaults = self.by_name["ai-system/HelmRelease/cognee/mcpServerDefaults"]
+        self.assertTrue(defaults.unattributed)
+        self.assertEqual(len(self.workloads), 2)
+
+    def test_unattributed_workloads_are_not_scheduled(self) -> None:
+        context = {"nodes": [{"name": "k8s-0", "controller": False}]}
+        report = plan(context, self.workloads, [], Resources(4, 16 * GIB))
+        self.assertEqual(
+            report["nodes"]["k8s-0"]["pods"],
+            [
+                "ai-system/HelmRelease/cognee/controllers/frontend[0]",
+                "ai-system/HelmRelease/cognee/controllers/frontend[1]",
+            ],
+        )
+        self.assertEqual(
+            list(report["unattributed"]), ["ai-system/HelmRelease/cognee/mcpServerDefaults"]
+        )
+        self.assertEqual(report["cluster"]["cpu_requested"], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+from typing import Any
+
+import yaml
+
+from netpol import (
+    NAMESPACE_LABEL,
+    Entry,
+    Policy,
+    analyze,
+    compacted_policies,
+    covers,
+    parse_cilium_policy,
+    parse_k8s_policy,
+)
+
+# The egress of the CloudNativePG operator to the PostgreSQL instances in every namespace
+CNPG_POLICY = """
+apiVersion: networking.k8s.io/v1
+kind: NetworkPolicy
+metadata:
+  name: cloudnative-pg
+  namespace: cnpg-system
+spec:
+  podSelector:
+    matchLabels:
+      app.kubernetes.io/name: cloudnative-pg
+  policyTypes: [Egress]
+  egress:
+    - to:
+        - namespaceSelector: {}
+          podSelector:
+            matchLabels:
+              cnpg.io/podRole: instance
+      ports:
+        - protocol: TCP
+          port: 8000
+        - protocol: TCP
+          port: 5432
+    - to:
+        - namespaceSelector:
+            matchLabels:
+              team: data
+      ports:
+        - protocol: TCP
+          port: 9187
+"""
+
+
+def parse(document: str) -> Policy:
+    return parse_k8s_policy(
+        "NetworkPolicy/cnpg-system/cloudnative-pg",
+        "networkpolicy.yaml",
+        "cnpg-system",
+        yaml.safe_load(document),
+    )
+
+
+def emit(policy: Policy) -> list[dict[str, Any]]:
+    return compacted_policies([policy], analyze([policy]).kept)["cnpg-system"]
+
+
+def reparse(document: dict[str, Any]) -> list[Entry]:
+    return parse_cilium_policy("emitted", "emitted.yaml", "cnpg-system", document["spec"]).entries
+
+
+class CompactedNamespaceSelectorTest(unittest.TestCase):
+    def test_empty_namespace_selector_matches_every_namespace(self) -> None:
+        [document] = emit(parse(CNPG_POLICY))
+        selectors = [
+            selector for rule in document["spec"]["egress"] for selector in rule["toEndpoints"]
+        ]
+        self.assertIn(
+            {
+                "matchLabels": {"cnpg.io/podRole": "instance"},
+                "matchExpressions": [{"key": NAMESPACE_LABEL, "operator": "Exists"}],
+            },
+            selectors,
+        )
+
+    def test_emitted_policy_allows_the_same_traffic(self) -> None:
+        policy = parse(CNPG_POLICY)
+        [document] = emit(policy)
+        emitted = reparse(document)
+        for entry in policy.entries:
+            self.assertTrue(any(covers(other, entry) for other in emitted), entry)
+        for entry in emitted:
+            self.assertTrue(any(covers(other, entry) for other in policy.entries), entry)
+
+    def test_pod_selector_stays_in_the_policy_namespace(self) -> None:
+        policy = parse(
+            CNPG_POLICY.replace("        - namespaceSelector: {}\n          pod", "        - pod")
+        )
+        [document] = emit(policy)
+        selectors = [
+            selector for rule in document["spec"]["egress"] for selector in rule["toEndpoints"]
+        ]
+        self.assertIn(
+            {"matchLabels": {NAMESPACE_LABEL: "cnpg-system", "cnpg.io/podRole": "instance"}},
+            selectors,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
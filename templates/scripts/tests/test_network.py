@@ -0,0 +1,46 @@
+import unittest
+
+from network import NetworkModel
+
+DATA = {
+    "node_cidr": "10.10.10.0/24",
+    "cluster_api_addr": "10.10.10.254",
+    "nodes": [{"name": "k8s-0", "address": "10.10.10.100"}],
+}
+
+
+class AllocateTest(unittest.TestCase):
+    def test_address_depends_only_on_the_owner(self) -> None:
+        first, second = NetworkModel(DATA), NetworkModel(DATA)
+        addresses = [first.allocate(owner) for owner in ("a", "b", "c")]
+        self.assertEqual([second.allocate(owner) for owner in ("c", "b", "a")], addresses[::-1])
+        self.assertEqual(first.allocate("a"), addresses[0])
+
+    def test_addresses_in_use_are_skipped(self) -> None:
+        # Hosts 1 to 5 of the /29 are the default gateway and nodes, host 6 is the only free one
+        nodes = [{"name": f"k8s-{host}", "address": f"10.10.10.{host}"} for host in range(2, 6)]
+        for owner in ("a", "b", "c", "d"):
+            model = NetworkModel({"node_cidr": "10.10.10.0/29", "nodes": nodes})
+            self.assertEqual(model.allocate(owner), "10.10.10.6")
+
+    def test_pinned_index(self) -> None:
+        model = NetworkModel(DATA)
+        self.assertEqual(model.allocate("postgres", index=50), "10.10.10.50")
+        self.assertEqual(model.allocate("postgres", "pod", index=5), "10.42.0.5")
+        with self.assertRaisesRegex(ValueError, "used by nodes"):
+            model.allocate("api", index=100)
+        with self.assertRaisesRegex(ValueError, "no host 255"):
+            model.allocate("broadcast", index=255)
+        with self.assertRaisesRegex(ValueError, "also allocated to 'postgres'"):
+            model.allocate("other", index=50)
+
+    def test_collision_asks_to_pin(self) -> None:
+        model = NetworkModel({"node_cidr": "10.10.10.0/30"})
+        # The only free host of a /30 next to the default gateway
+        self.assertEqual(model.allocate("a"), "10.10.10.2")
+        with self.assertRaisesRegex(ValueError, "pin one of them"):
+            model.allocate("b")
+
+
+if __name__ == "__main__":
+    unittest.main()
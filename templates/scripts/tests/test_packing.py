@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+
+import yaml
+
+from packing import minify_json, minify_yaml
+
+SCRIPTS_DIR = Path(__file__).resolve().parents[1]
+
+
+class MinifyYamlTest(unittest.TestCase):
+    def test_round_trips_yaml_types(self) -> None:
+        sources = [
+            "a: 2024-01-01\n",
+            "created: 2024-01-01T10:00:00Z\n",
+            "key: !!binary aGVsbG8=\n",
+            "hosts: !!set {a, b}\n",
+            "text: |\n  multi\n  line\nquoted: 'yes'\nempty: null\n",
+            "- 1\n- {a: [1.5, true, ünï]}\n",
+        ]
+        for source in sources:
+            with self.subTest(source):
+                minified = minify_yaml(source)
+                self.assertEqual(minified.count("\n"), 1)
+                self.assertEqual(yaml.safe_load(minified), yaml.safe_load(source))
+
+    def test_keeps_trailing_newline_of_the_block(self) -> None:
+        self.assertEqual(minify_yaml("a: 1\nb: [x, y]\n"), "{a: 1, b: [x, y]}\n")
+        self.assertEqual(minify_yaml("a: 1"), "{a: 1}")
+        self.assertEqual(minify_yaml("plain"), "plain")
+
+    def test_sets_do_not_depend_on_the_hash_seed(self) -> None:
+        code = "from packing import minify_yaml; print(minify_yaml('s: !!set {d, c, b, a}'))"
+        outputs = {
+            subprocess.run(
+                [sys.executable, "-c", code],
+                cwd=SCRIPTS_DIR,
+                env={**os.environ, "PYTHONHASHSEED": seed},
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            for seed in ("1", "2", "3")
+        }
+        self.assertEqual(outputs, {"{s: !!set {a: null, b: null, c: null, d: null}}\n"})
+
+
+class MinifyJsonTest(unittest.TestCase):
+    def test_dedupe_drops_repeated_panels(self) -> None:
+        panel = '{"id": 1, "datasource": "ds", "targets": [{"datasource": "ds", "expr": "up"}]}'
+        minified = minify_json(f'{{"panels": [{panel}, {panel}]}}\n', dedupe=True)
+        self.assertEqual(
+            minified, '{"panels":[{"id":1,"datasource":"ds","targets":[{"expr":"up"}]}]}\n'
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
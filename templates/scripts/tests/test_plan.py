@@ -0,0 +1,72 @@
+import contextlib
+import io
+import tempfile
+import unittest
+from pathlib import Path
+
+from plan import plan, print_plan
+from render import OutputFile
+
+SECRET = b"""\
+apiVersion: v1
+kind: Secret
+metadata:
+  name: app
+  namespace: default
+stringData:
+  username: admin
+"""
+
+
+def render_plan(files: dict[str, tuple[bytes | None, bytes]]) -> str:
+    with tempfile.TemporaryDirectory() as output:
+        rendered = []
+        for name, (existing, data) in files.items():
+            if existing is not None:
+                (Path(output) / name).write_bytes(existing)
+            rendered.append(OutputFile(Path(name), data, Path(name)))
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            print_plan(plan(rendered, Path(output), {}))
+    return stdout.getvalue()
+
+
+class SensitiveValuesTest(unittest.TestCase):
+    def test_added_nested_map_in_secret_is_masked(self) -> None:
+        output = render_plan(
+            {
+                "secret.yaml": (
+                    SECRET,
+                    SECRET + b"  nested:\n    password: hunter2\n    tokens: [abc, def]\n",
+                )
+            }
+        )
+        self.assertNotIn("hunter2", output)
+        self.assertNotIn("abc", output)
+        self.assertIn(
+            '+ stringData.nested: {"password": "(sensitive)", '
+            '"tokens": ["(sensitive)", "(sensitive)"]}',
+            output,
+        )
+
+    def test_added_map_in_sops_file_is_masked(self) -> None:
+        output = render_plan(
+            {
+                "app.sops.yaml": (
+                    b"config:\n  mode: a\n",
+                    b"config:\n  mode: a\n  credentials:\n    key: s3cr3t\n",
+                )
+            }
+        )
+        self.assertNotIn("s3cr3t", output)
+        self.assertIn('+ config.credentials: {"key": "(sensitive)"}', output)
+
+    def test_other_documents_are_shown(self) -> None:
+        output = render_plan(
+            {"config.yaml": (b"data:\n  a: 1\n", b"data:\n  a: 1\n  b: {c: visible}\n")}
+        )
+        self.assertIn('+ data.b: {"c": "visible"}', output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import copy
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Any
+
+import yaml
+
+from schema import SCHEMA_DIR, Parser, UnsupportedSchema, cue_vet, load_schema
+
+ROOT = Path(__file__).resolve().parents[3]
+FIXTURES = ROOT / ".github/tests"
+
+
+def load(name: str) -> dict[str, Any]:
+    return yaml.safe_load((FIXTURES / name).read_text())
+
+
+def changed(data: dict[str, Any], **changes: Any) -> dict[str, Any]:
+    data = copy.deepcopy(data)
+    for key, value in changes.items():
+        if value is None:
+            data.pop(key, None)
+        else:
+            data[key] = value
+    return data
+
+
+def node_changed(**changes: Any) -> dict[str, Any]:
+    nodes = copy.deepcopy(load("nodes.yaml"))
+    nodes["nodes"][0].update(changes)
+    return nodes
+
+
+# Data files with the verdict of `cue vet` against the schema of their kind
+def cases() -> list[tuple[str, str, dict[str, Any], bool]]:
+    public = load("public.yaml")
+    nodes = load("nodes.yaml")
+    duplicate = copy.deepcopy(nodes)
+    duplicate["nodes"][1]["name"] = duplicate["nodes"][0]["name"]
+    return [
+        ("public.yaml", "cluster.schema.cue", public, True),
+        ("private.yaml", "cluster.schema.cue", load("private.yaml"), True),
+        ("nodes.yaml", "nodes.schema.cue", nodes, True),
+        # Go's net.ParseCIDR accepts host bits
+        ("host bits", "cluster.schema.cue", changed(public, node_cidr="10.10.10.5/24"), True),
+        ("no prefix", "cluster.schema.cue", changed(public, node_cidr="10.10.10.0"), False),
+        ("bad cidr", "cluster.schema.cue", changed(public, node_cidr="10.10.10.0/33"), False),
+        (
+            "same cidr",
+            "cluster.schema.cue",
+            changed(public, cluster_pod_cidr="10.10.10.0/24"),
+            False,
+        ),
+        (
+            "default cidr",
+            "cluster.schema.cue",
+            changed(public, node_cidr="10.42.0.0/16", cluster_pod_cidr=None),
+            False,
+        ),
+        ("unknown field", "cluster.schema.cue", changed(public, unknown_field=True), False),
+        ("missing field", "cluster.schema.cue", changed(public, cluster_api_addr=None), False),
+        ("ipv6 address", "cluster.schema.cue", changed(public, cluster_api_addr="fd00::1"), False),
+        ("no domains", "cluster.schema.cue", changed(public, cloudflare_domains=[]), False),
+        ("duplicate names", "nodes.schema.cue", duplicate, False),
+        ("reserved name", "nodes.schema.cue", node_changed(name="global"), False),
+        ("mtu range", "nodes.schema.cue", node_changed(mtu=1400), False),
+        ("mtu type", "nodes.schema.cue", node_changed(mtu="1500"), False),
+        ("bad mac", "nodes.schema.cue", node_changed(mac_addr="00:00:00:00:00"), False),
+    ]
+
+
+class SchemaVerdictTest(unittest.TestCase):
+    def setUp(self) -> None:
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = Path(cache_dir.name)
+
+    def test_verdicts(self) -> None:
+        for name, schema_file, data, valid in cases():
+            with self.subTest(name):
+                schema = load_schema(ROOT / SCHEMA_DIR / schema_file, self.cache_dir)
+                self.assertEqual(schema.validate(data) == [], valid, schema.validate(data))
+
+    @unittest.skipUnless(shutil.which("cue"), "cue is not installed")
+    def test_verdicts_match_cue_vet(self) -> None:
+        for name, schema_file, data, valid in cases():
+            with self.subTest(name):
+                self.assertEqual(cue_vet(data, ROOT / SCHEMA_DIR / schema_file) == [], valid)
+
+
+class UnsupportedSchemaTest(unittest.TestCase):
+    def test_unsupported_constructs_are_rejected(self) -> None:
+        sources = {
+            "unresolved reference": "#C: {a: #Other}\n#C\n",
+            "unknown builtin": 'import "strings"\n#C: {a: strings.MinRunes(1)}\n#C\n',
+            "interpolation": '#C: {a: "x\\(b)", b: string}\n#C\n',
+            "bottom": "#C: {a: _|_}\n#C\n",
+            "open struct": "#C: {a: string, ...}\n#C\n",
+            "nested definition": "#C: {#D: string, a: #D}\n#C\n",
+        }
+        for name, source in sources.items():
+            with self.subTest(name), self.assertRaises(UnsupportedSchema):
+                Parser(source, "test.cue").parse()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+import argparse
+import os
+import stat
+import time
+import traceback
+from pathlib import Path
+
+import attrs
+from makejinja import app
+from makejinja.config import Config
+
+from render import collect_jobs, init_environment, load_config, render_jobs
+from schema import SchemaError, UnsupportedSchema
+from secret_sources import SECRET_FILES, SECRETS_FILE_ENV_VAR
+
+# Modification time and size of every watched file
+Snapshot = dict[Path, tuple[int, int]]
+
+
+def log(message: str) -> None:
+    print(message, flush=True)
+
+
+# Return the watched paths: the data files, the template inputs and the secret files
+def watched_paths(config: Config) -> list[Path]:
+    paths = [*config.data, *config.inputs, *map(Path, SECRET_FILES.values())]
+    if secrets_file := os.environ.get(SECRETS_FILE_ENV_VAR):
+        paths.append(Path(secrets_file))
+    return paths
+
+
+# Return the modification time and size of every file below the given paths
+def snapshot(paths: list[Path]) -> Snapshot:
+    files: Snapshot = {}
+    for path in paths:
+        for file in path.rglob("*") if path.is_dir() else [path]:
+            try:
+                info = file.stat()
+            except OSError:
+                continue
+            if stat.S_ISREG(info.st_mode):
+                files[file] = (info.st_mtime_ns, info.st_size)
+    return files
+
+
+# Return the files that were added, changed or removed between two snapshots
+def changed_files(previous: Snapshot, current: Snapshot) -> set[Path]:
+    return {
+        path
+        for path in previous.keys() | current.keys()
+        if previous.get(path) != current.get(path)
+    }
+
+
+# Keeps the Jinja environment with the compiled templates, the plugin and its resolved data in
+# memory between render passes. Every pass goes through the incremental render, so only the
+# outputs affected by a change are rendered again.
+class Watcher:
+    def __init__(self, config: Config, workers: int):
+        self._config = config
+        self._workers = workers
+        self._env, self._plugins = init_environment(config)
+        # Only rendered files are logged, not every skipped path and directory
+        self._walk_config = attrs.evolve(config, quiet=True)
+
+    # Render the templates that changed since the last pass, returning how many were rendered
+    def render(self) -> int:
+        jobs, rendered_dirs = collect_jobs(self._walk_config, self._plugins)
+        try:
+            render_jobs(self._config, self._env, jobs, self._workers)
+            app.postprocess_rendered_dirs(self._walk_config, rendered_dirs)
+        finally:
+            for plugin in self._plugins:
+                if hasattr(plugin, "save"):
+                    plugin.save()
+        return len(jobs)
+
+    # Prepare the next pass, reloading cluster.yaml and nodes.yaml if one of them changed
+    def reload(self, changed: set[Path]) -> None:
+        data_changed = any(
+            path.is_relative_to(data_path) for path in changed for data_path in self._config.data
+        )
+        data = app.load_data(self._config) if data_changed else None
+        for plugin in self._plugins:
+            if hasattr(plugin, "reload"):
+                plugin.reload(data)
+
+
+# Render once, then render again whenever a watched file changes, until interrupted
+def watch(config: Config, workers: int, interval: float) -> None:
+    paths = watched_paths(config)
+    previous = snapshot(paths)
+    watcher = Watcher(config, workers)
+    changed: set[Path] | None = None
+
+    while True:
+        start = time.perf_counter()
+        # Changes of a failed pass are handled again with the next change, e.g. a data file
+        # that did not parse is reloaded even when the fix is in a template
+        failed: set[Path] = set()
+        try:
+            if changed is not None:
+                watcher.reload(changed)
+            rendered = watcher.render()
+        except Exception as e:
+            if isinstance(e, (SchemaError, UnsupportedSchema)):
+                log(str(e))
+            else:
+                traceback.print_exc()
+            log("=== Render failed, waiting for the next change ===")
+            failed = changed or set()
+        else:
+            log(f"=== Rendered {rendered} files in {time.perf_counter() - start:.2f}s ===")
+
+        changed = set()
+        while not changed:
+            time.sleep(interval)
+            current = snapshot(paths)
+            changed = changed_files(previous, current)
+            previous = current
+        names = sorted(map(str, changed))
+        log(f"=== Changed {', '.join(names[:5])}{' ...' if len(names) > 5 else ''} ===")
+        changed |= failed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Render the templates, then render the affected outputs again on every change"
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0.2,
+        help="seconds between checks for changed files (default: 0.2)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="number of worker processes (default: 1)"
+    )
+    parser.add_argument(
+        "--config", type=Path, default=Path("makejinja.toml"), help="makejinja config file"
+    )
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    if app.single_input_output_file(config):
+        parser.error("rendering a single input file is not supported, use makejinja")
+
+    # Compiled templates stay in memory and are only reloaded when their source changed
+    config = attrs.evolve(
+        config, internal=attrs.evolve(config.internal, cache_size=-1, auto_reload=True)
+    )
+    # Every pass after the first only renders what changed
+    os.environ["TEMPLATE_INCREMENTAL"] = "1"
+
+    log(f"=== Watching {', '.join(map(str, watched_paths(config)))} ===")
+    try:
+        watch(config, args.workers, args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()